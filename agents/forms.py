@@ -15,3 +15,20 @@ class AgentModelForm(forms.ModelForm):
             'last_name',
             )
 
+
+class AgentInviteForm(AgentModelForm):
+    """One row of a bulk invite; usernames are checked for the whole file at once."""
+    email = forms.EmailField()
+
+    def validate_unique(self):
+        pass
+
+
+class AgentImportForm(forms.Form):
+    FORMAT_CHOICES = (
+        ('', 'Detect from file name'),
+        ('csv', 'CSV'),
+        ('jsonl', 'JSON Lines'),
+    )
+    file = forms.FileField(help_text='Columns: email, username, first_name, last_name.')
+    format = forms.ChoiceField(choices=FORMAT_CHOICES, required=False)
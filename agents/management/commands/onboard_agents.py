@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from agents.onboarding import AgentOnboarding
+from leads.importers import FORMATS, detect_format, open_text
+from leads.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = "Invite the agents of a CSV or JSON Lines file (email, username, first_name, last_name) into an organization."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--organization', required=True, help="Username of the organizer.")
+        parser.add_argument('--format', choices=FORMATS, help="Detected from the file extension by default.")
+        parser.add_argument('--workers', type=int, help="Password hashing processes; one per CPU by default.")
+
+    def handle(self, *args, **options):
+        try:
+            organization = UserProfile.objects.get(user__username=options['organization'])
+        except UserProfile.DoesNotExist:
+            raise CommandError(f"No organization for user {options['organization']!r}.")
+
+        onboarding = AgentOnboarding(organization, workers=options['workers'])
+        format = options['format'] or detect_format(options['path'])
+        start = time.perf_counter()
+        with open(options['path'], 'rb') as binary_file:
+            result = onboarding.run(open_text(binary_file), format)
+
+        for line_number, message in result.errors:
+            self.stderr.write(f"Line {line_number}: {message}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Invited {result.created} agents, rejected {result.rejected} of {result.processed} rows "
+            f"in {time.perf_counter() - start:.1f}s."
+        ))
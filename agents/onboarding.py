@@ -0,0 +1,159 @@
+"""
+Bulk agent onboarding.
+
+Creating agents one by one costs a PBKDF2 hash, the UserProfile signal
+insert, the Agent insert and the invite mail per agent. AgentOnboarding
+validates a whole file first, hashes the passwords in a process pool and
+then writes users, profiles, agents and queued invites with one
+bulk_create each, in a single transaction.
+"""
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError
+
+from leads.choices import invalidate_agent_choices
+from leads.freshness import touch_organization
+from leads.importers import ImportResult, UndecodableLine, read_rows
+from leads.mail import queue_mass_mail
+from leads.models import Agent, User, UserProfile, organization_shard
+from leads.sharding import shard_atomic
+
+from .forms import AgentInviteForm
+
+INVITE_SUBJECT = "You are invited to be an Agent"
+INVITE_MESSAGE = (
+    "Your account has been created in the CRM system as an agent.\n"
+    "Please login to start working.\n\nThank you,\nCRM Admin Team"
+)
+INVITE_FROM_EMAIL = 'admin@crm.com'
+
+
+def random_password():
+    return f"{random.randint(0, 1000000)}"
+
+
+def hash_passwords(passwords, workers=None):
+    """
+    make_password() for every password, spread over `workers` processes
+    (one per CPU by default). A single password is hashed in process.
+    """
+    workers = workers or os.cpu_count()
+    if len(passwords) <= 1 or workers == 1:
+        return [make_password(password) for password in passwords]
+    chunksize = max(1, len(passwords) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+        return list(pool.map(make_password, passwords, chunksize=chunksize))
+
+
+class AgentOnboarding:
+    """
+    Invite the agents of a CSV or JSON Lines file into an organization.
+    Rows are validated with the agent form; rows whose username is taken,
+    in the database or earlier in the file, are rejected. Valid rows are
+    only written if the whole file was read, i.e. it is UTF-8 throughout.
+    """
+
+    def __init__(self, organization, workers=None, max_errors=100):
+        self.organization = organization
+        self.workers = workers or settings.AGENT_ONBOARDING_WORKERS
+        self.max_errors = max_errors
+
+    def run(self, stream, format):
+        result = ImportResult(self.max_errors)
+        users = []
+        lines = {}
+        complete = True
+        for line_number, row in read_rows(stream, format):
+            result.processed += 1
+            if isinstance(row, UndecodableLine):
+                complete = False
+            user, error = self.build_user(row)
+            if error is None and user.username in lines:
+                error = f"username: Duplicate of line {lines[user.username]}."
+            if error:
+                result.reject(line_number, error)
+                continue
+            lines[user.username] = line_number
+            users.append(user)
+        if not complete:
+            return result
+
+        users = self.save(self.reject_taken(users, lines, result), lines, result)
+        result.created = len(users)
+        return result
+
+    def build_user(self, row):
+        if isinstance(row, UndecodableLine):
+            return None, f"{row} No agents were invited."
+        if not isinstance(row, dict):
+            return None, f"Invalid row: {row}"
+        row = {key.strip().lower(): value for key, value in row.items() if key}
+        form = AgentInviteForm(data=row)
+        if not form.is_valid():
+            return None, "; ".join(
+                f"{field}: {' '.join(messages)}" for field, messages in form.errors.items()
+            )
+        user = form.save(commit=False)
+        user.is_agent = True
+        user.is_organizor = False
+        return user, None
+
+    def reject_taken(self, users, lines, result):
+        """Reject the users whose username exists in the database; returns the others."""
+        taken = set(
+            User.objects.filter(username__in=[user.username for user in users])
+            .values_list('username', flat=True)
+        )
+        if not taken:
+            return users
+        for user in users:
+            if user.username in taken:
+                result.reject(lines[user.username], "username: A user with that username already exists.")
+        result.errors.sort()
+        return [user for user in users if user.username not in taken]
+
+    def save(self, users, lines, result):
+        """
+        Write `users` and their profiles, agents and invites. Usernames taken
+        while the passwords were being hashed, e.g. by a signup, are checked
+        again in the transaction and rejected. Returns the users written.
+        """
+        if not users:
+            return users
+        passwords = hash_passwords([random_password() for _ in users], self.workers)
+        for user, password in zip(users, passwords):
+            user.password = password
+        while users:
+            try:
+                with shard_atomic(self.organization):
+                    users = self.reject_taken(users, lines, result)
+                    self.insert(users)
+                return users
+            except IntegrityError:
+                # a username was taken after the check; retry without it
+                remaining = self.reject_taken(users, lines, result)
+                if len(remaining) == len(users):
+                    raise
+                users = remaining
+        return users
+
+    def insert(self, users):
+        if not users:
+            return
+        # bulk_create skips post_user_create_signal, so the profiles
+        # every user gets are created here as well
+        User.objects.bulk_create(users)
+        # SQLite doesn't return the ids of bulk inserted rows
+        ids = list(User.objects.filter(username__in=[user.username for user in users]).values_list('id', flat=True))
+        UserProfile.objects.bulk_create([UserProfile(user_id=user_id) for user_id in ids])
+        Agent.objects.using(organization_shard(self.organization)).bulk_create([Agent(user_id=user_id, organization=self.organization) for user_id in ids])
+        queue_mass_mail(
+            (INVITE_SUBJECT, INVITE_MESSAGE, INVITE_FROM_EMAIL, [user.email]) for user in users
+        )
+        invalidate_agent_choices(self.organization.pk)
+        touch_organization(self.organization.pk)
@@ -1,3 +1,102 @@
-from django.test import TestCase
+import io
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from leads.models import Agent, Category, Lead, User
+from leads.testing import TestCase, create_agent, create_organizer
+
+from .onboarding import AgentOnboarding
+
+
+class AgentOnboardingTests(TestCase):
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+
+    def onboard(self, content):
+        return AgentOnboarding(self.organization, workers=1).run(io.StringIO(content), 'csv')
+
+    def test_taken_and_duplicate_usernames_are_rejected(self):
+        User.objects.create_user(username='taken', email='taken@example.com')
+        result = self.onboard(
+            "email,username,first_name,last_name\n"
+            "a@example.com,ann,Ann,Lee\n"
+            "b@example.com,taken,Bob,Ray\n"
+            "c@example.com,ann,Cat,Doe\n"
+        )
+        self.assertEqual((result.created, result.rejected), (1, 2))
+        self.assertEqual([line for line, message in result.errors], [3, 4])
+        agent = Agent.objects.get(organization=self.organization)
+        self.assertEqual(agent.user.username, 'ann')
+        self.assertTrue(agent.user.userprofile)
+
+    def test_username_taken_while_hashing_is_rejected(self):
+        onboarding = AgentOnboarding(self.organization, workers=1)
+        result = onboarding.run(io.StringIO("email,username,first_name,last_name\n"), 'csv')
+        users = [
+            onboarding.build_user({'email': f'{name}@example.com', 'username': name, 'first_name': name, 'last_name': name})[0]
+            for name in ('ann', 'bob')
+        ]
+        # a signup takes "bob" between run's check and the insert
+        User.objects.create_user(username='bob', email='bob@example.com')
+        saved = onboarding.save(users, {'ann': 2, 'bob': 3}, result)
+        self.assertEqual([user.username for user in saved], ['ann'])
+        self.assertEqual(result.errors, [(3, "username: A user with that username already exists.")])
+        self.assertEqual(
+            list(Agent.objects.filter(organization=self.organization).values_list('user__username', flat=True)),
+            ['ann'],
+        )
+
+
+class AgentImportViewTests(TestCase):
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+        self.client.force_login(self.user)
+
+    def test_non_utf8_file_invites_nobody(self):
+        content = "email,username,first_name,last_name\na@example.com,ann,Ann,Lee\nj@example.com,jose,José,Müller\n"
+        response = self.client.post('/agents/import/', {'file': SimpleUploadedFile('agents.csv', content.encode('latin-1'))})
+        self.assertEqual(response.status_code, 200)
+        result = response.context['result']
+        self.assertEqual(result.created, 0)
+        self.assertEqual(result.errors[0][0], 3)
+        self.assertContains(response, "Not UTF-8 text")
+        self.assertFalse(Agent.objects.exists())
+
+
+class AgentWorkloadViewTests(TestCase):
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+        self.agent = create_agent(self.organization)
+        self.category = Category.objects.create(name='Contacted', organization=self.organization)
+        for category in (self.category, self.category, None):
+            Lead.objects.create(
+                first_name='Ann', last_name='Lee', age=30, agent=self.agent, category=category,
+                organization=self.organization,
+            )
+        Lead.objects.create(first_name='Bob', last_name='Ray', age=40, organization=self.organization)
+        self.client.force_login(self.user)
+
+    def test_counts_per_agent_and_category(self):
+        response = self.client.get('/agents/workload/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row['label'], row['counts'], row['total']) for row in response.context['agent_rows']],
+            [('agent@example.com', [2, 1], 3)],
+        )
+        self.assertEqual(response.context['unassigned_row']['counts'], [0, 1])
+        self.assertEqual(response.context['column_totals'], [2, 2])
+        self.assertEqual(response.context['lead_total'], 4)
+
+    def test_summary_reads_no_leads(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/agents/workload/')
+        self.assertFalse([query['sql'] for query in queries if 'FROM "leads_lead"' in query['sql']])
+
+    def test_agents_are_turned_away(self):
+        self.client.force_login(self.agent.user)
+        self.assertEqual(self.client.get('/agents/workload/').status_code, 302)
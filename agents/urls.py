@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import AgentListView, AgentCreateView, AgentDetailView, AgentUpdateView, AgentDeleteView
+from .views import AgentListView, AgentCreateView, AgentDetailView, AgentUpdateView, AgentDeleteView, AgentImportView, AgentWorkloadView
 
 
 app_name = 'agents'
@@ -7,6 +7,8 @@ app_name = 'agents'
 urlpatterns = [
     path('', AgentListView.as_view(), name='agent-list'),    
     path('create/', AgentCreateView.as_view(), name='agent-create'),    
+    path('import/', AgentImportView.as_view(), name='agent-import'),
+    path('workload/', AgentWorkloadView.as_view(), name='agent-workload'),
     path('<int:pk>/', AgentDetailView.as_view(), name='agent-detail'),
     path('<int:pk>/update/', AgentUpdateView.as_view(), name='agent-update'),
     path('<int:pk>/delete/', AgentDeleteView.as_view(), name='agent-delete'), 
@@ -1,18 +1,25 @@
-import random
+from django.conf import settings
 from django.views import generic
 from django.shortcuts import reverse
+from django.http import Http404, HttpResponseRedirect
 from django.contrib.auth.mixins import LoginRequiredMixin
-from leads.models import Agent
-from .forms import AgentModelForm
+from leads.models import Agent, Category
+from leads.sharding import shard_atomic
+from leads.choices import agent_choices
+from leads.deletion import enqueue_agent_deletion
+from .forms import AgentModelForm, AgentImportForm
 from .mixins import OrganizerAndLoginRequiredMixin
-from django.core.mail import send_mail
+from leads.freshness import FragmentCacheMixin
+from leads.importers import detect_format, open_text
+from leads.mail import queue_mail
+from leads.workload import workload_cells, workload_table
+from .onboarding import AgentOnboarding, INVITE_FROM_EMAIL, INVITE_MESSAGE, INVITE_SUBJECT, random_password
 
-class AgentListView(OrganizerAndLoginRequiredMixin, generic.ListView):
+class AgentListView(OrganizerAndLoginRequiredMixin, FragmentCacheMixin, generic.ListView):
     template_name = "agents/agent_list.html"
 
     def get_queryset(self):
-        organization = self.request.user.userprofile
-        return Agent.objects.filter(organization=organization)
+        return Agent.objects.for_tenant(self.request.tenant).with_user()
 
 
 class AgentCreateView(OrganizerAndLoginRequiredMixin, generic.CreateView):
@@ -27,30 +34,65 @@ class AgentCreateView(OrganizerAndLoginRequiredMixin, generic.CreateView):
         user = form.save(commit=False)
         user.is_agent = True
         user.is_organizor = False
-        user.set_password(f"{random.randint(0,1000000)}")
-        user.save()
-        Agent.objects.create(
-            user=user,
-            organization=self.request.user.userprofile
-        )
-        send_mail(
-            subject="You are invited to be an Agent",
-            message="Your account has been created in the CRM system as an agent.\nPlease login to start working.\n\nThank you,\nCRM Admin Team",
-            from_email='admin@crm.com', 
-            recipient_list=[user.email]
-        )
+        user.set_password(random_password())
+        with shard_atomic(self.request.tenant.organization):
+            user.save()
+            Agent.objects.create(
+                user=user,
+                organization=self.request.tenant.organization
+            )
+            queue_mail(
+                subject=INVITE_SUBJECT,
+                message=INVITE_MESSAGE,
+                from_email=INVITE_FROM_EMAIL,
+                recipient_list=[user.email]
+            )
         #agent.organization = self.request.user.userprofile
         #agent.save()
         return super(AgentCreateView, self).form_valid(form)
 
 
+class AgentImportView(OrganizerAndLoginRequiredMixin, generic.FormView):
+    template_name = "agents/agent_import.html"
+    form_class = AgentImportForm
+
+    def form_valid(self, form):
+        upload = form.cleaned_data["file"]
+        format = form.cleaned_data["format"] or detect_format(upload.name)
+        onboarding = AgentOnboarding(self.request.tenant.organization)
+        upload.open()
+        result = onboarding.run(open_text(upload.file), format)
+        return self.render_to_response(self.get_context_data(form=self.form_class(), result=result))
+
+
+class AgentWorkloadView(OrganizerAndLoginRequiredMixin, generic.TemplateView):
+    template_name = "agents/agent_workload.html"
+
+    def get_context_data(self, **kwargs):
+        context = super(AgentWorkloadView, self).get_context_data(**kwargs)
+        organization = self.request.tenant.organization
+        if organization is None:
+            raise Http404
+        # one read of at most agents x categories cells, whatever the number of leads
+        cells = workload_cells(organization, use_summary=settings.LEAD_WORKLOAD_SUMMARY)
+        categories = list(Category.objects.for_organization(organization).order_by('id'))
+        rows, totals = workload_table(cells, agent_choices(organization.pk), categories)
+        context.update({
+            "categories": categories,
+            "agent_rows": rows[:-1],
+            "unassigned_row": rows[-1],
+            "column_totals": totals,
+            "lead_total": sum(totals),
+        })
+        return context
+
+
 class AgentDetailView(OrganizerAndLoginRequiredMixin, generic.DetailView):
     template_name = "agents/agent_detail.html"
     #context_object_name = agent 
 
     def get_queryset(self):
-        organization = self.request.user.userprofile
-        return Agent.objects.filter(organization=organization)
+        return Agent.objects.for_tenant(self.request.tenant)
 
 
 class AgentUpdateView(OrganizerAndLoginRequiredMixin, generic.UpdateView):
@@ -58,8 +100,7 @@ class AgentUpdateView(OrganizerAndLoginRequiredMixin, generic.UpdateView):
     form_class = AgentModelForm 
 
     def get_queryset(self):
-        organization = self.request.user.userprofile
-        return Agent.objects.filter(organization=organization)
+        return Agent.objects.for_tenant(self.request.tenant)
     
     def get_success_url(self):
         return reverse('agents:agent-list')
@@ -69,9 +110,14 @@ class AgentDeleteView(OrganizerAndLoginRequiredMixin, generic.DeleteView):
     template_name = 'agents/agent_delete.html'
     
     def get_queryset(self):
-        organization = self.request.user.userprofile
-        return Agent.objects.filter(organization=organization)
+        return Agent.objects.for_tenant(self.request.tenant)
     
     def get_success_url(self):
         return reverse('agents:agent-list')
-    
\ No newline at end of file
+
+    def delete(self, request, *args, **kwargs):
+        # the agent disappears from the views now; run_deletion_jobs
+        # unassigns its leads in chunks and then removes it
+        self.object = self.get_object()
+        enqueue_agent_deletion(self.object)
+        return HttpResponseRedirect(self.get_success_url())
@@ -0,0 +1,149 @@
+"""
+Production SQLite profile and read/write routing.
+
+configure_sqlite runs the SQLITE_PRAGMAS on every new SQLite connection:
+WAL lets readers run alongside the single writer instead of failing with
+"database is locked", and busy_timeout makes writers wait for each other
+rather than erroring out. Together with CONN_MAX_AGE the pragmas are paid
+once per worker connection, not once per request.
+
+ReadWriteRouter sends the reads of safe (GET/HEAD/OPTIONS) requests to the
+READ_DATABASE alias, a second, query-only connection to the same file, so
+page rendering never queues behind the write connection of the worker.
+Everything else, and any read inside a transaction on the default
+database, stays on 'default'.
+
+ShardRouter sends the SHARDED_MODELS (leads, agents, categories) of an
+organization to the database of its shard (UserProfile.shard, see
+leads/sharding.py): the shard of a related instance when there is one,
+otherwise the one of the organization the request or job works for, set
+in `current_shard`. The default database holds the users, the
+organizations and everything else, and is a shard itself; the other
+shards don't have those rows, so their foreign keys to them are not
+enforced by the database and queries on a shard must not join them.
+"""
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+read_only_request = ContextVar('read_only_request', default=False)
+# alias of the shard the request or job works on, None for the default database
+current_shard = ContextVar('current_shard', default=None)
+
+
+def is_directory_database(alias):
+    """Whether `alias` holds the users and organizations, i.e. can join them."""
+    return alias in (DEFAULT_DB_ALIAS, settings.READ_DATABASE)
+
+
+def sqlite_pragmas(alias=DEFAULT_DB_ALIAS):
+    pragmas = dict(settings.SQLITE_PRAGMAS)
+    if alias == settings.READ_DATABASE:
+        pragmas['query_only'] = 1
+    return [f"PRAGMA {name} = {value}" for name, value in pragmas.items()]
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    # straight on the sqlite3 connection: not worth logging or counting
+    for statement in sqlite_pragmas(connection.alias):
+        connection.connection.execute(statement)
+
+
+class ReadOnlyRequestMiddleware:
+    """Mark safe requests so ReadWriteRouter may route their reads."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = read_only_request.set(request.method in SAFE_METHODS)
+        try:
+            return self.get_response(request)
+        finally:
+            read_only_request.reset(token)
+
+
+class ReadWriteRouter:
+    aliases = (DEFAULT_DB_ALIAS, settings.READ_DATABASE)
+
+    def db_for_read(self, model, **hints):
+        if settings.READ_DATABASE not in settings.DATABASES or not read_only_request.get():
+            return DEFAULT_DB_ALIAS
+        # a transaction on the default database may hold rows the read
+        # connection can't see yet
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return settings.READ_DATABASE
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if obj1._state.db in self.aliases and obj2._state.db in self.aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == settings.READ_DATABASE:
+            return False
+        return None
+
+
+def is_sharded(model):
+    return model._meta.label_lower in settings.SHARDED_MODELS
+
+
+class ShardRouter:
+    """Route the sharded models; must come before ReadWriteRouter."""
+
+    def shard_for(self, model, hints):
+        if not is_sharded(model):
+            return None
+        shard = None
+        instance = hints.get('instance')
+        if instance is not None:
+            if is_sharded(type(instance)):
+                shard = instance._state.db
+            else:
+                # an organization: UserProfile.shard
+                shard = getattr(instance, 'shard', None)
+        shard = shard or current_shard.get()
+        # the default database is left to ReadWriteRouter
+        if shard is None or is_directory_database(shard):
+            return None
+        return shard
+
+    def db_for_read(self, model, **hints):
+        return self.shard_for(model, hints)
+
+    def db_for_write(self, model, **hints):
+        if not is_sharded(model):
+            # the rows migrate creates in a shard's own (unused) copy of the
+            # other tables, e.g. permissions of its content types
+            instance = hints.get('instance')
+            if instance is not None and not is_sharded(type(instance)):
+                if instance._state.db and not is_directory_database(instance._state.db):
+                    return instance._state.db
+            return None
+        return self.shard_for(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not (is_sharded(type(obj1)) or is_sharded(type(obj2))):
+            return None
+        if not (is_sharded(type(obj1)) and is_sharded(type(obj2))):
+            # e.g. a lead and its organization: across databases by design
+            return True
+        databases = {
+            DEFAULT_DB_ALIAS if db is None or is_directory_database(db) else db
+            for db in (obj1._state.db, obj2._state.db)
+        }
+        return len(databases) == 1
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # every shard has the whole schema, ReadWriteRouter skips the read alias
+        return None
@@ -0,0 +1,181 @@
+"""
+Per-view request instrumentation.
+
+MetricsMiddleware records, for every request, the number of SQL queries and
+the time spent in the database, in template rendering and in total, keyed
+by the resolved URL name. The numbers are aggregated into histograms served
+in the Prometheus text format by metrics_view, to staff users and bearers
+of METRICS_TOKEN; responses to them, or to everyone with DEBUG on, also get
+a Server-Timing header. The registry lives in process memory, so with
+several gunicorn workers every worker is scraped (or reports) separately.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+    HISTOGRAMS = (
+        ('crm_request_duration_seconds', 'Total request latency.', DURATION_BUCKETS),
+        ('crm_request_db_seconds', 'Time spent executing SQL.', DURATION_BUCKETS),
+        ('crm_request_template_seconds', 'Time spent rendering templates.', DURATION_BUCKETS),
+        ('crm_request_queries', 'SQL queries per request.', QUERY_BUCKETS),
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {name: {} for name, _, _ in self.HISTOGRAMS}
+        self.responses = {}
+
+    def observe(self, view, status, duration, db_time, template_time, queries):
+        values = {
+            'crm_request_duration_seconds': duration,
+            'crm_request_db_seconds': db_time,
+            'crm_request_template_seconds': template_time,
+            'crm_request_queries': queries,
+        }
+        with self.lock:
+            for name, _, buckets in self.HISTOGRAMS:
+                histograms = self.histograms[name]
+                if view not in histograms:
+                    histograms[view] = Histogram(buckets)
+                histograms[view].observe(values[name])
+            key = (view, str(status))
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, help_text, _ in self.HISTOGRAMS:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for view, histogram in sorted(self.histograms[name].items()):
+                    label = f'view="{escape_label(view)}"'
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+                    lines.append(f"{name}_sum{{{label}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{label}}} {histogram.count}")
+            lines.append("# HELP crm_responses_total Responses by view and status code.")
+            lines.append("# TYPE crm_responses_total counter")
+            for (view, status), count in sorted(self.responses.items()):
+                lines.append(f'crm_responses_total{{view="{escape_label(view)}",status="{status}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {name: {} for name, _, _ in self.HISTOGRAMS}
+            self.responses = {}
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+class RequestStats:
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+class MetricsMiddleware:
+    """
+    Should be the first middleware so the timings cover the whole stack.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = request._request_stats = RequestStats()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = match.view_name if match and match.view_name else '<unresolved>'
+        registry.observe(view, response.status_code, duration, stats.db_time, stats.template_time, stats.queries)
+        if settings.DEBUG or metrics_allowed(request):
+            response['Server-Timing'] = (
+                f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries", '
+                f'tpl;dur={stats.template_time * 1000:.1f}, '
+                f'total;dur={duration * 1000:.1f}'
+            )
+        return response
+
+    def process_template_response(self, request, response):
+        # TemplateResponse renders after the view returns; time that render
+        stats = request._request_stats
+        render = response.render
+
+        def timed_render():
+            start = time.perf_counter()
+            try:
+                return render()
+            finally:
+                stats.template_time += time.perf_counter() - start
+
+        response.render = timed_render
+        return response
+
+
+def metrics_allowed(request):
+    """
+    Whether the request may read the metrics: a staff user, or a bearer of
+    METRICS_TOKEN. The client address proves nothing behind a proxy.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_active and user.is_staff:
+        return True
+    scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return bool(settings.METRICS_TOKEN) and scheme == 'Bearer' and constant_time_compare(token, settings.METRICS_TOKEN)
+
+
+def metrics_view(request):
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,89 @@
+"""
+Full-page cache for anonymous visitors.
+
+cache_anonymous_page wraps the views of public pages (landing, login,
+password reset, signup). A GET without a session or messages cookie and
+without a query string can only be an anonymous visitor with nothing
+pending, so it is answered from the cache without loading a session,
+a user or a template. Anyone else gets the view as usual, and the
+response carries Vary: Cookie so shared caches keep the two apart.
+
+Form pages are stored with a placeholder in place of the per-visitor
+CSRF token, and every response gets a fresh token for its visitor.
+"""
+import functools
+import hashlib
+import re
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils import translation
+from django.utils.cache import patch_vary_headers
+
+CSRF_PLACEHOLDER = b'__csrf_token__'
+# replayed on cache hits, e.g. the never_cache headers of the login page
+CACHED_HEADERS = ('Content-Type', 'Cache-Control')
+CSRF_INPUT = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+
+def page_cache_key(request):
+    path = hashlib.md5(request.path.encode()).hexdigest()
+    return f"crm:page:{translation.get_language()}:{path}"
+
+
+def is_cacheable_request(request):
+    if request.method != 'GET' or request.META.get('QUERY_STRING'):
+        return False
+    cookies = request.COOKIES
+    return settings.SESSION_COOKIE_NAME not in cookies and CookieStorage.cookie_name not in cookies
+
+
+def is_cacheable_response(request, response):
+    # views under csrf_protect set the CSRF cookie themselves; respond()
+    # issues one for every visitor anyway
+    cookies = set(response.cookies) - {settings.CSRF_COOKIE_NAME}
+    if response.status_code != 200 or response.streaming or cookies:
+        return False
+    session = getattr(request, 'session', None)
+    return session is None or not session.modified
+
+
+def respond(request, content, headers):
+    if CSRF_PLACEHOLDER in content:
+        content = content.replace(CSRF_PLACEHOLDER, get_token(request).encode())
+    response = HttpResponse(content)
+    for name, value in headers.items():
+        response[name] = value
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def cache_anonymous_page(view, timeout=None):
+    """Serve `view` from the cache to anonymous visitors, for PAGE_CACHE_TIMEOUT seconds."""
+
+    @functools.wraps(view)
+    def cached_view(request, *args, **kwargs):
+        page_timeout = settings.PAGE_CACHE_TIMEOUT if timeout is None else timeout
+        if not page_timeout or not is_cacheable_request(request):
+            response = view(request, *args, **kwargs)
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        key = page_cache_key(request)
+        page = cache.get(key)
+        if page is not None:
+            return respond(request, *page)
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            response.render()
+        if not is_cacheable_response(request, response):
+            patch_vary_headers(response, ('Cookie',))
+            return response
+        content = CSRF_INPUT.sub(rb'\1' + CSRF_PLACEHOLDER + rb'\2', response.content)
+        headers = {name: response[name] for name in CACHED_HEADERS if response.has_header(name)}
+        cache.set(key, (content, headers), page_timeout)
+        return respond(request, content, headers)
+
+    return cached_view
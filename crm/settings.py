@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -23,9 +26,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'hx8ar%jd#5#t4v(_$7kt5%s2agwramk=u=d^+r*1)#gz&ip1ch'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DJANGO_DEBUG', 'True') == 'True'
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [host for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',') if host]
 
 
 # Application definition
@@ -39,7 +42,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
 
     #local apps 
-    'leads',
+    'leads.apps.LeadsConfig',
     'agents',
 
     #third-party-app
@@ -48,23 +51,35 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'crm.metrics.MetricsMiddleware',
+    'crm.db.ReadOnlyRequestMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'leads.middleware.TenantMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'crm.urls'
 
+# Templates are read and compiled once per process unless debugging, when
+# edits should show up on the next request.
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+if not DEBUG:
+    TEMPLATE_LOADERS = [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [ BASE_DIR / "templates" ],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': TEMPLATE_LOADERS,
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -81,14 +96,105 @@ WSGI_APPLICATION = 'crm.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
+# Connections are kept open for CONN_MAX_AGE seconds so the pragmas below
+# are set once per worker connection rather than once per request.
+CONN_MAX_AGE = int(os.environ.get('DJANGO_CONN_MAX_AGE', 600))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+    },
+    # query-only connection to the same file for the reads of GET requests,
+    # see crm/db.py
+    'read': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+# Organization shards (see crm/db.py and leads/sharding.py): an
+# organization's leads, agents and categories live in the database its
+# UserProfile.shard names. DJANGO_SHARDS=shard1,shard2 adds one SQLite file
+# per name next to db.sqlite3, and one more per name for the test run;
+# 'default' holds everything else and is always a shard too.
+SHARD_NAMES = [name.strip() for name in os.environ.get('DJANGO_SHARDS', '').split(',') if name.strip()]
+for name in SHARD_NAMES:
+    DATABASES[name] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'db-{name}.sqlite3',
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'TEST': {'NAME': str(BASE_DIR / f'test-db-{name}.sqlite3')},
     }
+SHARDS = ['default'] + SHARD_NAMES
+SHARDED_MODELS = ('leads.lead', 'leads.agent', 'leads.category')
+# Ids of the rows created in the n-th shard start above n * SHARD_ID_STRIDE,
+# so an organization keeps its ids when it moves to another shard.
+SHARD_ID_STRIDE = 100_000_000
+# Seconds move_organization waits after flagging an organization as moving
+# for the requests that resolved it before to finish writing.
+SHARD_MOVE_GRACE_SECONDS = 5
+
+DATABASE_ROUTERS = ['crm.db.ShardRouter', 'crm.db.ReadWriteRouter']
+
+# Alias ReadWriteRouter sends safe requests' reads to.
+READ_DATABASE = 'read'
+
+# Run on every new SQLite connection (crm.db.configure_sqlite). WAL lets
+# readers work during writes and busy_timeout (ms) makes concurrent writers
+# wait instead of failing with "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+# Use a cache shared by all workers (file based, memcached...) when running
+# more than one process, or invalidations only reach the local worker.
+# DJANGO_CACHE=file:/var/tmp/crm-cache selects the file based cache; the
+# location after the colon may be left out, e.g. DJANGO_CACHE=file.
+CACHE_URL = os.environ.get('DJANGO_CACHE', 'locmem:crm')
+# scheme: (backend, default location)
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'crm'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', '/var/tmp/crm-cache'),
+}
+CACHE_SCHEME, _, CACHE_LOCATION = CACHE_URL.partition(':')
+if CACHE_SCHEME not in CACHE_BACKENDS:
+    raise ImproperlyConfigured(
+        f"Unknown cache backend {CACHE_SCHEME!r} in DJANGO_CACHE={CACHE_URL!r}; "
+        f"use one of {', '.join(CACHE_BACKENDS)}, optionally followed by ':location'."
+    )
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKENDS[CACHE_SCHEME][0],
+        'LOCATION': CACHE_LOCATION or CACHE_BACKENDS[CACHE_SCHEME][1],
+    }
+}
+
+# Seconds an organization's cached agent choices may linger unused.
+AGENT_CHOICES_CACHE_TIMEOUT = 300
+
+# Seconds a rendered lead, category or agent table is kept. Fragments are
+# keyed by the organization's data version, so writes never serve stale
+# tables; this only bounds how long superseded versions take up space.
+TEMPLATE_FRAGMENT_CACHE_TIMEOUT = 600
+
+# Seconds the public pages wrapped in cache_anonymous_page (see
+# crm/pagecache.py) are served to anonymous visitors from the cache; 0
+# renders them on every request.
+PAGE_CACHE_TIMEOUT = int(os.environ.get('DJANGO_PAGE_CACHE_TIMEOUT', 300))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -129,7 +235,15 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [ 
     BASE_DIR / 'static'
  ]
-STATIC_ROOT = 'static_root'
+STATIC_ROOT = BASE_DIR / 'static_root'
+
+# Outside debugging, collectstatic writes content hashed names with gzip
+# variants (see crm/staticfiles.py) and, with SERVE_STATIC, Django serves
+# them from STATIC_ROOT with far-future immutable caching. Turn
+# DJANGO_SERVE_STATIC off when a web server or CDN serves STATIC_ROOT.
+if not DEBUG:
+    STATICFILES_STORAGE = 'crm.staticfiles.CompressedManifestStaticFilesStorage'
+SERVE_STATIC = os.environ.get('DJANGO_SERVE_STATIC', 'True') == 'True'
 
 AUTH_USER_MODEL = 'leads.User'
 
@@ -138,5 +252,56 @@ LOGIN_REDIRECT_URL = "/leads"
 LOGOUT_REDIRECT_URL = '/'
 LOGIN_URL = '/login'
 
+# Read per-category lead counts from the maintained Category.lead_count
+# columns instead of counting the leads table on every category list.
+LEAD_CATEGORY_COUNTERS = True
+
+# Read the agent workload dashboard from the maintained WorkloadSummary
+# table instead of grouping the leads table on every request.
+LEAD_WORKLOAD_SUMMARY = True
+
+# Assign leads created without an agent automatically: None to disable,
+# 'round_robin' or 'least_loaded' (see leads/distribution.py).
+LEAD_AUTO_DISTRIBUTION = None
+
+# Processes hashing the passwords of bulk invited agents (see
+# agents/onboarding.py); None for one per CPU.
+AGENT_ONBOARDING_WORKERS = None
+
+# Rows removed or unassigned per transaction by the deletion jobs (see
+# leads/deletion.py).
+DELETION_BATCH_SIZE = 500
+
+# Lead activity log (see leads/activity.py): events recorded outside a
+# transaction are written once this many are buffered or the oldest is
+# this many seconds old. Events older than the retention are deleted and
+# those older than the compaction age compacted by prune_lead_activity.
+ACTIVITY_BUFFER_SIZE = 200
+ACTIVITY_FLUSH_INTERVAL = 2
+ACTIVITY_RETENTION_DAYS = 365
+ACTIVITY_COMPACT_AFTER_DAYS = 30
+
+# Lead scoring (see leads/scoring.py): a lead's score is the weighted sum of
+# these features, each scaled to 0..1; a negative weight lowers it. Category
+# values go by name, case insensitive, with None for uncategorized leads and
+# 0.5 for unlisted categories. Recency halves every half-life since creation.
+LEAD_SCORE_WEIGHTS = {
+    'age': 0.1,
+    'category': 0.4,
+    'agent_load': -0.2,
+    'recency': 0.5,
+}
+LEAD_SCORE_CATEGORY_VALUES = {
+    None: 1.0,
+    'contacted': 0.5,
+    'converted': 0.0,
+}
+LEAD_SCORE_HALF_LIFE_DAYS = 14
+
+# Bearer token of the Prometheus scraper for /metrics, which staff users
+# can also read; unset, only staff can. The Server-Timing header is sent to
+# the same requesters, or to everyone with DEBUG on.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 CRISPY_ALLOWED_TEMPLATE_PACK ='tailwind'
 CRISPY_TEMPLATE_PACK ='tailwind'
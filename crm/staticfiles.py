@@ -0,0 +1,107 @@
+"""
+Hashed, precompressed static files.
+
+collectstatic with CompressedManifestStaticFilesStorage copies every file
+under a name containing a hash of its content (styles.3f2a9c1e.css), so a
+changed file gets a new URL, and writes a gzip variant next to each text
+file. serve_static sends the gzip variant to clients that accept it,
+without compressing on the fly, and marks hashed files immutable for a
+year: browsers never revalidate them, and pick up a new version through
+the new URL in the next page.
+"""
+import functools
+import gzip
+import mimetypes
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# names without a hash may change under the same URL
+REVALIDATE = 'public, max-age=0, must-revalidate'
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ManifestStaticFilesStorage that also writes `<name>.gz` of text files."""
+    compressible_extensions = ('.css', '.js', '.json', '.map', '.svg', '.txt', '.xml')
+    # below this gzip's header and footer eat most of the saving
+    minimum_size = 256
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted(set(paths) | set(self.hashed_files.values())):
+            if name.endswith(self.compressible_extensions) and self.compress(name):
+                yield name, f"{name}.gz", True
+
+    def compress(self, name):
+        path = self.path(name)
+        with open(path, 'rb') as source:
+            content = source.read()
+        compressed = gzip.compress(content, compresslevel=9, mtime=0)
+        if len(content) < self.minimum_size or len(compressed) >= len(content):
+            # don't leave the variant of an earlier version behind
+            if os.path.exists(f"{path}.gz"):
+                os.remove(f"{path}.gz")
+            return False
+        with open(f"{path}.gz", 'wb') as target:
+            target.write(compressed)
+        return True
+
+
+@functools.lru_cache(maxsize=None)
+def hashed_names():
+    # the manifest only changes with a deploy, i.e. a restart
+    return frozenset(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+
+def accepts_gzip(request):
+    for encoding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = encoding.partition(';')
+        if name.strip().lower() == 'gzip':
+            # "gzip;q=0" refuses it
+            quality = params.strip().lower().replace(' ', '')
+            if not quality.startswith('q='):
+                return True
+            try:
+                return float(quality[2:]) > 0
+            except ValueError:
+                return False
+    return False
+
+
+def serve_static(request, path):
+    """Serve a collected file from STATIC_ROOT, precompressed when possible."""
+    try:
+        fullpath = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404("Invalid path")
+    if not os.path.isfile(fullpath):
+        raise Http404("Not found")
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    served = fullpath
+    if encoding is None and accepts_gzip(request) and os.path.isfile(f"{fullpath}.gz"):
+        served = f"{fullpath}.gz"
+        encoding = 'gzip'
+    stat = os.stat(served)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime, stat.st_size):
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(
+            open(served, 'rb'), content_type=content_type or 'application/octet-stream',
+            filename=os.path.basename(fullpath),
+        )
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['Cache-Control'] = IMMUTABLE if path in hashed_names() else REVALIDATE
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
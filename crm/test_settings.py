@@ -0,0 +1,10 @@
+"""
+Settings of the test run: crm/settings.py with one organization shard
+besides 'default' (DJANGO_SHARDS=shard1 unless set), so the sharded code
+paths are tested against a second local SQLite file.
+"""
+import os
+
+os.environ.setdefault('DJANGO_SHARDS', 'shard1')
+
+from .settings import *  # noqa: E402,F401,F403
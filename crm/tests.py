@@ -0,0 +1,202 @@
+import gzip
+import os
+import re
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.http import Http404, HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, override_settings
+
+from leads.models import Lead, User
+from leads.testing import TestCase, create_organizer
+
+from .db import ReadOnlyRequestMiddleware, ReadWriteRouter, read_only_request, sqlite_pragmas
+from .metrics import registry
+from .pagecache import page_cache_key
+from .staticfiles import IMMUTABLE, REVALIDATE, CompressedManifestStaticFilesStorage, accepts_gzip, serve_static
+
+
+@override_settings(METRICS_TOKEN='secret', DEBUG=False)
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        registry.reset()
+
+    def test_token_or_staff_required(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('crm_request_queries_bucket', response.content.decode())
+        staff = User.objects.create_user(username='staff', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_no_token_configured(self):
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+    def test_server_timing_only_for_allowed_requests(self):
+        user, organization = create_organizer()
+        self.client.force_login(user)
+        self.assertNotIn('Server-Timing', self.client.get('/leads/'))
+        response = self.client.get('/leads/', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertIn('queries', response['Server-Timing'])
+        with self.settings(DEBUG=True):
+            self.assertIn('Server-Timing', self.client.get('/leads/'))
+
+    def test_requests_are_recorded_per_view(self):
+        user, organization = create_organizer()
+        self.client.force_login(user)
+        self.client.get('/leads/')
+        metrics = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').content.decode()
+        self.assertIn('crm_responses_total{view="leads:lead-list",status="200"} 1', metrics)
+
+
+class ReadRouterTests(SimpleTestCase):
+
+    def test_reads_of_safe_requests_use_the_read_alias(self):
+        router = ReadWriteRouter()
+        self.assertEqual(router.db_for_read(Lead), 'default')
+        token = read_only_request.set(True)
+        try:
+            self.assertEqual(router.db_for_read(Lead), settings.READ_DATABASE)
+            self.assertEqual(router.db_for_write(Lead), 'default')
+        finally:
+            read_only_request.reset(token)
+        self.assertIs(router.allow_migrate(settings.READ_DATABASE, 'leads'), False)
+
+    def test_middleware_marks_safe_methods(self):
+        seen = []
+
+        def get_response(request):
+            seen.append(read_only_request.get())
+            return HttpResponse()
+
+        middleware = ReadOnlyRequestMiddleware(get_response)
+        middleware(RequestFactory().get('/'))
+        middleware(RequestFactory().post('/'))
+        self.assertEqual(seen, [True, False])
+        self.assertIs(read_only_request.get(), False)
+
+    def test_read_connection_is_query_only(self):
+        self.assertIn('PRAGMA query_only = 1', sqlite_pragmas(settings.READ_DATABASE))
+        self.assertNotIn('PRAGMA query_only = 1', sqlite_pragmas())
+
+
+class SqlitePragmaTests(TestCase):
+
+    def test_pragmas_are_applied_to_new_connections(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+
+    def test_reads_inside_a_transaction_stay_on_default(self):
+        token = read_only_request.set(True)
+        try:
+            # TestCase wraps every test in a transaction on 'default'
+            self.assertEqual(ReadWriteRouter().db_for_read(Lead), 'default')
+        finally:
+            read_only_request.reset(token)
+
+
+class StaticFilesTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        self.css = 'body { color: black; }\n' * 40
+
+    def write(self, name, content):
+        with open(os.path.join(self.root, name), 'wb') as file:
+            file.write(content)
+
+    def serve(self, path, **headers):
+        with self.settings(STATIC_ROOT=self.root):
+            return serve_static(RequestFactory().get(f'/static/{path}', **headers), path)
+
+    def test_accepts_gzip(self):
+        def accepts(value):
+            return accepts_gzip(RequestFactory().get('/', HTTP_ACCEPT_ENCODING=value))
+
+        self.assertTrue(accepts('gzip, deflate, br'))
+        self.assertTrue(accepts('br;q=1.0, gzip;q=0.5'))
+        self.assertFalse(accepts('gzip;q=0'))
+        self.assertFalse(accepts('br'))
+
+    def test_collectstatic_writes_hashed_and_compressed_files(self):
+        storage = CompressedManifestStaticFilesStorage(location=self.root, base_url='/static/')
+        storage.save('style.css', ContentFile(self.css.encode()))
+        storage.save('tiny.css', ContentFile(b'a{}'))
+        list(storage.post_process({name: (storage, name) for name in ('style.css', 'tiny.css')}))
+        hashed = storage.stored_name('style.css')
+        self.assertNotEqual(hashed, 'style.css')
+        with open(storage.path(f'{hashed}.gz'), 'rb') as file:
+            self.assertEqual(gzip.decompress(file.read()).decode(), self.css)
+        # too small to gain anything
+        self.assertFalse(storage.exists(f"{storage.stored_name('tiny.css')}.gz"))
+
+    def test_gzip_variant_is_served_to_clients_that_accept_it(self):
+        self.write('style.css', self.css.encode())
+        self.write('style.css.gz', gzip.compress(self.css.encode()))
+        response = self.serve('style.css', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['Cache-Control'], REVALIDATE)
+        response = self.serve('style.css')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content).decode(), self.css)
+        self.assertEqual(self.serve('style.css', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_hashed_files_are_immutable(self):
+        self.write('style.3f2a9c1e.css', self.css.encode())
+        with mock.patch('crm.staticfiles.hashed_names', return_value=frozenset({'style.3f2a9c1e.css'})):
+            self.assertEqual(self.serve('style.3f2a9c1e.css')['Cache-Control'], IMMUTABLE)
+
+    def test_missing_and_outside_files(self):
+        with self.assertRaises(Http404):
+            self.serve('missing.css')
+        with self.assertRaises(Http404):
+            self.serve('../settings.py')
+
+
+@override_settings(PAGE_CACHE_TIMEOUT=60)
+class AnonymousPageCacheTests(TestCase):
+
+    def csrf_token(self, response):
+        return re.search(rb'name="csrfmiddlewaretoken" value="([^"]*)"', response.content).group(1).decode()
+
+    def test_page_is_cached_with_a_token_per_visitor(self):
+        first = self.client.get('/login/')
+        self.assertIsNotNone(cache.get(page_cache_key(first.wsgi_request)))
+        other = Client(enforce_csrf_checks=True)
+        response = other.get('/login/')
+        self.assertEqual(response['Vary'], 'Cookie')
+        token = self.csrf_token(response)
+        self.assertNotEqual(token, self.csrf_token(first))
+        self.assertNotIn(b'__csrf_token__', response.content)
+        # the token of the cached page logs the visitor in
+        user, organization = create_organizer()
+        response = other.post('/login/', {'username': 'organizer', 'password': 'password', 'csrfmiddlewaretoken': token})
+        self.assertEqual(response.status_code, 302)
+
+    def test_query_strings_and_sessions_bypass_the_cache(self):
+        self.client.get('/login/?next=/leads/')
+        self.assertIsNone(cache.get(page_cache_key(RequestFactory().get('/login/'))))
+        user, organization = create_organizer()
+        self.client.force_login(user)
+        response = self.client.get('/')
+        self.assertIsNone(cache.get(page_cache_key(response.wsgi_request)))
+        self.assertEqual(response['Vary'], 'Cookie')
+
+    def test_cached_page_renders_nothing(self):
+        self.client.get('/')
+        with self.assertNumQueries(0), mock.patch('leads.views.LandingPageView.get') as view:
+            self.assertEqual(Client().get('/').status_code, 200)
+        view.assert_not_called()
@@ -1,31 +1,40 @@
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from leads.views import landing_page, LandingPageView
 from django.contrib.auth.views import(
     LoginView, LogoutView, PasswordResetView, PasswordResetDoneView, 
     PasswordResetConfirmView,PasswordResetCompleteView
     )
 from leads.views import CustomUserSignupView
+from .metrics import metrics_view
+from .pagecache import cache_anonymous_page
+from .staticfiles import serve_static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     #path('', landing_page, name='landing-page'),
-    path('', LandingPageView.as_view(), name='landing-page'),
+    path('', cache_anonymous_page(LandingPageView.as_view()), name='landing-page'),
     path('leads/', include('leads.urls', namespace="leads")),
     path('agents/', include('agents.urls', namespace="agents")),
 
-    path('login/', LoginView.as_view(), name='login'),
+    path('login/', cache_anonymous_page(LoginView.as_view()), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
-    path('reset-password/', PasswordResetView.as_view(), name='reset-password'),
+    path('reset-password/', cache_anonymous_page(PasswordResetView.as_view()), name='reset-password'),
     path('password-reset-done/', PasswordResetDoneView.as_view(), name='password_reset_done'),
     path('password-reset-confirm/<uidb64>/<token>', PasswordResetConfirmView.as_view(), name='password_reset_confirm'),
     path('password-reset-complete', PasswordResetCompleteView.as_view(), name='password_reset_complete'),
 
-    path('signup/', CustomUserSignupView.as_view(), name='signup'),
+    path('signup/', cache_anonymous_page(CustomUserSignupView.as_view()), name='signup'),
+
+    path('metrics', metrics_view, name='metrics'),
 
 ]
 
 if settings.DEBUG:
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+elif settings.SERVE_STATIC:
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % settings.STATIC_URL.lstrip('/'), serve_static, name='static'),
+    ]
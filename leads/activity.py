@@ -0,0 +1,200 @@
+"""
+Lead activity log.
+
+Recording an event costs no query on the path that makes the change:
+record_activity only builds LeadActivity rows. Inside a transaction they
+are handed to the process-wide buffer once it commits (and dropped if it
+rolls back) and written right away with one bulk_create. Outside a
+transaction they wait in the buffer until ACTIVITY_BUFFER_SIZE events
+have piled up or the oldest is ACTIVITY_FLUSH_INTERVAL seconds old; the
+age is checked on every new event and at the end of every request. A
+process that dies loses at most those last unwritten events.
+
+The actor of an event is the user of the current request, set by
+TenantMiddleware; events recorded by commands have none.
+"""
+import atexit
+import datetime
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import Lead, LeadActivity
+
+logger = logging.getLogger(__name__)
+
+activity_actor = ContextVar('activity_actor', default=None)
+
+
+class ActivityBuffer:
+    """Events waiting to be written, shared by the threads of the process."""
+
+    def __init__(self, max_size, max_age):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.events = []
+        self.oldest = None
+        self.lock = threading.Lock()
+
+    def _due(self):
+        if not self.events:
+            return False
+        return len(self.events) >= self.max_size or time.monotonic() - self.oldest >= self.max_age
+
+    def extend(self, events, flush=False):
+        with self.lock:
+            if not self.events:
+                self.oldest = time.monotonic()
+            self.events.extend(events)
+            due = flush or self._due()
+        if due:
+            self.flush()
+
+    def flush_if_due(self):
+        with self.lock:
+            due = self._due()
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            events, self.events = self.events, []
+        if not events:
+            return 0
+        try:
+            LeadActivity.objects.bulk_create(events, batch_size=500)
+        except DatabaseError:
+            # the log must never fail the change it records
+            logger.exception("Dropped %d lead activity event(s)", len(events))
+            return 0
+        return len(events)
+
+
+buffer = ActivityBuffer(settings.ACTIVITY_BUFFER_SIZE, settings.ACTIVITY_FLUSH_INTERVAL)
+atexit.register(buffer.flush)
+
+
+def current_actor_id():
+    user = activity_actor.get()
+    if user is None or not user.is_authenticated:
+        return None
+    return user.pk
+
+
+def record_activity(organization_id, events, using=None):
+    """
+    Log (lead_id, kind, value) `events` of the organization's leads, changed
+    on the `using` database.
+    """
+    now = timezone.now()
+    actor_id = current_actor_id()
+    rows = [
+        LeadActivity(
+            organization_key=organization_id, lead_key=lead_id, ts=now, kind=kind, actor_key=actor_id, value=value
+        )
+        for lead_id, kind, value in events
+    ]
+    if not rows:
+        return
+    # the transaction that matters is the one of the change, maybe in a shard
+    if connections[using or DEFAULT_DB_ALIAS].in_atomic_block:
+        transaction.on_commit(lambda: buffer.extend(rows, flush=True), using=using)
+    else:
+        buffer.extend(rows)
+
+
+def lead_events(lead_id, agent_id, category_id):
+    events = [(lead_id, LeadActivity.CREATED, None)]
+    if agent_id:
+        events.append((lead_id, LeadActivity.ASSIGNED, agent_id))
+    if category_id:
+        events.append((lead_id, LeadActivity.CATEGORIZED, category_id))
+    return events
+
+
+def new_lead_events(organization, leads):
+    """The events of `leads` inserted with bulk_create, in the same transaction."""
+    if any(lead.pk is None for lead in leads):
+        # SQLite doesn't return the ids of bulk inserted rows. bulk_create
+        # stamped each lead's updated_at, so find the rows by their stamps
+        # on the (organization, updated_at) index, in insertion order
+        stamps = {lead.updated_at for lead in leads}
+        ids = defaultdict(deque)
+        rows = (
+            Lead.objects.for_organization(organization)
+            .filter(updated_at__range=(min(stamps), max(stamps)))
+            .order_by('id')
+            .values_list('id', 'updated_at')
+        )
+        for lead_id, updated_at in rows:
+            if updated_at in stamps:
+                ids[updated_at].append(lead_id)
+        for lead in leads:
+            if lead.pk is None and ids[lead.updated_at]:
+                lead.pk = ids[lead.updated_at].popleft()
+    return [
+        event
+        for lead in leads if lead.pk is not None
+        for event in lead_events(lead.pk, lead.agent_id, lead.category_id)
+    ]
+
+
+def flush_activity(**kwargs):
+    """Write this process's buffered events now, e.g. before it exits."""
+    return buffer.flush()
+
+
+def flush_activity_if_due(**kwargs):
+    buffer.flush_if_due()
+
+
+def lead_timeline(organization_id, lead_id):
+    # ordered by ('-ts', '-id'), this reads the (organization_key, lead_key, ts) index backwards
+    return LeadActivity.objects.filter(organization_key=organization_id, lead_key=lead_id)
+
+
+def _delete_in_chunks(events, batch_size):
+    deleted = 0
+    while True:
+        ids = list(events.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        # nothing depends on LeadActivity, so this is a single DELETE
+        deleted += LeadActivity.objects.filter(id__in=ids).delete()[0]
+        if len(ids) < batch_size:
+            return deleted
+
+
+def prune_activity(retention_days=None, batch_size=1000):
+    """Delete the events older than `retention_days`, oldest first."""
+    retention_days = retention_days or settings.ACTIVITY_RETENTION_DAYS
+    cutoff = timezone.now() - datetime.timedelta(days=retention_days)
+    return _delete_in_chunks(LeadActivity.objects.filter(ts__lt=cutoff), batch_size)
+
+
+def compact_activity(compact_after_days=None, batch_size=1000):
+    """
+    In the events older than `compact_after_days`, keep only the last
+    assignment and the last recategorization of each lead: the
+    intermediate ones no longer matter for the timeline.
+    """
+    compact_after_days = compact_after_days or settings.ACTIVITY_COMPACT_AFTER_DAYS
+    cutoff = timezone.now() - datetime.timedelta(days=compact_after_days)
+    later = LeadActivity.objects.filter(
+        organization_key=OuterRef('organization_key'),
+        lead_key=OuterRef('lead_key'),
+        kind=OuterRef('kind'),
+        ts__lt=cutoff,
+    ).filter(Q(ts__gt=OuterRef('ts')) | Q(ts=OuterRef('ts'), id__gt=OuterRef('id')))
+    superseded = LeadActivity.objects.filter(
+        ts__lt=cutoff, kind__in=(LeadActivity.ASSIGNED, LeadActivity.CATEGORIZED)
+    ).filter(Exists(later))
+    return _delete_in_chunks(superseded, batch_size)
+
@@ -1,8 +1,11 @@
 from django.contrib import admin
-from .models import User, UserProfile, Agent, Lead, Category
+from .models import User, UserProfile, Agent, Lead, Category, OutgoingEmail, DeletionJob, LeadActivity
 
 admin.site.register(User)
 admin.site.register(UserProfile)
 admin.site.register(Lead)
 admin.site.register(Agent)
 admin.site.register(Category)
+admin.site.register(OutgoingEmail)
+admin.site.register(DeletionJob)
+admin.site.register(LeadActivity)
@@ -3,3 +3,33 @@ from django.apps import AppConfig
 
 class LeadsConfig(AppConfig):
     name = 'leads'
+
+    def ready(self):
+        from django.core.signals import request_finished
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_init, post_save, pre_delete, post_delete, post_migrate
+        from crm.db import configure_sqlite
+        from . import signals
+        from .activity import flush_activity_if_due
+        from .models import Agent, Category, Lead, User, UserProfile
+
+        post_init.connect(signals.remember_lead_state, sender=Lead)
+        post_save.connect(signals.record_lead_activity_on_save, sender=Lead)
+        post_save.connect(signals.update_counts_on_lead_save, sender=Lead)
+        post_delete.connect(signals.record_lead_activity_on_delete, sender=Lead)
+        post_delete.connect(signals.update_counts_on_lead_delete, sender=Lead)
+        post_save.connect(signals.invalidate_agent_choices_on_agent_change, sender=Agent)
+        post_delete.connect(signals.invalidate_agent_choices_on_agent_change, sender=Agent)
+        post_init.connect(signals.remember_user_label, sender=User)
+        post_save.connect(signals.invalidate_agent_choices_on_user_change, sender=User)
+        post_delete.connect(signals.fold_workload_on_agent_delete, sender=Agent)
+        pre_delete.connect(signals.uncategorize_counts_on_category_delete, sender=Category)
+        post_delete.connect(signals.fold_workload_on_category_delete, sender=Category)
+        post_delete.connect(signals.delete_workload_on_organization_delete, sender=UserProfile)
+        for model in (Lead, Agent, Category):
+            post_save.connect(signals.touch_organization_on_change, sender=model)
+            post_delete.connect(signals.touch_organization_on_change, sender=model)
+        post_migrate.connect(signals.ensure_lead_search_index, sender=self)
+        post_migrate.connect(signals.apply_shard_id_offsets, sender=self)
+        connection_created.connect(configure_sqlite)
+        request_finished.connect(flush_activity_if_due)
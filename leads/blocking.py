@@ -0,0 +1,51 @@
+"""
+Blocking keys for duplicate detection.
+
+Two leads can only be duplicates if they share a blocking key: the sorted
+Soundex codes of their name tokens. "Jon Smith", "john SMYTH" and "Smith,
+John" share one; the key is stored in the indexed Lead.block_key, so
+duplicates are looked for within blocks instead of across every pair of
+an organization's leads. Ages are left out of the key: fixed age buckets
+would split leads a year apart on either side of a bucket boundary, so
+find_duplicates compares ages within a block instead.
+"""
+import re
+import unicodedata
+
+# block_key holds at most this many token codes
+MAX_TOKENS = 10
+
+SOUNDEX_CODES = {
+    letter: code
+    for code, letters in (('1', 'bfpv'), ('2', 'cgjkqsxz'), ('3', 'dt'), ('4', 'l'), ('5', 'mn'), ('6', 'r'))
+    for letter in letters
+}
+
+
+def name_tokens(*names):
+    """Lower case words of `names`, without accents, punctuation or digits."""
+    text = unicodedata.normalize('NFKD', ' '.join(name or '' for name in names))
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    return re.findall(r'[^\W\d_]+', text)
+
+
+def soundex(token):
+    if not 'a' <= token[0] <= 'z':
+        return token[:4]
+    digits = []
+    previous = SOUNDEX_CODES.get(token[0])
+    for char in token[1:]:
+        code = SOUNDEX_CODES.get(char)
+        if code is None:
+            # vowels separate equal codes, h and w don't
+            if char not in 'hw':
+                previous = None
+            continue
+        if code != previous:
+            digits.append(code)
+        previous = code
+    return (token[0] + ''.join(digits) + '000')[:4]
+
+
+def blocking_key(first_name, last_name):
+    return '.'.join(sorted({soundex(token) for token in name_tokens(first_name, last_name)})[:MAX_TOKENS])
@@ -0,0 +1,44 @@
+"""
+Per-organization cache of the agent (id, label) pairs rendered by the lead
+and assignment forms. Entries are keyed by a version number that the Agent
+and User signals bump, so a change never serves a stale list; the timeout
+only bounds how long unused versions linger.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Agent
+
+
+def version_key(organization_id):
+    return f"leads:agent-choices-version:{organization_id}"
+
+
+def agent_choices_version(organization_id):
+    key = version_key(organization_id)
+    version = cache.get(key)
+    if version is None:
+        # a fresh, never used version in case an old one was evicted
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_agent_choices(organization_id):
+    try:
+        cache.incr(version_key(organization_id))
+    except ValueError:
+        cache.set(version_key(organization_id), time.time_ns(), None)
+
+
+def agent_choices(organization_id):
+    """(id, label) pairs of the organization's agents, cached per version."""
+    key = f"leads:agent-choices:{organization_id}:{agent_choices_version(organization_id)}"
+    choices = cache.get(key)
+    if choices is None:
+        agents = Agent.objects.for_organization(organization_id).with_user().order_by('id')
+        choices = [(agent.pk, str(agent)) for agent in agents]
+        cache.set(key, choices, settings.AGENT_CHOICES_CACHE_TIMEOUT)
+    return choices
@@ -0,0 +1,77 @@
+from collections import Counter
+
+from django.conf import settings
+
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .freshness import touch_organization
+from .models import Category, Lead, UserProfile
+
+
+def category_counts(leads):
+    """
+    Count `leads` per category with a single GROUP BY. Uncategorized leads
+    are counted under the None key.
+    """
+    return dict(
+        leads.order_by().values_list('category').annotate(count=Count('id'))
+    )
+
+
+def adjust_category_counts(organization_id, deltas, using=None):
+    """
+    Apply {category_id: change} to the maintained Category.lead_count; the
+    None key goes to the organization's uncategorized_lead_count.
+    """
+    for category_id, delta in deltas.items():
+        if not delta:
+            continue
+        if category_id is None:
+            UserProfile.objects.filter(pk=organization_id).update(
+                uncategorized_lead_count=F('uncategorized_lead_count') + delta
+            )
+        else:
+            Category.objects.using(using).filter(pk=category_id).update(lead_count=F('lead_count') + delta)
+
+
+def count_new_leads(leads):
+    """Counter deltas for leads inserted without signals (bulk_create)."""
+    return Counter(lead.category_id for lead in leads)
+
+
+def rebuild_category_counts(organization=None):
+    """
+    Recompute Category.lead_count from the leads table in one UPDATE, and
+    the organizations' uncategorized_lead_count.
+    """
+    counts = (
+        Lead.objects
+        .filter(category=OuterRef('pk'))
+        .order_by()
+        .values('category')
+        .annotate(count=Count('id'))
+        .values('count')
+    )
+    if organization is not None:
+        category_sets = [Category.objects.for_organization(organization)]
+        lead_sets = [Lead.objects.for_organization(organization)]
+        organizations = UserProfile.objects.filter(pk=organization.pk)
+    else:
+        category_sets = [Category.objects.using(shard) for shard in settings.SHARDS]
+        lead_sets = [Lead.objects.using(shard) for shard in settings.SHARDS]
+        organizations = UserProfile.objects.all()
+    updated = sum(
+        categories.update(lead_count=Coalesce(Subquery(counts), Value(0))) for categories in category_sets
+    )
+    # leads live on the organization's shard, profiles on the default database
+    uncategorized = Counter()
+    for leads in lead_sets:
+        uncategorized.update(dict(
+            leads.filter(category__isnull=True).order_by().values_list('organization').annotate(count=Count('id'))
+        ))
+    organizations.exclude(pk__in=list(uncategorized)).update(uncategorized_lead_count=0)
+    for organization_id, count in uncategorized.items():
+        UserProfile.objects.filter(pk=organization_id).update(uncategorized_lead_count=count)
+    touch_organization(organization.pk if organization is not None else None)
+    return updated
@@ -0,0 +1,222 @@
+"""
+Chunked background deletion of organizations, agents and lead sets.
+
+Deleting through the ORM makes the deletion collector load every dependent
+row and remove them all in one transaction, which holds the SQLite write
+lock for as long as that takes. Instead the views enqueue a DeletionJob
+and hide an organization or agent right away (pending_deletion), and
+run_deletion_jobs
+works through the job's stages in chunks of `batch_size` rows: one SELECT
+of the chunk's ids and one raw UPDATE or DELETE, committed together with
+the job's progress and the counter adjustments. An interrupted job picks
+up at its recorded stage; each chunk selects whatever rows are left, so
+repeating one is harmless.
+"""
+import logging
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from .activity import record_activity
+from .choices import invalidate_agent_choices
+from .counters import adjust_category_counts
+from .freshness import touch_organization
+from .models import Agent, Category, DeletionJob, Lead, LeadActivity, User, UserProfile, organization_shard
+from .sharding import shard_atomic, use_shard
+from .workload import adjust_workload, cell, delete_workload
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_agent_deletion(agent):
+    with shard_atomic(agent.organization_id):
+        Agent.objects.for_organization(agent.organization_id).filter(pk=agent.pk).update(pending_deletion=True)
+        job = DeletionJob.objects.create(
+            kind=DeletionJob.AGENT, organization_key=agent.organization_id, params={'agent': agent.pk}
+        )
+        invalidate_agent_choices(agent.organization_id)
+        touch_organization(agent.organization_id)
+    return job
+
+
+def enqueue_lead_deletion(organization, lead_ids=None, category=None):
+    """Delete the given leads, or the leads of `category`, of the organization."""
+    params = {}
+    if lead_ids is not None:
+        params['lead_ids'] = [int(lead_id) for lead_id in lead_ids]
+    if category is not None:
+        params['category'] = category.pk
+    return DeletionJob.objects.create(kind=DeletionJob.LEADS, organization_key=organization.pk, params=params)
+
+
+def enqueue_organization_deletion(organization):
+    with transaction.atomic():
+        UserProfile.objects.filter(pk=organization.pk).update(pending_deletion=True)
+        # the organizer can't log in meanwhile; the last stage deletes the user
+        User.objects.filter(pk=organization.user_id).update(is_active=False)
+        return DeletionJob.objects.create(kind=DeletionJob.ORGANIZATION, organization_key=organization.pk)
+
+
+def _chunk(queryset, batch_size, *fields):
+    return list(queryset.order_by('id').values_list('id', *fields)[:batch_size])
+
+
+def _raw_delete(model, ids, using=None):
+    # no collector, no per row signals: the callers adjust what depends on them
+    connection = connections[using or router.db_for_write(model)]
+    table = connection.ops.quote_name(model._meta.db_table)
+    placeholders = ", ".join(["%s"] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", ids)
+
+
+def job_leads(job):
+    leads = Lead.objects.filter(organization_id=job.organization_key)
+    if job.kind == DeletionJob.AGENT:
+        leads = leads.filter(agent_id=job.params['agent'])
+    elif job.kind == DeletionJob.LEADS:
+        if 'lead_ids' in job.params:
+            leads = leads.filter(id__in=job.params['lead_ids'])
+        if 'category' in job.params:
+            leads = leads.filter(category_id=job.params['category'])
+    return leads
+
+
+def unassign_leads(job, batch_size):
+    rows = _chunk(job_leads(job), batch_size, 'category')
+    if not rows:
+        return 0
+    Lead.objects.filter(id__in=[lead_id for lead_id, _ in rows]).update(agent=None, updated_at=timezone.now())
+    deltas = Counter()
+    for _, category_id in rows:
+        deltas[cell(job.params['agent'], category_id)] -= 1
+        deltas[cell(None, category_id)] += 1
+    adjust_workload(job.organization_key, deltas)
+    record_activity(
+        job.organization_key, [(lead_id, LeadActivity.ASSIGNED, None) for lead_id, _ in rows], router.db_for_write(Lead)
+    )
+    touch_organization(job.organization_key)
+    return len(rows)
+
+
+def delete_lead_rows(organization_id, rows):
+    """
+    Delete the leads of (id, agent_id, category_id) `rows` with one DELETE
+    and apply what their delete signals would have: counters, workload,
+    activity log. Call it inside a transaction.
+    """
+    shard = organization_shard(organization_id)
+    _raw_delete(Lead, [lead_id for lead_id, _, _ in rows], shard)
+    adjust_category_counts(organization_id, {
+        category_id: -count for category_id, count in Counter(category for _, _, category in rows).items()
+    }, shard)
+    adjust_workload(organization_id, {
+        key: -count for key, count in Counter(cell(agent, category) for _, agent, category in rows).items()
+    })
+    record_activity(organization_id, [(lead_id, LeadActivity.DELETED, None) for lead_id, _, _ in rows], shard)
+    touch_organization(organization_id)
+
+
+def delete_leads(job, batch_size):
+    rows = _chunk(job_leads(job), batch_size, 'agent', 'category')
+    if not rows:
+        return 0
+    if job.kind == DeletionJob.ORGANIZATION:
+        # an organization's categories, summary and log go with it, no need to count
+        _raw_delete(Lead, [lead_id for lead_id, _, _ in rows])
+    else:
+        delete_lead_rows(job.organization_key, rows)
+    return len(rows)
+
+
+def delete_agent(job, batch_size):
+    # its leads are unassigned by now, so the collector has nothing to load
+    deleted, _ = Agent.objects.filter(pk=job.params['agent']).delete()
+    return deleted
+
+
+def delete_categories(job, batch_size):
+    ids = [row[0] for row in _chunk(Category.objects.filter(organization_id=job.organization_key), batch_size)]
+    if ids:
+        _raw_delete(Category, ids)
+    return len(ids)
+
+
+def delete_agents(job, batch_size):
+    ids = [row[0] for row in _chunk(Agent.objects.filter(organization_id=job.organization_key), batch_size)]
+    if ids:
+        _raw_delete(Agent, ids)
+    return len(ids)
+
+
+def delete_activity(job, batch_size):
+    ids = [row[0] for row in _chunk(LeadActivity.objects.filter(organization_key=job.organization_key), batch_size)]
+    if ids:
+        _raw_delete(LeadActivity, ids)
+    return len(ids)
+
+
+def delete_organization(job, batch_size):
+    delete_workload(job.organization_key)
+    invalidate_agent_choices(job.organization_key)
+    # the organizer user, and its UserProfile with it
+    deleted, _ = User.objects.filter(userprofile__pk=job.organization_key).delete()
+    return deleted
+
+
+STAGES = {
+    DeletionJob.AGENT: (unassign_leads, delete_agent),
+    DeletionJob.LEADS: (delete_leads,),
+    DeletionJob.ORGANIZATION: (
+        delete_leads, delete_categories, delete_agents, delete_activity, delete_organization
+    ),
+}
+
+
+def run_deletion_job(job, batch_size=None, progress=None):
+    """Run the remaining stages of `job`, one transaction per chunk."""
+    batch_size = batch_size or settings.DELETION_BATCH_SIZE
+    stages = STAGES[job.kind]
+    names = [stage.__name__ for stage in stages]
+    start = names.index(job.stage) if job.stage in names else 0
+    job.status = DeletionJob.RUNNING
+    job.save(update_fields=['status', 'updated_at'])
+    try:
+        for stage in stages[start:]:
+            job.stage = stage.__name__
+            while True:
+                # the stages' queries of leads, agents and categories go to the shard
+                with use_shard(job.organization_key), shard_atomic(job.organization_key):
+                    done = stage(job, batch_size)
+                    job.processed += done
+                    job.save(update_fields=['stage', 'processed', 'updated_at'])
+                if progress:
+                    progress(job)
+                if done < batch_size:
+                    break
+    except Exception as exc:
+        logger.exception("Deletion job %s failed", job.pk)
+        job.status = DeletionJob.FAILED
+        job.last_error = str(exc)
+        job.save(update_fields=['status', 'last_error', 'updated_at'])
+        if progress:
+            progress(job)
+        return job
+    job.status = DeletionJob.DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at', 'updated_at'])
+    return job
+
+
+def run_deletion_jobs(batch_size=None, progress=None, retry_failed=False):
+    """Run every pending job, and interrupted or failed ones, oldest first."""
+    statuses = [DeletionJob.PENDING, DeletionJob.RUNNING]
+    if retry_failed:
+        statuses.append(DeletionJob.FAILED)
+    jobs = 0
+    for job in DeletionJob.objects.filter(status__in=statuses).order_by('id'):
+        run_deletion_job(job, batch_size, progress)
+        jobs += 1
+    return jobs
@@ -0,0 +1,149 @@
+import heapq
+from collections import Counter
+
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from .activity import record_activity
+from .freshness import touch_organization
+from .models import Agent, Lead, LeadActivity, organization_shard
+from .sharding import shard_atomic
+from .workload import adjust_workload, cell, reassign_cells
+
+ROUND_ROBIN = 'round_robin'
+LEAST_LOADED = 'least_loaded'
+STRATEGIES = (ROUND_ROBIN, LEAST_LOADED)
+
+
+def assign_leads(organization, agent, lead_ids=None, batch_size=1000):
+    """
+    Assign the selected leads of the organization, or all of its unassigned
+    leads when `lead_ids` is None, to `agent`: one UPDATE per id-ordered
+    batch of `batch_size` leads, each in its own transaction.
+    """
+    leads = Lead.objects.for_organization(organization)
+    if lead_ids is None:
+        leads = leads.filter(agent__isnull=True)
+    else:
+        leads = leads.filter(id__in=lead_ids)
+    updated = 0
+    last_id = 0
+    while True:
+        with shard_atomic(organization):
+            # lock the batch so the UPDATE matches exactly the rows read:
+            # their ids for the activity log, the workload cells they leave
+            rows = list(
+                leads.select_for_update().filter(id__gt=last_id).order_by('id')
+                .values_list('id', 'agent', 'category')[:batch_size]
+            )
+            if not rows:
+                break
+            first_id, last_id = rows[0][0], rows[-1][0]
+            cells = Counter(cell(agent_id, category_id) for _, agent_id, category_id in rows)
+            # update() bypasses auto_now and the save signals
+            updated += leads.filter(id__gte=first_id, id__lte=last_id).update(agent=agent, updated_at=timezone.now())
+            adjust_workload(organization.pk, reassign_cells(cells, agent.pk))
+            record_activity(
+                organization.pk, [(lead_id, LeadActivity.ASSIGNED, agent.pk) for lead_id, _, _ in rows],
+                organization_shard(organization),
+            )
+            touch_organization(organization.pk)
+    return updated
+
+
+def agent_loads(organization):
+    """Number of leads assigned to each agent of the organization, in one query."""
+    return dict(
+        Agent.objects.for_organization(organization)
+        .annotate(load=Count('lead'))
+        .order_by('id')
+        .values_list('id', 'load')
+    )
+
+
+def plan_round_robin(lead_ids, agent_ids, start):
+    plan = {}
+    for offset, lead_id in enumerate(lead_ids):
+        plan.setdefault(agent_ids[(start + offset) % len(agent_ids)], []).append(lead_id)
+    return plan
+
+
+def plan_least_loaded(lead_ids, loads):
+    """Give each lead to the agent with the fewest leads; updates `loads`."""
+    heap = [(load, agent_id) for agent_id, load in loads.items()]
+    heapq.heapify(heap)
+    plan = {}
+    for lead_id in lead_ids:
+        load, agent_id = heapq.heappop(heap)
+        plan.setdefault(agent_id, []).append(lead_id)
+        loads[agent_id] = load + 1
+        heapq.heappush(heap, (load + 1, agent_id))
+    return plan
+
+
+def round_robin_key(organization):
+    return f"leads:round-robin:{organization.pk}"
+
+
+def distribute_leads(organization, strategy=LEAST_LOADED, lead_ids=None, batch_size=1000):
+    """
+    Spread the organization's unassigned leads (or the unassigned ones among
+    `lead_ids`) over its agents. Agent loads are read with one aggregated
+    query; leads are then handled in id-ordered chunks of `batch_size`, with
+    one UPDATE per agent per chunk. The round robin position is kept in the
+    cache so consecutive calls, e.g. one per created lead, keep rotating.
+    Returns the number of leads assigned.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown distribution strategy {strategy!r}")
+    loads = agent_loads(organization)
+    if not loads:
+        return 0
+    agent_ids = list(loads)
+    position = cache.get(round_robin_key(organization), 0) if strategy == ROUND_ROBIN else 0
+
+    unassigned = Lead.objects.for_organization(organization).filter(agent__isnull=True)
+    if lead_ids is not None:
+        unassigned = unassigned.filter(id__in=lead_ids)
+    assigned = 0
+    last_id = 0
+    while True:
+        chunk = list(unassigned.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not chunk:
+            break
+        last_id = chunk[-1]
+        if strategy == ROUND_ROBIN:
+            plan = plan_round_robin(chunk, agent_ids, position)
+            position = (position + len(chunk)) % len(agent_ids)
+        else:
+            plan = plan_least_loaded(chunk, loads)
+        now = timezone.now()
+        with shard_atomic(organization):
+            chunk_assigned = 0
+            for agent_id, ids in plan.items():
+                # leads assigned meanwhile by someone else are left alone
+                chunk_assigned += unassigned.filter(id__in=ids).update(agent_id=agent_id, updated_at=now)
+            if not chunk_assigned:
+                continue
+            assigned += chunk_assigned
+            # the rows this chunk's UPDATEs matched, by their timestamp
+            rows = list(
+                Lead.objects.for_organization(organization)
+                .filter(id__in=chunk, agent__isnull=False, updated_at=now)
+                .values_list('id', 'agent', 'category')
+            )
+            deltas = Counter()
+            for lead_id, agent_id, category_id in rows:
+                deltas[cell(None, category_id)] -= 1
+                deltas[cell(agent_id, category_id)] += 1
+            adjust_workload(organization.pk, deltas)
+            record_activity(
+                organization.pk, [(lead_id, LeadActivity.ASSIGNED, agent_id) for lead_id, agent_id, _ in rows],
+                organization_shard(organization),
+            )
+            touch_organization(organization.pk)
+
+    if strategy == ROUND_ROBIN:
+        cache.set(round_robin_key(organization), position, None)
+    return assigned
@@ -0,0 +1,145 @@
+"""
+Duplicate lead detection and merging.
+
+find_duplicates never compares all pairs of an organization's leads. One
+GROUP BY on the (organization, block_key) index finds the blocks holding
+more than one lead, one ordered scan reads just those leads, and only
+leads of the same block are compared, so the work grows with the number
+of leads times the (small) block sizes. Within a block, leads are sorted
+by age and each is compared only with those at most AGE_TOLERANCE years
+older. Blocks larger than `max_block_size`, e.g. thousands of leads with
+a placeholder name, are skipped rather than compared pairwise.
+"""
+import re
+from difflib import SequenceMatcher
+from itertools import groupby
+
+from django.db.models import Count
+
+from .blocking import blocking_key, name_tokens
+from .deletion import delete_lead_rows
+from .models import Lead
+from .sharding import shard_atomic
+
+# ages of the same person entered at different times
+AGE_TOLERANCE = 2
+NAME_SIMILARITY = 0.85
+MAX_BLOCK_SIZE = 500
+
+
+class DuplicateGroup:
+    """Leads of one person: the oldest is kept, the others merged into it."""
+
+    def __init__(self, leads):
+        leads = sorted(leads, key=lambda lead: lead.pk)
+        self.survivor = leads[0]
+        self.duplicates = leads[1:]
+
+    def __iter__(self):
+        yield self.survivor
+        yield from self.duplicates
+
+
+def normalized_name(lead):
+    return ' '.join(sorted(name_tokens(lead.first_name, lead.last_name)))
+
+
+def name_numbers(lead):
+    # blocking ignores digits, but "Test Lead 2" and "Test Lead 3" differ
+    return set(re.findall(r'\d+', f"{lead.first_name} {lead.last_name}"))
+
+
+def is_duplicate(lead, other):
+    if abs(lead.age - other.age) > AGE_TOLERANCE or name_numbers(lead) != name_numbers(other):
+        return False
+    return SequenceMatcher(None, normalized_name(lead), normalized_name(other)).ratio() >= NAME_SIMILARITY
+
+
+def group_block(leads):
+    """Split the leads of one block into groups of duplicates (union-find)."""
+    leads = sorted(leads, key=lambda lead: lead.age)
+    parents = list(range(len(leads)))
+
+    def root(position):
+        while parents[position] != position:
+            parents[position] = parents[parents[position]]
+            position = parents[position]
+        return position
+
+    for first in range(len(leads)):
+        for second in range(first + 1, len(leads)):
+            if leads[second].age - leads[first].age > AGE_TOLERANCE:
+                break
+            if is_duplicate(leads[first], leads[second]):
+                parents[root(second)] = root(first)
+    groups = {}
+    for position, lead in enumerate(leads):
+        groups.setdefault(root(position), []).append(lead)
+    return [DuplicateGroup(group) for group in groups.values() if len(group) > 1]
+
+
+def find_duplicates(organization, max_block_size=MAX_BLOCK_SIZE):
+    """Yield the organization's DuplicateGroups, block by block."""
+    leads = Lead.objects.for_organization(organization)
+    blocks = (
+        leads.order_by().values('block_key')
+        .annotate(size=Count('id'))
+        .filter(size__gt=1, size__lte=max_block_size)
+        .values('block_key')
+    )
+    candidates = (
+        leads.filter(block_key__in=blocks)
+        .order_by('block_key', 'id')
+        .only('id', 'first_name', 'last_name', 'age', 'agent', 'category', 'block_key')
+    )
+    for _, block in groupby(candidates.iterator(chunk_size=2000), key=lambda lead: lead.block_key):
+        yield from group_block(list(block))
+
+
+def merge_leads(organization, survivor_id, duplicate_ids):
+    """
+    Merge the duplicates into the survivor: it takes the agent and the
+    category of the first duplicate that has one where it has none, then
+    the duplicates are deleted with one DELETE. Returns how many were.
+    """
+    leads = Lead.objects.for_organization(organization)
+    with shard_atomic(organization):
+        survivor = leads.get(pk=survivor_id)
+        rows = list(
+            leads.filter(id__in=duplicate_ids).exclude(pk=survivor.pk)
+            .order_by('id').values_list('id', 'agent', 'category')
+        )
+        if not rows:
+            return 0
+        changed = []
+        agent_id = next((agent_id for _, agent_id, _ in rows if agent_id), None)
+        if survivor.agent_id is None and agent_id is not None:
+            survivor.agent_id = agent_id
+            changed.append('agent')
+        category_id = next((category_id for _, _, category_id in rows if category_id), None)
+        if survivor.category_id is None and category_id is not None:
+            survivor.category_id = category_id
+            changed.append('category')
+        if changed:
+            # the save signals move the counters and log the change
+            survivor.save(update_fields=changed + ['updated_at'])
+        delete_lead_rows(organization.pk, rows)
+    return len(rows)
+
+
+def rebuild_block_keys(organization=None, batch_size=1000):
+    """Recompute Lead.block_key, e.g. after changing the blocking rules."""
+    leads = Lead.objects.all()
+    if organization is not None:
+        leads = leads.for_organization(organization)
+    updated = 0
+    last_id = 0
+    while True:
+        batch = list(leads.filter(id__gt=last_id).order_by('id').only('first_name', 'last_name')[:batch_size])
+        if not batch:
+            return updated
+        for lead in batch:
+            lead.block_key = blocking_key(lead.first_name, lead.last_name)
+        leads.bulk_update(batch, ['block_key'])
+        updated += len(batch)
+        last_id = batch[-1].pk
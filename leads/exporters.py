@@ -0,0 +1,77 @@
+import csv
+import json
+
+from crm.db import is_directory_database
+from .models import Agent, User
+
+EXPORT_COLUMNS = ('id', 'first_name', 'last_name', 'age', 'agent', 'category')
+# the agent and category columns use the same names the importer accepts
+EXPORT_FIELDS = ('id', 'first_name', 'last_name', 'age', 'agent__user__username', 'category__name')
+AGENT_COLUMN = EXPORT_COLUMNS.index('agent')
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+class Echo:
+    """File-like object that hands back what is written, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def agent_usernames(leads):
+    """{agent_id: username} of the agents of `leads`, the users read from the default database."""
+    agents = dict(Agent.objects.using(leads.db).filter(id__in=leads.values('agent')).values_list('id', 'user'))
+    usernames = dict(User.objects.filter(id__in=list(agents.values())).values_list('id', 'username'))
+    return {agent_id: usernames.get(user_id) for agent_id, user_id in agents.items()}
+
+
+def export_rows(queryset, chunk_size=2000):
+    """Iterate a flat projection of the leads without building model instances."""
+    queryset = queryset.order_by('id')
+    if is_directory_database(queryset.db):
+        return queryset.values_list(*EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+    # a shard has no users to join: export the agent ids and map them
+    usernames = agent_usernames(queryset)
+    fields = EXPORT_FIELDS[:AGENT_COLUMN] + ('agent',) + EXPORT_FIELDS[AGENT_COLUMN + 1:]
+    return (
+        row[:AGENT_COLUMN] + (usernames.get(row[AGENT_COLUMN]),) + row[AGENT_COLUMN + 1:]
+        for row in queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+    )
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n"
+
+
+def buffered(lines, size=64 * 1024):
+    """Join small lines into chunks of about `size` characters."""
+    buffer = []
+    length = 0
+    for line in lines:
+        buffer.append(line)
+        length += len(line)
+        if length >= size:
+            yield "".join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def export_leads(queryset, format, chunk_size=2000):
+    # the lines are produced while the response streams, after the request's
+    # routing context (shard, read connection) is gone: bind the database now
+    rows = export_rows(queryset.using(queryset.db), chunk_size)
+    lines = csv_lines(rows) if format == 'csv' else jsonl_lines(rows)
+    return buffered(lines)
@@ -1,14 +1,70 @@
 from django import forms
-from .models import Lead, User, Agent
+from .models import Lead, User, Agent, Category
 from django.contrib.auth.forms import UserCreationForm
+from .choices import agent_choices
+
+
+class TenantAgentChoiceField(forms.ModelChoiceField):
+    """
+    Agent choice limited to one organization. The options come from the
+    per-organization choices cache instead of a query per render; only a
+    submitted value is looked up, within the organization.
+    """
+
+    def __init__(self, **kwargs):
+        self.organization = None
+        super(TenantAgentChoiceField, self).__init__(queryset=Agent.objects.none(), **kwargs)
+
+    def set_organization(self, organization):
+        self.organization = organization
+        if organization is None:
+            self.queryset = Agent.objects.none()
+        else:
+            self.queryset = Agent.objects.for_organization(organization)
+
+    def _get_choices(self):
+        choices = [] if self.empty_label is None else [("", self.empty_label)]
+        if self.organization is not None:
+            choices += agent_choices(self.organization.pk)
+        return choices
+
+    choices = property(_get_choices, forms.ChoiceField._set_choices)
+
 
 class LeadModelForm(forms.ModelForm):
+    agent = TenantAgentChoiceField(required=False)
+
     class Meta:
         model = Lead
         fields = (
             'first_name', 'last_name', 'age', 'agent'
         )
 
+    def __init__(self, *args, organization=None, **kwargs):
+        super(LeadModelForm, self).__init__(*args, **kwargs)
+        if 'agent' in self.fields:
+            self.fields['agent'].set_organization(organization)
+
+
+class LeadImportRowForm(LeadModelForm):
+    """Validates one imported row; agent and category are resolved by the importer."""
+    agent = None
+
+    class Meta(LeadModelForm.Meta):
+        fields = (
+            'first_name', 'last_name', 'age'
+        )
+
+
+class LeadImportForm(forms.Form):
+    FORMAT_CHOICES = (
+        ('', 'Detect from file name'),
+        ('csv', 'CSV'),
+        ('jsonl', 'JSON Lines'),
+    )
+    file = forms.FileField(help_text='Columns: first_name, last_name, age, agent (username or email), category (name).')
+    format = forms.ChoiceField(choices=FORMAT_CHOICES, required=False)
+
 
 class LeadForm(forms.Form):
     first_name = forms.CharField()
@@ -25,7 +81,7 @@ class SignUpForm(UserCreationForm):
         fields = ('username', 'first_name', 'last_name', 'email', 'password1', 'password2', )
 
 class AssignAgentForm(forms.Form):
-    agent = forms.ModelChoiceField(queryset=Agent.objects.none())
+    agent = TenantAgentChoiceField()
     
     # With this method we are refreshing the agents based on the request user.
     # We are not hardcoding it.
@@ -33,9 +89,53 @@ class AssignAgentForm(forms.Form):
     def __init__(self, *args, **kwargs):
         request = kwargs.pop("request")
         #print(request.user)
-        agents = Agent.objects.filter(organization=request.user.userprofile)
         super(AssignAgentForm, self).__init__(*args, **kwargs)
-        self.fields["agent"].queryset = agents
+        self.fields["agent"].set_organization(request.tenant.organization)
+
+
+class LeadIdsField(forms.Field):
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        try:
+            return [int(lead_id) for lead_id in value or []]
+        except (TypeError, ValueError):
+            raise forms.ValidationError("Invalid lead selection.")
+
+
+class BulkAssignAgentForm(AssignAgentForm):
+    leads = LeadIdsField(required=False)
+    all_unassigned = forms.BooleanField(required=False, label="Assign all unassigned leads")
+
+    def clean(self):
+        cleaned_data = super(BulkAssignAgentForm, self).clean()
+        if not cleaned_data.get("leads") and not cleaned_data.get("all_unassigned"):
+            raise forms.ValidationError("Select some leads or assign all unassigned leads.")
+        return cleaned_data
+
+
+class BulkLeadDeleteForm(forms.Form):
+    leads = LeadIdsField(required=False)
+    category = forms.ModelChoiceField(
+        queryset=Category.objects.none(), required=False, label="Delete all leads of category"
+    )
+
+    def __init__(self, *args, **kwargs):
+        request = kwargs.pop("request")
+        super(BulkLeadDeleteForm, self).__init__(*args, **kwargs)
+        self.fields["category"].queryset = Category.objects.for_tenant(request.tenant)
+
+    def clean(self):
+        cleaned_data = super(BulkLeadDeleteForm, self).clean()
+        if not cleaned_data.get("leads") and not cleaned_data.get("category"):
+            raise forms.ValidationError("Select some leads or a category.")
+        return cleaned_data
+
+
+class LeadMergeForm(forms.Form):
+    survivor = forms.IntegerField(widget=forms.HiddenInput)
+    duplicates = LeadIdsField()
+
     
 class LeadCategoryUpdateForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,170 @@
+import csv
+import json
+import os
+
+from .activity import new_lead_events, record_activity
+from .counters import adjust_category_counts, count_new_leads
+from .forms import LeadImportRowForm
+from .freshness import touch_organization
+from .models import Agent, Category, Lead, organization_shard
+from .sharding import shard_atomic
+from .workload import adjust_workload, new_lead_cells
+
+FORMATS = ('csv', 'jsonl')
+
+
+def detect_format(filename, default='csv'):
+    extension = os.path.splitext(filename or '')[1].lstrip('.').lower()
+    if extension in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    if extension == 'csv':
+        return 'csv'
+    return default
+
+
+class UndecodableLine(ValueError):
+
+    def __init__(self, line_number):
+        super().__init__("Not UTF-8 text: the file was only read up to this line.")
+        self.line_number = line_number
+
+
+def open_text(binary_file):
+    """
+    Decode an uploaded or opened binary file one line at a time for
+    streaming text reads. A line that isn't UTF-8 raises UndecodableLine.
+    """
+    for line_number, line in enumerate(binary_file, start=1):
+        try:
+            yield line.decode('utf-8-sig' if line_number == 1 else 'utf-8')
+        except UnicodeDecodeError:
+            raise UndecodableLine(line_number) from None
+
+
+def read_rows(stream, format):
+    """
+    Yield (line number, row dict) pairs one at a time from a text stream.
+    A row that can't be parsed is yielded as the exception instead; an
+    undecodable line ends the stream.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown import format {format!r}")
+    try:
+        if format == 'csv':
+            reader = csv.DictReader(stream)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(stream, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as exc:
+                    yield line_number, exc
+                    continue
+                yield line_number, row
+    except UndecodableLine as exc:
+        yield exc.line_number, exc
+
+
+class ImportResult:
+
+    def __init__(self, max_errors):
+        self.max_errors = max_errors
+        self.processed = 0
+        self.created = 0
+        self.rejected = 0
+        self.errors = []
+
+    def reject(self, line_number, message):
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line_number, message))
+
+
+class LeadImporter:
+    """
+    Stream leads from a CSV or JSON Lines file into an organization.
+
+    Rows are validated with the LeadModelForm rules. The optional `agent`
+    column is matched against the username or email of the organization's
+    agents and `category` against category names, using maps loaded once up
+    front. Valid rows are inserted with bulk_create, one transaction per
+    batch, so memory stays bounded by `batch_size` whatever the file size.
+    Only the first `max_errors` rejected rows are kept in the result; pass
+    `on_reject` to see all of them.
+    """
+
+    def __init__(self, organization, batch_size=1000, max_errors=100, progress=None, on_reject=None):
+        self.organization = organization
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.progress = progress
+        self.on_reject = on_reject
+        self.agents = {}
+        for agent in Agent.objects.for_organization(organization).with_user():
+            self.agents[agent.user.username.lower()] = agent.pk
+            if agent.user.email:
+                self.agents[agent.user.email.lower()] = agent.pk
+        self.categories = {
+            name.lower(): category_id
+            for category_id, name in Category.objects.for_organization(organization).values_list('id', 'name')
+        }
+
+    def run(self, stream, format):
+        result = ImportResult(self.max_errors)
+        batch = []
+        for line_number, row in read_rows(stream, format):
+            result.processed += 1
+            lead, error = self.build_lead(row)
+            if error:
+                result.reject(line_number, error)
+                if self.on_reject:
+                    self.on_reject(line_number, row, error)
+                continue
+            batch.append(lead)
+            if len(batch) >= self.batch_size:
+                self.save_batch(batch, result)
+                batch = []
+        if batch:
+            self.save_batch(batch, result)
+        return result
+
+    def build_lead(self, row):
+        if isinstance(row, UndecodableLine):
+            return None, str(row)
+        if not isinstance(row, dict):
+            return None, f"Invalid row: {row}"
+        row = {key.strip().lower(): value for key, value in row.items() if key}
+        form = LeadImportRowForm(data=row)
+        if not form.is_valid():
+            return None, "; ".join(
+                f"{field}: {' '.join(messages)}" for field, messages in form.errors.items()
+            )
+        lead = form.save(commit=False)
+        lead.organization = self.organization
+        agent = str(row.get('agent') or '').strip()
+        if agent:
+            lead.agent_id = self.agents.get(agent.lower())
+            if lead.agent_id is None:
+                return None, f"agent: Unknown agent {agent!r}."
+        category = str(row.get('category') or '').strip()
+        if category:
+            lead.category_id = self.categories.get(category.lower())
+            if lead.category_id is None:
+                return None, f"category: Unknown category {category!r}."
+        return lead, None
+
+    def save_batch(self, batch, result):
+        shard = organization_shard(self.organization)
+        with shard_atomic(self.organization):
+            Lead.objects.using(shard).bulk_create(batch)
+            # bulk_create sends no signals, so update the counters here
+            adjust_category_counts(self.organization.pk, count_new_leads(batch), shard)
+            adjust_workload(self.organization.pk, new_lead_cells(batch))
+            record_activity(self.organization.pk, new_lead_events(self.organization, batch), shard)
+            touch_organization(self.organization.pk)
+        result.created += len(batch)
+        if self.progress:
+            self.progress(result)
@@ -0,0 +1,122 @@
+import datetime
+import logging
+import uuid
+
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+
+def queue_mail(subject, message, from_email, recipient_list):
+    """
+    Drop-in replacement for send_mail() that writes to the outbox instead of
+    talking to the mail server. Call it inside the transaction that makes
+    the change so the mail is only queued if that change commits.
+    """
+    return OutgoingEmail.objects.create(
+        subject=subject,
+        message=message,
+        from_email=from_email,
+        recipients="\n".join(recipient_list),
+    )
+
+
+def queue_mass_mail(datatuple):
+    """
+    Like send_mass_mail(): queue one message per (subject, message,
+    from_email, recipient_list) tuple, with a single INSERT.
+    """
+    return OutgoingEmail.objects.bulk_create([
+        OutgoingEmail(
+            subject=subject,
+            message=message,
+            from_email=from_email,
+            recipients="\n".join(recipient_list),
+        )
+        for subject, message, from_email, recipient_list in datatuple
+    ])
+
+
+def retry_delay(attempts, backoff):
+    """Exponential backoff: backoff, 2*backoff, 4*backoff... seconds."""
+    return datetime.timedelta(seconds=backoff * 2 ** (attempts - 1))
+
+
+def claim_due_mail(worker, batch_size, lease):
+    """
+    Claim up to `batch_size` due messages for `worker` with one conditional
+    UPDATE and return them: a message another worker claimed meanwhile no
+    longer matches, so no message is sent twice. Messages whose claim
+    expired, i.e. whose worker died while sending, are due again.
+    """
+    now = timezone.now()
+    due = OutgoingEmail.objects.filter(
+        status__in=[OutgoingEmail.PENDING, OutgoingEmail.SENDING], next_attempt_at__lte=now,
+    )
+    ids = list(due.order_by('next_attempt_at', 'id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    due.filter(id__in=ids).update(
+        status=OutgoingEmail.SENDING, claimed_by=worker, next_attempt_at=now + datetime.timedelta(seconds=lease),
+    )
+    return list(
+        OutgoingEmail.objects.filter(id__in=ids, status=OutgoingEmail.SENDING, claimed_by=worker).order_by('id')
+    )
+
+
+def send_queued_mail(batch_size=100, max_attempts=5, backoff=60, connection=None, lease=600):
+    """
+    Send due outbox mail in batches of `batch_size` until nothing is due,
+    reusing a single mail connection for every message. Each batch is
+    claimed for `lease` seconds first, so several workers can run at once.
+    Failed messages are retried with exponential backoff and given up on
+    after `max_attempts`. Returns a (sent, failed) tuple.
+    """
+    connection = connection or get_connection()
+    worker = uuid.uuid4().hex
+    sent = failed = 0
+    while True:
+        batch = claim_due_mail(worker, batch_size, lease)
+        if not batch:
+            return sent, failed
+        try:
+            connection.open()
+        except Exception as exc:
+            logger.exception("Could not open the mail connection")
+            for email in batch:
+                _record_failure(email, exc, max_attempts, backoff)
+            return sent, failed + len(batch)
+        for email in batch:
+            message = EmailMessage(
+                subject=email.subject,
+                body=email.message,
+                from_email=email.from_email,
+                to=email.recipient_list,
+                connection=connection,
+            )
+            try:
+                message.send()
+            except Exception as exc:
+                logger.warning("Sending outgoing email %s failed: %s", email.pk, exc)
+                _record_failure(email, exc, max_attempts, backoff)
+                failed += 1
+            else:
+                email.status = OutgoingEmail.SENT
+                email.attempts += 1
+                email.sent_at = timezone.now()
+                email.save(update_fields=['status', 'attempts', 'sent_at'])
+                sent += 1
+
+
+def _record_failure(email, exc, max_attempts, backoff):
+    email.attempts += 1
+    email.last_error = str(exc)
+    if email.attempts >= max_attempts:
+        email.status = OutgoingEmail.FAILED
+    else:
+        email.status = OutgoingEmail.PENDING
+        email.next_attempt_at = timezone.now() + retry_delay(email.attempts, backoff)
+    email.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at'])
@@ -0,0 +1,133 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from leads.models import Lead
+from leads.seeding import seed_organization
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a large throwaway dataset and report the SQLite query plan and "
+        "timing of every lead view queryset without and with the tenant "
+        "indexes. Everything runs in one transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organizations', type=int, default=5)
+        parser.add_argument('--leads', type=int, default=100000, help="Leads per organization.")
+        parser.add_argument('--agents', type=int, default=20, help="Agents per organization.")
+        parser.add_argument('--categories', type=int, default=10, help="Categories per organization.")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("This benchmark reads SQLite's EXPLAIN QUERY PLAN output.")
+        try:
+            with transaction.atomic():
+                self.run(options)
+                raise Rollback
+        except Rollback:
+            self.stdout.write("Benchmark data rolled back.")
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        self.stdout.write("Seeding...")
+        organizations = [
+            seed_organization(
+                f"benchmark-org-{number}",
+                agents=options['agents'],
+                categories=options['categories'],
+                leads=options['leads'],
+                rng=rng,
+            )
+            for number in range(options['organizations'])
+        ]
+        cases = self.get_cases(organizations[0])
+
+        self.drop_indexes()
+        self.analyze()
+        before = self.measure(cases, options['repeat'])
+        self.create_indexes()
+        self.analyze()
+        after = self.measure(cases, options['repeat'])
+
+        for name, _ in cases:
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for label, results in (("before", before), ("after", after)):
+                plan, timing = results[name]
+                self.stdout.write(f"  {label}: {timing * 1000:.2f} ms")
+                for line in plan:
+                    self.stdout.write(f"    {line}")
+
+    def get_cases(self, organization):
+        """The querysets the lead and category views run for one request."""
+        agent = organization.agent_set.select_related('user').first()
+        category = organization.category_set.first()
+        lead = Lead.objects.filter(organization=organization).order_by('-id').first()
+        page = 21
+        return [
+            ("lead-list (organizer, assigned)", lambda: list(
+                Lead.objects.filter(organization=organization, agent__isnull=False).order_by('-score', '-id')[:page])),
+            ("lead-list (organizer, unassigned)", lambda: list(
+                Lead.objects.filter(organization=organization, agent__isnull=True).order_by('-score', '-id')[:page])),
+            ("lead-list (agent)", lambda: list(
+                Lead.objects.filter(organization=organization, agent__user=agent.user).order_by('-score', '-id')[:page])),
+            ("lead-detail", lambda: list(
+                Lead.objects.filter(organization=organization, pk=lead.pk))),
+            ("category-list (unassigned count)", lambda:
+                Lead.objects.filter(organization=organization, category__isnull=True).count()),
+            ("category-detail", lambda: list(
+                Lead.objects.filter(organization=organization, category=category).order_by('id')[:page])),
+        ]
+
+    def measure(self, cases, repeat):
+        results = {}
+        for name, run in cases:
+            recorder = PlanRecorder()
+            with connection.execute_wrapper(recorder):
+                run()
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - start)
+            results[name] = (recorder.plan, statistics.median(timings))
+        return results
+
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            for index in Lead._meta.indexes:
+                cursor.execute(f'DROP INDEX IF EXISTS {connection.ops.quote_name(index.name)}')
+
+    def create_indexes(self):
+        schema_editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            for index in Lead._meta.indexes:
+                cursor.execute(str(index.create_sql(Lead, schema_editor)))
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+
+class PlanRecorder:
+    """execute_wrapper that captures the query plan of the last SELECT."""
+
+    def __init__(self):
+        self.plan = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith('SELECT'):
+            cursor = context['cursor']
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            self.plan = [row[-1] for row in cursor.fetchall()]
+        return execute(sql, params, many, context)
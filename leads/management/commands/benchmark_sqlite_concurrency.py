@@ -0,0 +1,106 @@
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from crm.db import sqlite_pragmas
+
+ORGANIZATIONS = 10
+PAGE = 21
+
+PROFILES = {
+    # what a bare sqlite3 connection does: rollback journal, full fsync and
+    # the 5 s busy handler of Python's sqlite3 module
+    'default': ["PRAGMA journal_mode = DELETE"],
+    'production': sqlite_pragmas(),
+}
+
+
+def create_database(path, rows, pragmas):
+    connection = sqlite3.connect(path, isolation_level=None)
+    for statement in pragmas:
+        connection.execute(statement)
+    connection.execute(
+        "CREATE TABLE lead (id INTEGER PRIMARY KEY, organization_id INTEGER NOT NULL, "
+        "agent_id INTEGER, first_name TEXT, last_name TEXT)"
+    )
+    connection.execute("CREATE INDEX lead_org_agent_idx ON lead (organization_id, agent_id)")
+    connection.execute("BEGIN")
+    connection.executemany(
+        "INSERT INTO lead (organization_id, agent_id, first_name, last_name) VALUES (?, ?, ?, ?)",
+        ((number % ORGANIZATIONS, number % 50, f"First{number}", f"Last{number}") for number in range(rows)),
+    )
+    connection.execute("COMMIT")
+    connection.close()
+
+
+def run_worker(path, pragmas, seconds, write_ratio, rows, seed):
+    """
+    Mix of lead page reads and single row writes in autocommit, like the
+    views. Returns (reads, writes, "database is locked" errors).
+    """
+    connection = sqlite3.connect(path, isolation_level=None)
+    for statement in pragmas:
+        connection.execute(statement)
+    rng = random.Random(seed)
+    reads = writes = errors = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        try:
+            if rng.random() < write_ratio:
+                connection.execute(
+                    "UPDATE lead SET agent_id = ? WHERE id = ?", (rng.randrange(50), rng.randrange(1, rows + 1))
+                )
+                writes += 1
+            else:
+                connection.execute(
+                    "SELECT id, first_name, last_name FROM lead WHERE organization_id = ? AND id > ? "
+                    "ORDER BY id LIMIT ?",
+                    (rng.randrange(ORGANIZATIONS), rng.randrange(rows), PAGE),
+                ).fetchall()
+                reads += 1
+        except sqlite3.OperationalError:
+            errors += 1
+    connection.close()
+    return reads, writes, errors
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the throughput of concurrent worker processes reading and "
+        "writing one SQLite file, with SQLite's default settings and with the "
+        "SQLITE_PRAGMAS production profile. Uses throwaway database files."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', default='1,2,4,8', help="Comma separated worker counts.")
+        parser.add_argument('--seconds', type=float, default=3.0, help="Run time per measurement.")
+        parser.add_argument('--write-ratio', type=float, default=0.1, help="Share of operations that write.")
+        parser.add_argument('--rows', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        worker_counts = [int(count) for count in options['workers'].split(',')]
+        self.stdout.write(f"{'profile':12} {'workers':>7} {'ops/s':>10} {'reads':>9} {'writes':>8} {'locked':>7}")
+        with tempfile.TemporaryDirectory() as directory:
+            for profile, pragmas in PROFILES.items():
+                path = os.path.join(directory, f"{profile}.sqlite3")
+                create_database(path, options['rows'], pragmas)
+                for workers in worker_counts:
+                    reads, writes, errors = self.measure(path, pragmas, workers, options)
+                    throughput = (reads + writes) / options['seconds']
+                    self.stdout.write(
+                        f"{profile:12} {workers:7} {throughput:10.0f} {reads:9} {writes:8} {errors:7}"
+                    )
+
+    def measure(self, path, pragmas, workers, options):
+        arguments = [
+            (path, pragmas, options['seconds'], options['write_ratio'], options['rows'], seed)
+            for seed in range(workers)
+        ]
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.starmap(run_worker, arguments)
+        return tuple(sum(column) for column in zip(*results))
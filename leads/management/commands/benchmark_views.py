@@ -0,0 +1,189 @@
+import json
+import random
+import statistics
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.auth.tokens import default_token_generator
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, setup_databases, setup_test_environment,
+    teardown_databases, teardown_test_environment,
+)
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from leads.models import Lead
+from leads.seeding import seed_organization
+
+DEFAULT_BUDGETS = settings.BASE_DIR / 'crm' / 'query_budgets.json'
+# namespaces driven as a logged in organizer and agent; everything else
+# (landing and auth pages) is requested anonymously
+TENANT_NAMESPACES = ('leads', 'agents')
+# GET on these has side effects on the benchmark clients
+SKIPPED = ('logout',)
+
+
+def iter_patterns(patterns, namespace=None):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            if pattern.namespace == 'admin':
+                continue
+            child = pattern.namespace or namespace
+            if namespace and pattern.namespace:
+                child = f"{namespace}:{pattern.namespace}"
+            yield from iter_patterns(pattern.url_patterns, child)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            yield f"{namespace}:{pattern.name}" if namespace else pattern.name, pattern
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive every named URL of the leads, agents and crm url confs through "
+        "the test Client against a seeded test database, record p50/p95 "
+        "latency and query counts per view into a JSON report and fail when a "
+        "view issues more queries than its checked-in budget."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=20, help="Requests per view.")
+        parser.add_argument('--organizations', type=int, default=3)
+        parser.add_argument('--agents', type=int, default=10)
+        parser.add_argument('--categories', type=int, default=5)
+        parser.add_argument('--leads', type=int, default=2000, help="Leads per organization.")
+        parser.add_argument('--output', default='benchmark_report.json')
+        parser.add_argument('--budgets', default=str(DEFAULT_BUDGETS))
+        parser.add_argument('--update-budgets', action='store_true', help="Write the measured query counts as the new budgets.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        try:
+            report = self.run(options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+        self.stdout.write(f"Report written to {options['output']}")
+
+        if options['update_budgets']:
+            budgets = {key: result['queries_max'] for key, result in report.items()}
+            with open(options['budgets'], 'w') as output:
+                json.dump(budgets, output, indent=2, sort_keys=True)
+                output.write("\n")
+            self.stdout.write(f"Budgets written to {options['budgets']}")
+            return
+        self.check_budgets(report, options['budgets'])
+
+    def run(self, options):
+        rng = random.Random(0)
+        organizations = [
+            seed_organization(
+                f"benchmark-org-{number}",
+                agents=options['agents'],
+                categories=options['categories'],
+                leads=options['leads'],
+                skew=1.0,
+                rng=rng,
+            )
+            for number in range(options['organizations'])
+        ]
+        organization = organizations[0]
+        agent = organization.agent_set.select_related('user').first()
+        lead = Lead.objects.for_organization(organization).filter(agent=agent).order_by('id').first()
+        objects = {
+            'lead': lead.pk,
+            'category': organization.category_set.order_by('id').first().pk,
+            'agent': agent.pk,
+        }
+
+        clients = {'anonymous': Client(), 'organizer': Client(), 'agent': Client()}
+        clients['organizer'].force_login(organization.user)
+        clients['agent'].force_login(agent.user)
+
+        report = {}
+        for name, pattern in iter_patterns(get_resolver().url_patterns):
+            if name in SKIPPED:
+                continue
+            namespace = name.split(':')[0] if ':' in name else None
+            roles = ('organizer', 'agent') if namespace in TENANT_NAMESPACES else ('anonymous',)
+            url = reverse(name, kwargs=self.get_kwargs(name, pattern, objects, organization))
+            for role in roles:
+                report[f"{role} {name}"] = self.measure(clients[role], url, options['requests'])
+                self.stdout.write(f"{role:10} {name:32} {self.format_result(report[f'{role} {name}'])}")
+        return report
+
+    def get_kwargs(self, name, pattern, objects, organization):
+        converters = pattern.pattern.converters
+        if 'uidb64' in converters:
+            user = organization.user
+            return {
+                'uidb64': urlsafe_base64_encode(force_bytes(user.pk)),
+                'token': default_token_generator.make_token(user),
+            }
+        if 'pk' not in converters:
+            return {}
+        if name.startswith('agents:'):
+            return {'pk': objects['agent']}
+        if name == 'leads:category-detail':
+            return {'pk': objects['category']}
+        return {'pk': objects['lead']}
+
+    def measure(self, client, url, requests):
+        timings = []
+        queries = []
+        status = None
+        for _ in range(requests):
+            # reads of GET requests may go to the read alias
+            with ExitStack() as stack:
+                captured = [stack.enter_context(CaptureQueriesContext(connection)) for connection in connections.all()]
+                start = time.perf_counter()
+                response = client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings.append(time.perf_counter() - start)
+            queries.append(sum(len(context.captured_queries) for context in captured))
+            status = response.status_code
+        return {
+            'url': url,
+            'status': status,
+            'p50_ms': round(statistics.median(timings) * 1000, 3),
+            'p95_ms': round(percentile(timings, 0.95) * 1000, 3),
+            'queries_median': statistics.median(queries),
+            'queries_max': max(queries),
+        }
+
+    def format_result(self, result):
+        return (
+            f"{result['status']}  p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+            f"{result['queries_max']} queries"
+        )
+
+    def check_budgets(self, report, path):
+        try:
+            with open(path) as budgets_file:
+                budgets = json.load(budgets_file)
+        except FileNotFoundError:
+            raise CommandError(f"No query budgets at {path}; run with --update-budgets first.")
+        over = [
+            f"{key}: {result['queries_max']} queries, budget {budgets[key]}"
+            for key, result in sorted(report.items())
+            if key in budgets and result['queries_max'] > budgets[key]
+        ]
+        missing = sorted(set(report) - set(budgets))
+        for key in missing:
+            self.stderr.write(f"No query budget for {key}")
+        if over:
+            raise CommandError("Query budgets exceeded:\n" + "\n".join(over))
+        self.stdout.write(self.style.SUCCESS("All views within their query budgets."))
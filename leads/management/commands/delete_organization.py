@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from leads.deletion import enqueue_organization_deletion
+from leads.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = (
+        "Queue the deletion of an organization with its leads, categories and "
+        "agents. The organization is hidden right away; run_deletion_jobs removes the rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('organization', help="Username of the organizer.")
+
+    def handle(self, *args, **options):
+        try:
+            organization = UserProfile.objects.get(user__username=options['organization'])
+        except UserProfile.DoesNotExist:
+            raise CommandError(f"No organization {options['organization']!r}.")
+        job = enqueue_organization_deletion(organization)
+        self.stdout.write(f"Queued deletion job {job.pk}.")
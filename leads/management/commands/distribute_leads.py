@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from leads.distribution import LEAST_LOADED, STRATEGIES, distribute_leads
+from leads.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = "Spread an organization's unassigned leads over its agents."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organization', required=True, help="Username of the organizer.")
+        parser.add_argument('--strategy', choices=STRATEGIES, default=LEAST_LOADED)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            organization = UserProfile.objects.get(user__username=options['organization'])
+        except UserProfile.DoesNotExist:
+            raise CommandError(f"No organization for user {options['organization']!r}.")
+        assigned = distribute_leads(organization, options['strategy'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Assigned {assigned} leads."))
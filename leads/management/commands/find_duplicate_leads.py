@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from leads.duplicates import MAX_BLOCK_SIZE, find_duplicates, merge_leads, rebuild_block_keys
+from leads.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = (
+        "List the groups of duplicate leads of each organization, found by "
+        "blocking key, and optionally merge every group into its oldest lead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organization', help="Username of the organizer; all organizations by default.")
+        parser.add_argument('--merge', action='store_true', help="Merge the groups found instead of only listing them.")
+        parser.add_argument('--rebuild-keys', action='store_true', help="Recompute the blocking keys first.")
+        parser.add_argument('--max-block-size', type=int, default=MAX_BLOCK_SIZE, help="Skip larger blocks.")
+
+    def handle(self, *args, **options):
+        organizations = UserProfile.objects.filter(pending_deletion=False, moving=False).select_related('user').order_by('id')
+        if options['organization']:
+            organizations = organizations.filter(user__username=options['organization'])
+            if not organizations:
+                raise CommandError(f"No organization for user {options['organization']!r}.")
+        for organization in organizations:
+            if options['rebuild_keys']:
+                rebuild_block_keys(organization)
+            groups = merged = 0
+            # listed first: merging while the scan is running would change it
+            for group in list(find_duplicates(organization, options['max_block_size'])):
+                groups += 1
+                self.stdout.write(
+                    f"{organization}: #{group.survivor.pk} {group.survivor} <- "
+                    + ", ".join(f"#{lead.pk} {lead}" for lead in group.duplicates)
+                )
+                if options['merge']:
+                    merged += merge_leads(organization, group.survivor.pk, [lead.pk for lead in group.duplicates])
+            if groups:
+                self.stdout.write(self.style.SUCCESS(
+                    f"{organization}: {groups} group(s) of duplicates" + (f", merged {merged} lead(s)." if options['merge'] else ".")
+                ))
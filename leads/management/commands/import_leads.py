@@ -0,0 +1,57 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from leads.importers import FORMATS, LeadImporter, detect_format, open_text
+from leads.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = "Stream leads from a CSV or JSON Lines file into an organization."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--organization', required=True, help="Username of the organizer.")
+        parser.add_argument('--format', choices=FORMATS, help="Detected from the file extension by default.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--rejects', help="Write rejected rows to this CSV file.")
+
+    def handle(self, *args, **options):
+        try:
+            organization = UserProfile.objects.get(user__username=options['organization'])
+        except UserProfile.DoesNotExist:
+            raise CommandError(f"No organization for user {options['organization']!r}.")
+
+        rejects_file = rejects = None
+        if options['rejects']:
+            rejects_file = open(options['rejects'], 'w', newline='')
+            rejects = csv.writer(rejects_file)
+            rejects.writerow(['line', 'error', 'row'])
+
+        def on_reject(line_number, row, error):
+            if rejects:
+                rejects.writerow([line_number, error, json.dumps(row, default=str)])
+
+        def progress(result):
+            self.stdout.write(f"{result.processed} rows processed, {result.created} created, {result.rejected} rejected")
+
+        importer = LeadImporter(
+            organization,
+            batch_size=options['batch_size'],
+            progress=progress,
+            on_reject=on_reject,
+        )
+        format = options['format'] or detect_format(options['path'])
+        try:
+            with open(options['path'], 'rb') as binary_file:
+                result = importer.run(open_text(binary_file), format)
+        finally:
+            if rejects_file:
+                rejects_file.close()
+
+        for line_number, message in result.errors:
+            self.stderr.write(f"Line {line_number}: {message}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result.created} leads, rejected {result.rejected} of {result.processed} rows."
+        ))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from leads.models import UserProfile
+from leads.sharding import ShardMoveError, move_organization, shard_sizes
+
+
+class Command(BaseCommand):
+    help = (
+        "Move an organization's leads, agents and categories to another shard, "
+        "or list the organizations and leads of each shard to pick one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organization', help="Username of the organizer.")
+        parser.add_argument('--to', dest='shard', help="Alias of the shard to move it to.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows copied and deleted at a time.")
+        parser.add_argument(
+            '--grace', type=float, default=None,
+            help="Seconds to let running requests finish before copying (default SHARD_MOVE_GRACE_SECONDS).",
+        )
+
+    def handle(self, *args, **options):
+        if not options['organization'] or not options['shard']:
+            for shard, (organizations, leads) in shard_sizes().items():
+                self.stdout.write(f"{shard}: {organizations} organization(s), {leads} lead(s)")
+            return
+        try:
+            organization = UserProfile.objects.select_related('user').get(user__username=options['organization'])
+        except UserProfile.DoesNotExist:
+            raise CommandError(f"No organization for user {options['organization']!r}.")
+        source = organization.shard
+        try:
+            moved = move_organization(
+                organization, options['shard'], batch_size=options['batch_size'], grace=options['grace'],
+            )
+        except ShardMoveError as exc:
+            raise CommandError(str(exc))
+        if not moved:
+            self.stdout.write(f"{organization} is already in {source}.")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {organization} from {source} to {organization.shard}: "
+            + ", ".join(f"{count} {name}(s)" for name, count in moved.items()) + "."
+        ))
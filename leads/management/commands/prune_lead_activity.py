@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from leads.activity import compact_activity, prune_activity
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete lead activity older than the retention period and drop the "
+        "superseded assignments and recategorizations of older events."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int, default=None, help="Default ACTIVITY_RETENTION_DAYS.")
+        parser.add_argument('--compact-after-days', type=int, default=None, help="Default ACTIVITY_COMPACT_AFTER_DAYS.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Events deleted per statement.")
+
+    def handle(self, *args, **options):
+        pruned = prune_activity(options['retention_days'], options['batch_size'])
+        compacted = compact_activity(options['compact_after_days'], options['batch_size'])
+        self.stdout.write(f"Deleted {pruned} expired and {compacted} superseded event(s).")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from leads.counters import rebuild_category_counts
+from leads.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = "Recompute the maintained per-category lead counts from the leads table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organization', help="Username of the organizer; all organizations by default.")
+
+    def handle(self, *args, **options):
+        organization = None
+        if options['organization']:
+            try:
+                organization = UserProfile.objects.get(user__username=options['organization'])
+            except UserProfile.DoesNotExist:
+                raise CommandError(f"No organization for user {options['organization']!r}.")
+        updated = rebuild_category_counts(organization)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt lead counts of {updated} categories."))
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from leads.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Re-index every lead in the full-text search index of each shard and optimize it."
+
+    def handle(self, *args, **options):
+        for shard in settings.SHARDS:
+            rebuild_search_index(connections[shard])
+        self.stdout.write(self.style.SUCCESS("Rebuilt the lead search index."))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from leads.models import UserProfile
+from leads.workload import rebuild_workload
+
+
+class Command(BaseCommand):
+    help = "Recompute the agent x category workload summary from the leads table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organization', help="Username of the organizer; all organizations by default.")
+
+    def handle(self, *args, **options):
+        organization = None
+        if options['organization']:
+            try:
+                organization = UserProfile.objects.get(user__username=options['organization'])
+            except UserProfile.DoesNotExist:
+                raise CommandError(f"No organization for user {options['organization']!r}.")
+        rebuild_workload(organization)
+        self.stdout.write(self.style.SUCCESS("Rebuilt the workload summary."))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from leads.deletion import run_deletion_jobs
+
+
+class Command(BaseCommand):
+    help = "Run the queued organization, agent and lead deletions in chunks, resuming interrupted ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help="Rows per transaction (default DELETION_BATCH_SIZE).")
+        parser.add_argument('--retry-failed', action='store_true', help="Also resume jobs that failed.")
+        parser.add_argument('--loop', action='store_true', help="Keep polling for jobs instead of exiting when none are left.")
+        parser.add_argument('--interval', type=float, default=5, help="Seconds to sleep between polls with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            jobs = run_deletion_jobs(
+                batch_size=options['batch_size'],
+                progress=self.report,
+                retry_failed=options['retry_failed'],
+            )
+            if jobs:
+                self.stdout.write(f"Ran {jobs} deletion job(s).")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def report(self, job):
+        if job.status == job.FAILED:
+            self.stderr.write(f"{job}: {job.last_error}")
+        else:
+            self.stdout.write(f"{job}: {job.stage}, {job.processed} row(s) processed")
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from leads.models import UserProfile
+from leads.scoring import score_leads
+
+
+class Command(BaseCommand):
+    help = (
+        "Score the leads of each organization that changed since its last run, "
+        "or all of them with --full. Schedule it per organization, e.g. from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organization', help="Username of the organizer; all organizations by default.")
+        parser.add_argument('--full', action='store_true', help="Rescore every lead, not only the changed ones.")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Leads read and scored at a time.")
+        parser.add_argument('--loop', action='store_true', help="Keep scoring instead of exiting after one run.")
+        parser.add_argument('--interval', type=float, default=60, help="Seconds to sleep between runs with --loop.")
+
+    def handle(self, *args, **options):
+        organizations = UserProfile.objects.filter(pending_deletion=False, moving=False).select_related('user').order_by('id')
+        if options['organization']:
+            organizations = organizations.filter(user__username=options['organization'])
+            if not organizations:
+                raise CommandError(f"No organization for user {options['organization']!r}.")
+        while True:
+            for organization in organizations.all():
+                scored = score_leads(organization, full=options['full'], batch_size=options['batch_size'])
+                if scored:
+                    self.stdout.write(f"{organization}: scored {scored} lead(s).")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,38 @@
+import random
+
+from django.core.management.base import BaseCommand
+
+from leads.seeding import seed_organization, split_skewed
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic organizations with agents, categories and leads. "
+        "With --skew, organization sizes and the spread of leads over agents "
+        "and categories follow a Zipf distribution."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organizations', type=int, default=10)
+        parser.add_argument('--agents', type=int, default=10, help="Agents per organization.")
+        parser.add_argument('--categories', type=int, default=5, help="Categories per organization.")
+        parser.add_argument('--leads', type=int, default=1000, help="Average leads per organization.")
+        parser.add_argument('--skew', type=float, default=1.0, help="0 for uniform data.")
+        parser.add_argument('--prefix', default='seed', help="Prefix of the generated usernames.")
+        parser.add_argument('--seed', type=int, help="Random seed for reproducible data.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        sizes = split_skewed(options['leads'] * options['organizations'], options['organizations'], options['skew'])
+        for number, size in enumerate(sizes):
+            username = f"{options['prefix']}-org-{number}"
+            seed_organization(
+                username,
+                agents=options['agents'],
+                categories=options['categories'],
+                leads=size,
+                skew=options['skew'],
+                rng=rng,
+            )
+            self.stdout.write(f"{username}: {size} leads")
+        self.stdout.write(self.style.SUCCESS(f"Seeded {len(sizes)} organizations."))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from leads.mail import send_queued_mail
+
+
+class Command(BaseCommand):
+    help = "Send the mail waiting in the outbox over a single reused mail connection."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('--backoff', type=int, default=60, help="Seconds before the first retry; doubles on every attempt.")
+        parser.add_argument('--lease', type=int, default=600, help="Seconds a claimed batch is reserved for this worker.")
+        parser.add_argument('--loop', action='store_true', help="Keep polling the outbox instead of exiting when it is drained.")
+        parser.add_argument('--interval', type=float, default=5, help="Seconds to sleep between polls with --loop.")
+
+    def handle(self, *args, **options):
+        connection = get_connection()
+        try:
+            while True:
+                sent, failed = send_queued_mail(
+                    batch_size=options['batch_size'],
+                    max_attempts=options['max_attempts'],
+                    backoff=options['backoff'],
+                    connection=connection,
+                    lease=options['lease'],
+                )
+                if sent or failed:
+                    self.stdout.write(f"Sent {sent} email(s), {failed} failed.")
+                if not options['loop']:
+                    break
+                if not sent and not failed:
+                    # idle: don't hold the SMTP connection open between polls
+                    connection.close()
+                time.sleep(options['interval'])
+        finally:
+            connection.close()
@@ -0,0 +1,84 @@
+from django.utils.functional import SimpleLazyObject
+
+from crm.db import current_shard
+from .activity import activity_actor
+from .models import UserProfile, organization_shard
+from .sharding import find_agent
+
+
+class Tenant:
+    """
+    The organization a request works in and, for agents, the Agent record
+    of the logged in user. `organization` is None for anonymous users and
+    for accounts that belong to no organization.
+    """
+
+    def __init__(self, user=None, organization=None, agent=None):
+        self.user = user
+        self.organization = organization
+        self.agent = agent
+
+    @property
+    def is_organizor(self):
+        return self.organization is not None and self.agent is None
+
+    def __repr__(self):
+        return f"<Tenant organization={self.organization!r} agent={self.agent!r}>"
+
+
+def resolve_tenant(user):
+    """
+    Load the tenant of `user` with a single query: the UserProfile for
+    organizers, or the Agent joined with its organization for agents
+    (looked up shard by shard when there are several, see find_agent). The
+    result is also cached on the user so `user.userprofile` and
+    `user.agent` don't query again. Organizations and agents pending
+    deletion, and organizations being moved to another shard, resolve to
+    no organization.
+    """
+    if not user.is_authenticated:
+        return Tenant()
+    if user.is_organizor:
+        try:
+            organization = UserProfile.objects.get(user=user)
+        except UserProfile.DoesNotExist:
+            return Tenant(user)
+        user.userprofile = organization
+        if organization.pending_deletion or organization.moving:
+            return Tenant(user)
+        return Tenant(user, organization)
+    agent = find_agent(user)
+    if agent is None:
+        return Tenant(user)
+    user.agent = agent
+    if agent.pending_deletion or agent.organization.pending_deletion or agent.organization.moving:
+        return Tenant(user)
+    return Tenant(user, agent.organization, agent)
+
+
+class TenantMiddleware:
+    """
+    Attach `request.tenant`, resolved lazily on first use, route the
+    request's queries to the shard of its organization once resolved, and
+    make the request's user the actor of the lead activity it records.
+    Must come after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.tenant = SimpleLazyObject(lambda: self.resolve(request))
+        token = activity_actor.set(request.user)
+        shard_token = current_shard.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            current_shard.reset(shard_token)
+            activity_actor.reset(token)
+
+    def resolve(self, request):
+        tenant = resolve_tenant(request.user)
+        if tenant.organization is not None:
+            current_shard.set(organization_shard(tenant.organization))
+        return tenant
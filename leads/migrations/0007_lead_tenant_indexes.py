@@ -0,0 +1,29 @@
+# Generated by Django 3.1.7 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0006_auto_20210403_1852'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['organization', 'agent'], name='lead_org_agent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['organization', 'category'], name='lead_org_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(condition=models.Q(agent__isnull=True), fields=['organization'], name='lead_org_unassigned_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(condition=models.Q(agent__isnull=False), fields=['organization'], name='lead_org_assigned_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.1.7 on 2026-10-18 20:02
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_lead_counts(apps, schema_editor):
+    Category = apps.get_model('leads', 'Category')
+    Lead = apps.get_model('leads', 'Lead')
+    db_alias = schema_editor.connection.alias
+    counts = (
+        Lead.objects.using(db_alias).filter(category__isnull=False)
+        .order_by().values_list('category').annotate(count=Count('id'))
+    )
+    for category_id, count in counts:
+        Category.objects.using(db_alias).filter(pk=category_id).update(lead_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0008_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='lead_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_lead_counts, migrations.RunPython.noop),
+    ]
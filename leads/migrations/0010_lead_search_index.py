@@ -0,0 +1,66 @@
+from django.db import migrations
+
+# the DDL as of this migration; leads/search.py may define a newer index
+
+CREATE_STATEMENTS = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS leads_lead_fts USING fts5(
+        first_name, last_name,
+        content='leads_lead', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS leads_lead_fts_insert AFTER INSERT ON leads_lead BEGIN
+        INSERT INTO leads_lead_fts(rowid, first_name, last_name) VALUES (new.id, new.first_name, new.last_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS leads_lead_fts_delete AFTER DELETE ON leads_lead BEGIN
+        INSERT INTO leads_lead_fts(leads_lead_fts, rowid, first_name, last_name)
+        VALUES ('delete', old.id, old.first_name, old.last_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS leads_lead_fts_update AFTER UPDATE OF first_name, last_name ON leads_lead BEGIN
+        INSERT INTO leads_lead_fts(leads_lead_fts, rowid, first_name, last_name)
+        VALUES ('delete', old.id, old.first_name, old.last_name);
+        INSERT INTO leads_lead_fts(rowid, first_name, last_name) VALUES (new.id, new.first_name, new.last_name);
+    END
+    """,
+    "INSERT INTO leads_lead_fts(leads_lead_fts) VALUES ('rebuild')",
+)
+
+DROP_STATEMENTS = (
+    "DROP TRIGGER IF EXISTS leads_lead_fts_insert",
+    "DROP TRIGGER IF EXISTS leads_lead_fts_delete",
+    "DROP TRIGGER IF EXISTS leads_lead_fts_update",
+    "DROP TABLE IF EXISTS leads_lead_fts",
+)
+
+
+def execute(schema_editor, statements):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    execute(schema_editor, CREATE_STATEMENTS)
+
+
+def drop_search_index(apps, schema_editor):
+    execute(schema_editor, DROP_STATEMENTS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0009_category_lead_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
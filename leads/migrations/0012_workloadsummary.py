@@ -0,0 +1,45 @@
+# Generated by Django 3.1.7 on 2026-10-18 20:19
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_workload_summary(apps, schema_editor):
+    Lead = apps.get_model('leads', 'Lead')
+    WorkloadSummary = apps.get_model('leads', 'WorkloadSummary')
+    db_alias = schema_editor.connection.alias
+    rows = Lead.objects.using(db_alias).order_by().values_list('organization', 'agent', 'category').annotate(count=Count('id'))
+    WorkloadSummary.objects.using(db_alias).bulk_create([
+        WorkloadSummary(
+            organization_key=organization_id,
+            agent_key=agent_id or 0,
+            category_key=category_id or 0,
+            lead_count=count,
+        )
+        for organization_id, agent_id, category_id, count in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0011_timestamps_and_data_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkloadSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('organization_key', models.IntegerField()),
+                ('agent_key', models.IntegerField()),
+                ('category_key', models.IntegerField()),
+                ('lead_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='workloadsummary',
+            constraint=models.UniqueConstraint(fields=('organization_key', 'agent_key', 'category_key'), name='workload_summary_cell_unique'),
+        ),
+        migrations.RunPython(fill_workload_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.1.7 on 2026-10-18 20:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0013_deletion_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeadActivity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('organization_key', models.IntegerField()),
+                ('lead_key', models.IntegerField()),
+                ('ts', models.DateTimeField()),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Created'), (2, 'Assigned'), (3, 'Categorized'), (4, 'Deleted')])),
+                ('actor_key', models.IntegerField(blank=True, null=True)),
+                ('value', models.IntegerField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='leadactivity',
+            index=models.Index(fields=['organization_key', 'lead_key', 'ts'], name='lead_activity_lead_ts_idx'),
+        ),
+    ]
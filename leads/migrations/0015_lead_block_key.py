@@ -0,0 +1,39 @@
+# Generated by Django 3.1.7 on 2026-10-18 20:33
+
+from django.db import migrations, models
+
+from leads.blocking import blocking_key
+
+
+def fill_block_keys(apps, schema_editor):
+    Lead = apps.get_model('leads', 'Lead')
+    db_alias = schema_editor.connection.alias
+    last_id = 0
+    while True:
+        batch = list(Lead.objects.using(db_alias).filter(id__gt=last_id).order_by('id').only('first_name', 'last_name')[:1000])
+        if not batch:
+            break
+        for lead in batch:
+            lead.block_key = blocking_key(lead.first_name, lead.last_name)
+        Lead.objects.using(db_alias).bulk_update(batch, ['block_key'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0014_lead_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lead',
+            name='block_key',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['organization', 'block_key'], name='lead_org_block_key_idx'),
+        ),
+        migrations.RunPython(fill_block_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.7 on 2026-10-18 20:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0015_lead_block_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lead',
+            name='score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='scored_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['organization', 'score'], name='lead_org_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['organization', 'updated_at'], name='lead_org_updated_idx'),
+        ),
+    ]
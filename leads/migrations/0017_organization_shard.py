@@ -0,0 +1,40 @@
+# Generated by Django 3.1.7 on 2026-10-18 20:42
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0016_lead_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='shard',
+            field=models.CharField(default='default', editable=False, max_length=30),
+        ),
+        migrations.AlterField(
+            model_name='agent',
+            name='organization',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='leads.userprofile'),
+        ),
+        migrations.AlterField(
+            model_name='agent',
+            name='user',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='organization',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='leads.userprofile'),
+        ),
+        migrations.AlterField(
+            model_name='lead',
+            name='organization',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='leads.userprofile'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.7 on 2026-10-18 21:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0017_organization_shard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='moving',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
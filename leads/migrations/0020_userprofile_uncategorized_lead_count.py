@@ -0,0 +1,31 @@
+# Generated by Django 3.1.7 on 2026-10-18 21:17
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_uncategorized_lead_count(apps, schema_editor):
+    # counts the leads of this database only: after adding a shard, run
+    # rebuild_category_counts to count the leads stored there
+    Lead = apps.get_model('leads', 'Lead')
+    UserProfile = apps.get_model('leads', 'UserProfile')
+    db_alias = schema_editor.connection.alias
+    rows = Lead.objects.using(db_alias).filter(category__isnull=True).order_by().values_list('organization').annotate(count=Count('id'))
+    for organization_id, count in rows:
+        UserProfile.objects.using(db_alias).filter(pk=organization_id).update(uncategorized_lead_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0019_outgoingemail_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='uncategorized_lead_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_uncategorized_lead_count, migrations.RunPython.noop),
+    ]
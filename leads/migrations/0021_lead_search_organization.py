@@ -0,0 +1,98 @@
+from django.db import migrations
+
+# adds the organization id to the search index, so searches are restricted
+# to the tenant inside the MATCH; the DDL as of this migration
+
+CREATE_STATEMENTS = (
+    """
+    CREATE VIRTUAL TABLE leads_lead_fts USING fts5(
+        first_name, last_name, organization_id,
+        content='leads_lead', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER leads_lead_fts_insert AFTER INSERT ON leads_lead BEGIN
+        INSERT INTO leads_lead_fts(rowid, first_name, last_name, organization_id)
+        VALUES (new.id, new.first_name, new.last_name, new.organization_id);
+    END
+    """,
+    """
+    CREATE TRIGGER leads_lead_fts_delete AFTER DELETE ON leads_lead BEGIN
+        INSERT INTO leads_lead_fts(leads_lead_fts, rowid, first_name, last_name, organization_id)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.organization_id);
+    END
+    """,
+    """
+    CREATE TRIGGER leads_lead_fts_update AFTER UPDATE OF first_name, last_name, organization_id ON leads_lead BEGIN
+        INSERT INTO leads_lead_fts(leads_lead_fts, rowid, first_name, last_name, organization_id)
+        VALUES ('delete', old.id, old.first_name, old.last_name, old.organization_id);
+        INSERT INTO leads_lead_fts(rowid, first_name, last_name, organization_id)
+        VALUES (new.id, new.first_name, new.last_name, new.organization_id);
+    END
+    """,
+    "INSERT INTO leads_lead_fts(leads_lead_fts) VALUES ('rebuild')",
+)
+
+DROP_STATEMENTS = (
+    "DROP TRIGGER IF EXISTS leads_lead_fts_insert",
+    "DROP TRIGGER IF EXISTS leads_lead_fts_delete",
+    "DROP TRIGGER IF EXISTS leads_lead_fts_update",
+    "DROP TABLE IF EXISTS leads_lead_fts",
+)
+
+PREVIOUS_CREATE_STATEMENTS = (
+    """
+    CREATE VIRTUAL TABLE leads_lead_fts USING fts5(
+        first_name, last_name,
+        content='leads_lead', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER leads_lead_fts_insert AFTER INSERT ON leads_lead BEGIN
+        INSERT INTO leads_lead_fts(rowid, first_name, last_name) VALUES (new.id, new.first_name, new.last_name);
+    END
+    """,
+    """
+    CREATE TRIGGER leads_lead_fts_delete AFTER DELETE ON leads_lead BEGIN
+        INSERT INTO leads_lead_fts(leads_lead_fts, rowid, first_name, last_name)
+        VALUES ('delete', old.id, old.first_name, old.last_name);
+    END
+    """,
+    """
+    CREATE TRIGGER leads_lead_fts_update AFTER UPDATE OF first_name, last_name ON leads_lead BEGIN
+        INSERT INTO leads_lead_fts(leads_lead_fts, rowid, first_name, last_name)
+        VALUES ('delete', old.id, old.first_name, old.last_name);
+        INSERT INTO leads_lead_fts(rowid, first_name, last_name) VALUES (new.id, new.first_name, new.last_name);
+    END
+    """,
+    "INSERT INTO leads_lead_fts(leads_lead_fts) VALUES ('rebuild')",
+)
+
+
+def execute(schema_editor, statements):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def add_organization(apps, schema_editor):
+    execute(schema_editor, DROP_STATEMENTS + CREATE_STATEMENTS)
+
+
+def remove_organization(apps, schema_editor):
+    execute(schema_editor, DROP_STATEMENTS + PREVIOUS_CREATE_STATEMENTS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0020_userprofile_uncategorized_lead_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_organization, remove_organization),
+    ]
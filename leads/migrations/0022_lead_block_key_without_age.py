@@ -0,0 +1,22 @@
+from django.db import migrations
+from django.db.models import Value
+from django.db.models.functions import StrIndex, Substr
+
+
+def strip_age_bucket(apps, schema_editor):
+    # block keys used to end in ":<age // 5>"; they are now the name codes only
+    Lead = apps.get_model('leads', 'Lead')
+    Lead.objects.using(schema_editor.connection.alias).filter(block_key__contains=':').update(
+        block_key=Substr('block_key', 1, StrIndex('block_key', Value(':')) - 1)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0021_lead_search_organization'),
+    ]
+
+    operations = [
+        migrations.RunPython(strip_age_bucket, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.1.7 on 2026-10-18 21:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0022_lead_block_key_without_age'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='lead',
+            name='lead_org_unassigned_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='lead',
+            name='lead_org_assigned_idx',
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(condition=models.Q(agent__isnull=True), fields=['organization', 'score'], name='lead_org_unassigned_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(condition=models.Q(agent__isnull=False), fields=['organization', 'score'], name='lead_org_assigned_score_idx'),
+        ),
+    ]
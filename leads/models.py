@@ -1,6 +1,11 @@
-from django.db import models
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, models
 from django.contrib.auth.models import AbstractUser
 from django.db.models.signals import post_save
+from django.utils import timezone
+
+from crm.db import is_directory_database
+from .blocking import blocking_key
 
 class User(AbstractUser):
     is_organizor = models.BooleanField(default=True)
@@ -8,33 +13,179 @@ class User(AbstractUser):
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
+    # bumped on every write to the organization's leads, agents and
+    # categories; the conditional GET validators of the lead pages
+    data_version = models.PositiveIntegerField(default=0)
+    data_changed_at = models.DateTimeField(default=timezone.now)
+    # set while a DeletionJob removes the organization's rows
+    pending_deletion = models.BooleanField(default=False)
+    # start of the last score_leads run; leads updated since are rescored
+    scored_at = models.DateTimeField(null=True, blank=True)
+    # database of the organization's leads, agents and categories; changed
+    # only by move_organization (leads/sharding.py), which moves them
+    shard = models.CharField(max_length=30, default=DEFAULT_DB_ALIAS, editable=False)
+    # set while move_organization copies the organization to another shard:
+    # requests resolve it to no organization and shard_atomic refuses writes
+    moving = models.BooleanField(default=False, editable=False)
+    # the organization's leads without a category, maintained like
+    # Category.lead_count (see leads/counters.py)
+    uncategorized_lead_count = models.IntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.user.username
 
 
+def organization_shard(organization):
+    """
+    Alias of the shard of an organization, given as a UserProfile or an id.
+    An id costs a primary key query: the shard map is never cached, as
+    move_organization runs in another process than the web workers.
+    """
+    if len(settings.SHARDS) == 1:
+        return DEFAULT_DB_ALIAS
+    if isinstance(organization, UserProfile):
+        return organization.shard
+    return UserProfile.objects.filter(pk=organization).values_list('shard', flat=True).first() or DEFAULT_DB_ALIAS
+
+
+class TenantQuerySet(models.QuerySet):
+    """Scope rows to an organization or to the request tenant."""
+
+    def for_organization(self, organization):
+        queryset = self.filter(organization=organization)
+        # an explicit using() wins, e.g. while moving the organization
+        if self._db is None:
+            shard = organization_shard(organization)
+            if not is_directory_database(shard):
+                queryset = queryset.using(shard)
+        return queryset
+
+    def for_tenant(self, tenant):
+        if tenant.organization is None:
+            return self.none()
+        return self.for_organization(tenant.organization)
+
+
+class LeadQuerySet(TenantQuerySet):
+
+    def bulk_create(self, objs, *args, **kwargs):
+        # leads/scoring.py imports the models
+        from .scoring import initial_scores
+        # bulk_create skips save(), which sets block_key and the first score
+        objs = list(objs)
+        new = {}
+        for lead in objs:
+            lead.block_key = blocking_key(lead.first_name, lead.last_name)
+            if lead.pk is None and lead.organization_id is not None:
+                new.setdefault(lead.organization_id, []).append(lead)
+        for leads in new.values():
+            for lead, score in zip(leads, initial_scores(leads[0].scoring_organization, leads)):
+                lead.score = score
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def for_tenant(self, tenant):
+        queryset = super().for_tenant(tenant)
+        # agents only ever see the leads assigned to them
+        if tenant.agent is not None:
+            queryset = queryset.filter(agent=tenant.agent)
+        return queryset
+
+
+class AgentQuerySet(TenantQuerySet):
+
+    def for_organization(self, organization):
+        # agents a DeletionJob is removing are already gone for the views
+        return super().for_organization(organization).filter(pending_deletion=False)
+
+    def with_user(self):
+        # the users are in the default database: a shard can't join them
+        if is_directory_database(self.db):
+            return self.select_related('user')
+        return self.prefetch_related('user')
+
+
+# the fields blocking_key() is computed from
+KEY_FIELDS = frozenset(('first_name', 'last_name'))
+
+
 class Lead(models.Model):
     first_name = models.CharField(max_length=20)
     last_name = models.CharField(max_length=20)
     age = models.IntegerField(default=0)
-    organization = models.ForeignKey(UserProfile, on_delete=models.CASCADE) 
+    # organizations and users stay in the default database, see crm/db.py
+    organization = models.ForeignKey(UserProfile, on_delete=models.CASCADE, db_constraint=False)
     agent = models.ForeignKey("Agent", null=True, blank=True, on_delete=models.SET_NULL)
     category = models.ForeignKey("Category", related_name="leads", null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # duplicate detection candidates share it, see leads/blocking.py
+    block_key = models.CharField(max_length=64, blank=True, editable=False)
+    # priority computed by score_leads (leads/scoring.py); lists order by it
+    score = models.FloatField(default=0, editable=False)
+
+    objects = LeadQuerySet.as_manager()
+
+    class Meta:
+        # Every lead view filters by organization first, then by agent or
+        # category. The partial indexes keep the assigned/unassigned panels
+        # ordered by score (then id, which SQLite appends to every index)
+        # within an organization without a sort.
+        indexes = [
+            models.Index(fields=['organization', 'agent'], name='lead_org_agent_idx'),
+            models.Index(fields=['organization', 'category'], name='lead_org_category_idx'),
+            models.Index(
+                fields=['organization', 'score'], condition=models.Q(agent__isnull=True), name='lead_org_unassigned_score_idx',
+            ),
+            models.Index(
+                fields=['organization', 'score'], condition=models.Q(agent__isnull=False), name='lead_org_assigned_score_idx',
+            ),
+            models.Index(fields=['organization', 'block_key'], name='lead_org_block_key_idx'),
+            # lead lists by priority, and the leads score_leads has to rescore
+            models.Index(fields=['organization', 'score'], name='lead_org_score_idx'),
+            models.Index(fields=['organization', 'updated_at'], name='lead_org_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}" 
 
+    def save(self, *args, **kwargs):
+        # leads/scoring.py imports the models
+        from .scoring import initial_scores
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or KEY_FIELDS.intersection(update_fields):
+            self.block_key = blocking_key(self.first_name, self.last_name)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'block_key'}
+        if self._state.adding and self.organization_id is not None:
+            # a first score until score_leads rescores it with the others
+            self.score = initial_scores(self.scoring_organization, [self])[0]
+        super().save(*args, **kwargs)
+
+    @property
+    def scoring_organization(self):
+        # the loaded UserProfile knows its shard; an id may cost a query
+        return self.organization if Lead.organization.is_cached(self) else self.organization_id
+
 
 class Agent(models.Model):
-    user = models.OneToOneField(User, on_delete=models.CASCADE)
-    organization = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    user = models.OneToOneField(User, on_delete=models.CASCADE, db_constraint=False)
+    organization = models.ForeignKey(UserProfile, on_delete=models.CASCADE, db_constraint=False)
+    pending_deletion = models.BooleanField(default=False)
+
+    objects = AgentQuerySet.as_manager()
 
     def __str__(self):
         return self.user.email
 
 class Category(models.Model):
     name = models.CharField(max_length=50)
-    organization = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    organization = models.ForeignKey(UserProfile, on_delete=models.CASCADE, db_constraint=False)
+    # denormalized number of leads in the category, see leads/counters.py
+    lead_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = TenantQuerySet.as_manager()
     
     class Meta:
         verbose_name_plural = ("Categories")
@@ -44,8 +195,156 @@ class Category(models.Model):
 
 
 
+class WorkloadSummary(models.Model):
+    """
+    Number of an organization's leads per agent and category, maintained
+    incrementally (see leads/workload.py). Key 0 stands for no agent or no
+    category so every cell is unique without NULLs. Plain integer keys
+    rather than foreign keys: the Lead delete signals of a cascading
+    organization delete may still write cells while it is being deleted.
+    """
+    organization_key = models.IntegerField()
+    agent_key = models.IntegerField()
+    category_key = models.IntegerField()
+    lead_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['organization_key', 'agent_key', 'category_key'], name='workload_summary_cell_unique'
+            ),
+        ]
+
+    def __str__(self):
+        return f"organization {self.organization_key} agent {self.agent_key} category {self.category_key}: {self.lead_count}"
+
+
+class DeletionJob(models.Model):
+    """
+    Removal of an organization, an agent or a set of leads in bounded
+    chunks, run by the run_deletion_jobs command (see leads/deletion.py).
+    `stage` and `processed` record how far it got, so an interrupted job
+    resumes where it stopped.
+    """
+    ORGANIZATION = 'organization'
+    AGENT = 'agent'
+    LEADS = 'leads'
+    KIND_CHOICES = (
+        (ORGANIZATION, 'Organization'),
+        (AGENT, 'Agent'),
+        (LEADS, 'Leads'),
+    )
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # plain ids: the job outlives the rows it deletes
+    organization_key = models.IntegerField()
+    params = models.JSONField(default=dict, blank=True, help_text="agent id, or lead_ids / category of the leads.")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    stage = models.CharField(max_length=30, blank=True)
+    processed = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='deletion_job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Delete {self.kind} of organization {self.organization_key} ({self.status})"
+
+
+class LeadActivity(models.Model):
+    """
+    Append-only log of what happened to a lead: creation, (re)assignment,
+    recategorization and deletion. Written in batches by leads/activity.py.
+    """
+    CREATED = 1
+    ASSIGNED = 2
+    CATEGORIZED = 3
+    DELETED = 4
+    KIND_CHOICES = (
+        (CREATED, 'Created'),
+        (ASSIGNED, 'Assigned'),
+        (CATEGORIZED, 'Categorized'),
+        (DELETED, 'Deleted'),
+    )
+
+    # plain ids: the log outlives the leads, agents and users it mentions
+    organization_key = models.IntegerField()
+    lead_key = models.IntegerField()
+    ts = models.DateTimeField()
+    kind = models.PositiveSmallIntegerField(choices=KIND_CHOICES)
+    actor_key = models.IntegerField(null=True, blank=True)
+    # the new agent or category id of ASSIGNED and CATEGORIZED, None for none
+    value = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['organization_key', 'lead_key', 'ts'], name='lead_activity_lead_ts_idx'),
+        ]
+
+    def __str__(self):
+        return f"lead {self.lead_key} {self.get_kind_display()} at {self.ts}"
+
+
+class OutgoingEmail(models.Model):
+    """
+    Transactional outbox: mail is written here in the same transaction as
+    the change that triggers it and sent later by the send_queued_mail
+    command.
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipients = models.TextField(help_text="One address per line.")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # when a pending message is due; while SENDING, when the claim of the
+    # worker in claimed_by expires and another one may send it
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outgoing_email_due_idx'),
+        ]
+
+    def __str__(self):
+        return self.subject
+
+    @property
+    def recipient_list(self):
+        return [address for address in self.recipients.splitlines() if address]
+
+
 def post_user_create_signal(sender, instance, created, **kwargs):
-    print(instance, created)
     if created:
         UserProfile.objects.create(user=instance)
 
@@ -0,0 +1,188 @@
+import base64
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import SimpleLazyObject, cached_property
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    Datetimes keep their microseconds (DjangoJSONEncoder cuts them to
+    milliseconds, and a cursor between rows that share a truncated
+    timestamp would skip some) and are tagged to be parsed back.
+    """
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return {'datetime': o.isoformat()}
+        return super().default(o)
+
+
+def decode_value(obj):
+    if set(obj) != {'datetime'}:
+        raise ValueError("Unknown cursor value")
+    value = parse_datetime(obj['datetime'])
+    if value is None:
+        raise ValueError("Invalid cursor datetime")
+    return value
+
+
+def encode_cursor(values):
+    data = json.dumps(list(values), cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode(), object_hook=decode_value)
+    except (ValueError, TypeError):
+        raise Http404("Invalid cursor")
+    if not isinstance(values, list) or len(values) != length:
+        raise Http404("Invalid cursor")
+    return values
+
+
+def keyset_filter(ordering, values):
+    """
+    Build the WHERE clause selecting the rows that come strictly after
+    `values` in `ordering`: for (f0, f1, ..., id) with descending fields,
+    f0 < v0 OR (f0 = v0 AND f1 < v1) OR ... OR (f0 = v0 AND ... AND id < vn);
+    ascending fields compare with > instead.
+    """
+    condition = Q()
+    for position, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        step = Q(**{f"{name}__{lookup}": values[position]})
+        for previous, value in zip(ordering[:position], values):
+            step &= Q(**{previous.lstrip('-'): value})
+        condition |= step
+    return condition
+
+
+class KeysetPage:
+    """
+    One page of a queryset paginated on a unique ordering (the last field of
+    `ordering` must be unique, normally the primary key). Each page is a
+    single indexed range query of `per_page + 1` rows, so page N costs the
+    same as page 1. The query only runs when the page is first used.
+    """
+
+    def __init__(self, queryset, ordering, per_page, cursor=None):
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.cursor = cursor or None
+        queryset = queryset.order_by(*self.ordering)
+        if self.cursor:
+            values = decode_cursor(self.cursor, len(self.ordering))
+            queryset = queryset.filter(keyset_filter(self.ordering, values))
+        self.queryset = queryset
+
+    @cached_property
+    def _rows(self):
+        return list(self.queryset[:self.per_page + 1])
+
+    @property
+    def object_list(self):
+        return self._rows[:self.per_page]
+
+    @property
+    def has_next(self):
+        return len(self._rows) > self.per_page
+
+    @property
+    def has_previous(self):
+        return self.cursor is not None
+
+    def has_other_pages(self):
+        return self.has_previous or self.has_next
+
+    @property
+    def next_cursor(self):
+        if not self.has_next:
+            return None
+        last = self.object_list[-1]
+        return encode_cursor(self._value(last, field.lstrip('-')) for field in self.ordering)
+
+    @staticmethod
+    def _value(row, name):
+        if isinstance(row, dict):
+            return row[name]
+        return getattr(row, name)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+def querystring_with(request, **params):
+    """Return the current query string with `params` replaced (None removes)."""
+    query = request.GET.copy()
+    for key, value in params.items():
+        if value is None:
+            query.pop(key, None)
+        else:
+            query[key] = value
+    encoded = query.urlencode()
+    return f"?{encoded}" if encoded else "?"
+
+
+class PageLinks:
+    """
+    First/next page URLs of a KeysetPage, computed on first access so a
+    page whose links are never rendered (e.g. cached) is never queried.
+    """
+
+    def __init__(self, request, page, cursor_kwarg):
+        self.request = request
+        self.page = page
+        self.cursor_kwarg = cursor_kwarg
+
+    @cached_property
+    def next_url(self):
+        if not self.page.has_next:
+            return None
+        return querystring_with(self.request, **{self.cursor_kwarg: self.page.next_cursor})
+
+    @cached_property
+    def first_url(self):
+        if not self.page.has_previous:
+            return None
+        return querystring_with(self.request, **{self.cursor_kwarg: None})
+
+
+class KeysetPaginationMixin:
+    """
+    Keyset (cursor) pagination for ListView. The cursor is read from
+    `cursor_kwarg` in the query string so several independently paged panels
+    can share one page.
+    """
+    paginate_by = 25
+    keyset_ordering = ('id',)
+    cursor_kwarg = 'after'
+
+    def get_keyset_page(self, queryset, cursor_kwarg, ordering=None, per_page=None):
+        return KeysetPage(
+            queryset,
+            ordering or self.keyset_ordering,
+            per_page or self.paginate_by,
+            self.request.GET.get(cursor_kwarg),
+        )
+
+    def get_page_links(self, page, cursor_kwarg):
+        return PageLinks(self.request, page, cursor_kwarg)
+
+    def paginate_queryset(self, queryset, page_size):
+        page = self.get_keyset_page(queryset, self.cursor_kwarg, per_page=page_size)
+        # is_paginated stays lazy too, like the page itself
+        return (None, page, page, SimpleLazyObject(page.has_other_pages))
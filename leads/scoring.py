@@ -0,0 +1,172 @@
+"""
+Lead scoring.
+
+score_leads gives every lead of an organization a priority score, the
+weighted sum of features scaled to 0..1 (LEAD_SCORE_WEIGHTS):
+
+- age: the lead's age, capped at MAX_AGE;
+- category: LEAD_SCORE_CATEGORY_VALUES of its category's name, the None
+  entry for uncategorized leads and DEFAULT_CATEGORY_VALUE otherwise;
+- agent_load: its agent's lead count relative to the busiest agent;
+- recency: halves every LEAD_SCORE_HALF_LIFE_DAYS since it was created.
+
+Leads are read a batch at a time as NumPy columns with one values_list
+query, scored in one vectorized pass and written back with bulk_update,
+one UPDATE per 500 leads, into the indexed Lead.score the lead list is
+ordered by. An incremental run only rescores the leads updated since the
+organization's previous run (UserProfile.scored_at); run it with --full
+now and then, e.g. nightly, so recency and agent loads catch up on
+leads that didn't change. Only the scores that changed are written, and
+the organization's data_version is only bumped when some did. New leads
+get their first score from initial_scores when they are saved or bulk
+created, so they don't wait at the end of the list for the next run; it
+takes the agent loads from the maintained WorkloadSummary rather than
+counting the organization's leads.
+"""
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .distribution import agent_loads
+from .freshness import touch_organization
+from .models import Category, Lead, UserProfile
+from .sharding import shard_atomic
+from .workload import agent_lead_counts
+
+MAX_AGE = 100
+DEFAULT_CATEGORY_VALUE = 0.5
+SECONDS_PER_DAY = 86400
+# "no agent" and "no category" in the id columns
+NONE_KEY = 0
+
+
+def category_values(organization):
+    """
+    {category_id: value} of the organization, NONE_KEY for uncategorized;
+    only NONE_KEY, without a query, when `organization` is None.
+    """
+    values = {
+        (name.lower() if name is not None else None): value
+        for name, value in settings.LEAD_SCORE_CATEGORY_VALUES.items()
+    }
+    mapping = {}
+    if organization is not None:
+        mapping = {
+            category_id: values.get(name.lower(), DEFAULT_CATEGORY_VALUE)
+            for category_id, name in Category.objects.for_organization(organization).values_list('id', 'name')
+        }
+    mapping[NONE_KEY] = values.get(None, DEFAULT_CATEGORY_VALUE)
+    return mapping
+
+
+def relative_loads(loads, added=None):
+    """
+    {agent_id: leads / leads of the busiest agent} of the {agent_id: leads}
+    `loads`, NONE_KEY for unassigned, counting the `added` {agent_id: leads}
+    about to be assigned as well.
+    """
+    loads = dict(loads)
+    for agent_id, count in (added or {}).items():
+        loads[agent_id] = loads.get(agent_id, 0) + count
+    busiest = max(loads.values(), default=0) or 1
+    mapping = {agent_id: load / busiest for agent_id, load in loads.items()}
+    mapping[NONE_KEY] = 0.0
+    return mapping
+
+
+def lookup(mapping, keys, default=0.0):
+    """mapping[key] for every key of an integer column, with one searchsorted."""
+    known = np.array(sorted(mapping), dtype=np.int64)
+    values = np.array([mapping[key] for key in known.tolist()], dtype=np.float64)
+    positions = np.minimum(np.searchsorted(known, keys), len(known) - 1)
+    return np.where(known[positions] == keys, values[positions], default)
+
+
+def compute_scores(columns, categories, loads, now, weights=None, half_life_days=None):
+    """
+    Scores of a batch of leads given as columns: 'age', 'category' and
+    'agent' ids (NONE_KEY for none) and 'created' POSIX timestamps.
+    """
+    weights = weights or settings.LEAD_SCORE_WEIGHTS
+    half_life_days = half_life_days or settings.LEAD_SCORE_HALF_LIFE_DAYS
+    features = {
+        'age': np.clip(columns['age'], 0, MAX_AGE) / MAX_AGE,
+        'category': lookup(categories, columns['category'], DEFAULT_CATEGORY_VALUE),
+        'agent_load': lookup(loads, columns['agent']),
+        'recency': np.exp2(-np.maximum(now - columns['created'], 0) / (half_life_days * SECONDS_PER_DAY)),
+    }
+    scores = np.zeros(len(columns['age']), dtype=np.float64)
+    for feature, weight in weights.items():
+        scores += weight * features[feature]
+    return np.round(scores * 100, 4)
+
+
+def initial_scores(organization, leads, now=None):
+    """
+    Scores of the organization's new, unsaved `leads`. The categories and
+    agent loads are only read when some of the leads have one; the loads
+    come from the workload summary, one row per agent and category.
+    """
+    now = now or timezone.now()
+    categories = category_values(organization if any(lead.category_id for lead in leads) else None)
+    added = Counter(lead.agent_id for lead in leads if lead.agent_id)
+    if added:
+        loads = relative_loads(agent_lead_counts(getattr(organization, 'pk', organization)), added)
+    else:
+        loads = {NONE_KEY: 0.0}
+    _, columns = lead_columns(
+        (None, lead.age, lead.category_id, lead.agent_id, lead.created_at or now) for lead in leads
+    )
+    return compute_scores(columns, categories, loads, now.timestamp()).tolist()
+
+
+def lead_columns(rows):
+    ids, ages, category_ids, agent_ids, created = zip(*rows)
+    return ids, {
+        'age': np.array(ages, dtype=np.float64),
+        'category': np.array([category_id or NONE_KEY for category_id in category_ids], dtype=np.int64),
+        'agent': np.array([agent_id or NONE_KEY for agent_id in agent_ids], dtype=np.int64),
+        'created': np.array([created_at.timestamp() for created_at in created], dtype=np.float64),
+    }
+
+
+def score_leads(organization, full=False, batch_size=5000):
+    """Rescore the organization's changed (or, with `full`, all) leads. Returns how many."""
+    started = timezone.now()
+    leads = Lead.objects.for_organization(organization)
+    if not full and organization.scored_at is not None:
+        leads = leads.filter(updated_at__gte=organization.scored_at)
+    categories = category_values(organization)
+    loads = relative_loads(agent_loads(organization))
+    scored = 0
+    changed = 0
+    last_id = 0
+    while True:
+        rows = list(
+            leads.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'age', 'category', 'agent', 'created_at', 'score')[:batch_size]
+        )
+        if not rows:
+            break
+        ids, columns = lead_columns(row[:5] for row in rows)
+        scores = compute_scores(columns, categories, loads, started.timestamp())
+        updates = [
+            Lead(id=lead_id, score=score)
+            for lead_id, score, (*_, old_score) in zip(ids, scores.tolist(), rows)
+            if score != old_score
+        ]
+        if updates:
+            # bulk_update leaves updated_at alone, so scoring doesn't count as a change
+            with shard_atomic(organization):
+                Lead.objects.for_organization(organization).bulk_update(updates, ['score'], batch_size=500)
+        scored += len(rows)
+        changed += len(updates)
+        last_id = ids[-1]
+    # changes made while this run was reading are picked up by the next one
+    UserProfile.objects.filter(pk=organization.pk).update(scored_at=started)
+    if changed:
+        # the lead list order changed
+        touch_organization(organization.pk)
+    return scored
@@ -0,0 +1,144 @@
+"""
+Full-text lead search backed by an SQLite FTS5 index.
+
+leads_lead_fts is an external-content FTS5 table over the name columns of
+leads_lead, kept in sync by triggers so bulk_create, update() and raw
+deletes are indexed too. It also indexes the organization id, so a search
+matches the tenant's rows inside the FTS query instead of filtering every
+tenant's matches afterwards. SQLite drops a table's triggers when Django
+rebuilds the table during a migration, so ensure_search_index also runs
+after every migrate. On other databases search falls back to prefix
+matching on the name columns.
+"""
+import re
+
+from django.db import connection as default_connection, connections
+from django.db.models import Q
+
+from .models import Lead, organization_shard
+
+FTS_TABLE = 'leads_lead_fts'
+NAME_COLUMNS = ('first_name', 'last_name')
+INDEXED_COLUMNS = NAME_COLUMNS + ('organization_id',)
+
+CREATE_TABLE = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    {', '.join(INDEXED_COLUMNS)},
+    content='leads_lead', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+)
+"""
+
+_new_values = ', '.join(f'new.{column}' for column in INDEXED_COLUMNS)
+_old_values = ', '.join(f'old.{column}' for column in INDEXED_COLUMNS)
+_columns = ', '.join(INDEXED_COLUMNS)
+
+CREATE_TRIGGERS = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert AFTER INSERT ON leads_lead BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete AFTER DELETE ON leads_lead BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update AFTER UPDATE OF {_columns} ON leads_lead BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+        INSERT INTO {FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END
+    """,
+)
+
+DROP_STATEMENTS = (
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_insert",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_delete",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_update",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+)
+
+
+def _table_exists(cursor):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+    return cursor.fetchone() is not None
+
+
+def ensure_search_index(connection=None):
+    """Create the FTS table and triggers if missing; fill a newly created table."""
+    connection = connection or default_connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        created = not _table_exists(cursor)
+        cursor.execute(CREATE_TABLE)
+        for statement in CREATE_TRIGGERS:
+            cursor.execute(statement)
+        if created:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_search_index(connection=None):
+    connection = connection or default_connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for statement in DROP_STATEMENTS:
+            cursor.execute(statement)
+
+
+def rebuild_search_index(connection=None):
+    """Re-index every lead and merge the index segments."""
+    connection = connection or default_connection
+    ensure_search_index(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def match_expression(text):
+    """Turn user input into an FTS5 query: every word must match as a prefix."""
+    return ' '.join(f'"{token}"*' for token in re.findall(r'\w+', text))
+
+
+def tenant_match_expression(expression, organization_id):
+    """Restrict `expression` to the name columns of the organization's leads."""
+    return f'organization_id : "{organization_id}" AND {{{" ".join(NAME_COLUMNS)}}} : ({expression})'
+
+
+def search_leads(tenant, text, limit=20):
+    """
+    The `limit` best matching leads visible to the tenant, best first.
+    """
+    if tenant.organization is None:
+        return []
+    expression = match_expression(text)
+    if not expression:
+        return []
+    # the index is in the organization's shard, next to its leads
+    connection = connections[organization_shard(tenant.organization)]
+    if connection.vendor != 'sqlite':
+        leads = Lead.objects.for_tenant(tenant)
+        for token in re.findall(r'\w+', text):
+            leads = leads.filter(Q(first_name__istartswith=token) | Q(last_name__istartswith=token))
+        return list(leads.order_by('id')[:limit])
+
+    sql = (
+        f"SELECT lead.id FROM {FTS_TABLE} "
+        f"JOIN leads_lead lead ON lead.id = {FTS_TABLE}.rowid "
+        f"WHERE {FTS_TABLE} MATCH %s"
+    )
+    params = [tenant_match_expression(expression, tenant.organization.pk)]
+    if tenant.agent is not None:
+        sql += " AND lead.agent_id = %s"
+        params.append(tenant.agent.pk)
+    # rank on the names only: the organization matches every row alike
+    weights = ', '.join('1.0' if column in NAME_COLUMNS else '0.0' for column in INDEXED_COLUMNS)
+    sql += f" ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s"
+    params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        ids = [row[0] for row in cursor.fetchall()]
+    leads = Lead.objects.for_tenant(tenant).in_bulk(ids)
+    return [leads[lead_id] for lead_id in ids if lead_id in leads]
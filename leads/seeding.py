@@ -0,0 +1,91 @@
+import random
+
+from django.db import transaction
+
+from .counters import adjust_category_counts, count_new_leads
+from .workload import adjust_workload, new_lead_cells
+from .models import User, Agent, Category, Lead
+
+
+FIRST_NAMES = (
+    "James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda",
+    "William", "Elizabeth", "David", "Barbara", "Richard", "Susan", "Joseph", "Jessica",
+)
+LAST_NAMES = (
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis",
+    "Rodriguez", "Martinez", "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas",
+)
+
+
+def zipf_weights(count, skew):
+    """Cumulative weights where item i is (i + 1) ** skew times rarer than the first."""
+    cumulative = []
+    total = 0.0
+    for rank in range(1, count + 1):
+        total += 1.0 / rank ** skew
+        cumulative.append(total)
+    return cumulative
+
+
+def split_skewed(total, parts, skew):
+    """Split `total` into `parts` integers following zipf_weights(parts, skew)."""
+    weights = [1.0 / rank ** skew for rank in range(1, parts + 1)]
+    scale = total / sum(weights)
+    sizes = [int(weight * scale) for weight in weights]
+    sizes[0] += total - sum(sizes)
+    return sizes
+
+
+def seed_organization(username, agents=10, categories=5, leads=1000,
+                      unassigned_ratio=0.2, uncategorized_ratio=0.3,
+                      skew=0.0, batch_size=5000, rng=None):
+    """
+    Create an organizer with `agents` agents, `categories` categories and
+    `leads` leads and return the organization (UserProfile). With a `skew`
+    above 0 a few agents and categories get most of the leads, like real
+    call centers. Leads are inserted with bulk_create so large datasets stay
+    fast; users go through save() so the UserProfile signal still runs.
+    """
+    rng = rng or random.Random()
+    organizer = User.objects.create(username=username, email=f"{username}@example.com")
+    organization = organizer.userprofile
+
+    agent_ids = []
+    for number in range(agents):
+        agent_user = User.objects.create(
+            username=f"{username}-agent-{number}",
+            email=f"{username}-agent-{number}@example.com",
+            is_organizor=False,
+            is_agent=True,
+        )
+        agent_ids.append(Agent.objects.create(user=agent_user, organization=organization).id)
+
+    category_ids = [
+        Category.objects.create(name=f"Category {number}", organization=organization).id
+        for number in range(categories)
+    ]
+    agent_weights = zipf_weights(len(agent_ids), skew)
+    category_weights = zipf_weights(len(category_ids), skew)
+
+    def pick(ids, weights, none_ratio):
+        if not ids or rng.random() < none_ratio:
+            return None
+        return rng.choices(ids, cum_weights=weights)[0]
+
+    batch = []
+    for number in range(leads):
+        batch.append(Lead(
+            first_name=rng.choice(FIRST_NAMES),
+            last_name=rng.choice(LAST_NAMES),
+            age=rng.randint(18, 80),
+            organization=organization,
+            agent_id=pick(agent_ids, agent_weights, unassigned_ratio),
+            category_id=pick(category_ids, category_weights, uncategorized_ratio),
+        ))
+        if len(batch) >= batch_size or number == leads - 1:
+            with transaction.atomic():
+                Lead.objects.bulk_create(batch)
+                adjust_category_counts(organization.pk, count_new_leads(batch))
+                adjust_workload(organization.pk, new_lead_cells(batch))
+            batch = []
+    return organization
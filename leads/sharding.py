@@ -0,0 +1,235 @@
+"""
+Organization shards.
+
+An organization's leads, agents and categories live in one of the SHARDS
+databases, the one its UserProfile.shard names, so a large organization's
+writes only lock its own file. The default database keeps the users and
+the organizations, i.e. the shard map, and what is keyed by plain
+organization ids: deletion jobs, the outbox, the workload summary and the
+activity log.
+
+crm.db.ShardRouter does the routing: instances carry their database,
+TenantQuerySet.for_organization picks the organization's shard, and other
+queries of the sharded models go to `current_shard`, which TenantMiddleware
+sets from the request tenant and use_shard sets for jobs and commands.
+
+Ids are allocated per database, so apply_id_offsets starts the ids of the
+n-th shard above n * SHARD_ID_STRIDE, and move_organization copies an
+organization to another shard with its ids unchanged: URLs, the activity
+log and the workload summary stay valid. While it copies, the
+organization is flagged UserProfile.moving: its users' requests resolve
+to no organization and shard_atomic refuses to write to it.
+"""
+import contextlib
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from crm.db import current_shard, is_directory_database
+from .choices import invalidate_agent_choices
+from .freshness import touch_organization
+from .models import Agent, Category, DeletionJob, Lead, UserProfile, organization_shard
+
+# parents first: the copied leads refer to the agents and categories
+SHARDED_MODELS = (Category, Agent, Lead)
+
+
+class ShardMoveError(Exception):
+    pass
+
+
+class OrganizationMoving(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def shard_context(shard):
+    token = current_shard.set(shard)
+    try:
+        yield
+    finally:
+        current_shard.reset(token)
+
+
+def use_shard(organization):
+    """Route the queries without an organization or instance at hand to its shard."""
+    return shard_context(organization_shard(organization))
+
+
+def writable_shard(organization):
+    """
+    The shard of an organization, given as a UserProfile or an id, read
+    afresh; OrganizationMoving while move_organization is copying it.
+    """
+    if len(settings.SHARDS) == 1:
+        return DEFAULT_DB_ALIAS
+    organization_id = organization.pk if isinstance(organization, UserProfile) else organization
+    shard, moving = (
+        UserProfile.objects.filter(pk=organization_id).values_list('shard', 'moving').first()
+        or (DEFAULT_DB_ALIAS, False)
+    )
+    if moving:
+        raise OrganizationMoving(f"Organization {organization_id} is being moved to another shard.")
+    return shard
+
+
+@contextlib.contextmanager
+def shard_atomic(organization):
+    """
+    A transaction on the default database and, when the organization lives
+    in another shard, one on its shard inside it. The two commit one after
+    the other, not atomically.
+    """
+    with transaction.atomic():
+        shard = writable_shard(organization)
+        if is_directory_database(shard):
+            yield
+        else:
+            with transaction.atomic(using=shard):
+                yield
+
+
+def agent_shard_key(user_id):
+    return f"leads:agent-shard:{user_id}"
+
+
+def find_agent(user):
+    """
+    The Agent of `user`, or None. With several shards each is tried in
+    turn, the one it was last found in first: the cached shard is only a
+    hint, and an agent is only returned from the shard its organization
+    names, so a copy left behind by an interrupted move is passed over.
+    """
+    if len(settings.SHARDS) == 1:
+        try:
+            return Agent.objects.select_related('organization').get(user=user)
+        except Agent.DoesNotExist:
+            return None
+    last_shard = cache.get(agent_shard_key(user.pk))
+    for shard in sorted(settings.SHARDS, key=lambda shard: shard != last_shard):
+        agents = Agent.objects.using(shard)
+        if is_directory_database(shard):
+            agents = agents.select_related('organization')
+        try:
+            agent = agents.get(user=user)
+        except Agent.DoesNotExist:
+            continue
+        if agent.organization.shard != shard:
+            continue
+        if shard != last_shard:
+            cache.set(agent_shard_key(user.pk), shard, None)
+        return agent
+    return None
+
+
+def apply_id_offsets(using):
+    """Start the ids of the sharded tables of the n-th shard above n * SHARD_ID_STRIDE."""
+    connection = connections[using]
+    if using not in settings.SHARDS or connection.vendor != 'sqlite':
+        return
+    offset = settings.SHARDS.index(using) * settings.SHARD_ID_STRIDE
+    if not offset:
+        return
+    with connection.cursor() as cursor:
+        for model in SHARDED_MODELS:
+            table = model._meta.db_table
+            cursor.execute("UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s", [offset, table, offset])
+            cursor.execute(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)",
+                [table, offset, table],
+            )
+
+
+def shard_sizes():
+    """{shard: (organizations, leads)} for every shard."""
+    organizations = Counter(UserProfile.objects.values_list('shard', flat=True))
+    return {
+        shard: (organizations[shard], Lead.objects.using(shard).count())
+        for shard in settings.SHARDS
+    }
+
+
+def _raw_insert(model, objs, using):
+    # raw: the ids, timestamps and maintained columns are copied as they are
+    fields = model._meta.concrete_fields
+    step = max(connections[using].ops.bulk_batch_size(fields, objs), 1)
+    for start in range(0, len(objs), step):
+        model._base_manager.using(using)._insert(objs[start:start + step], fields=fields, using=using, raw=True)
+
+
+def copy_rows(model, organization, source, target, batch_size):
+    rows = model._base_manager.using(source).filter(organization=organization).order_by('pk')
+    copied = 0
+    last_pk = 0
+    while True:
+        batch = list(rows.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            return copied
+        ids = [obj.pk for obj in batch]
+        if model._base_manager.using(target).filter(pk__in=ids).exists():
+            raise ShardMoveError(f"Some {model._meta.verbose_name_plural} ids of {organization} are taken in {target}.")
+        _raw_insert(model, batch, target)
+        copied += len(batch)
+        last_pk = ids[-1]
+
+
+def delete_rows(model, organization, shard, batch_size):
+    rows = model._base_manager.using(shard).filter(organization=organization)
+    while True:
+        ids = list(rows.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        with transaction.atomic(using=shard):
+            # no collector and no signals: the rows live on in the target
+            model._base_manager.using(shard).filter(pk__in=ids)._raw_delete(shard)
+
+
+def move_organization(organization, target, batch_size=1000, grace=None):
+    """
+    Move the organization's categories, agents and leads to the `target`
+    shard: flag it moving, wait `grace` seconds (SHARD_MOVE_GRACE_SECONDS)
+    for the requests that resolved it before to finish, copy the rows with
+    their ids in one transaction, point UserProfile.shard at the target and
+    clear the flag, then delete them from the old shard in chunks. It is
+    refused while deletion jobs of the organization are queued. Moving ids
+    into a shard with a lower id range moves that shard's next ids past
+    them (SQLite never reuses one), so a later move whose ids are taken is
+    refused rather than merged. Returns {model name: rows moved}.
+    """
+    if target not in settings.SHARDS:
+        raise ShardMoveError(f"Unknown shard {target!r}; the shards are {', '.join(settings.SHARDS)}.")
+    source = organization.shard
+    if source == target:
+        return {}
+    if organization.pending_deletion:
+        raise ShardMoveError(f"{organization} is being deleted.")
+    if not UserProfile.objects.filter(pk=organization.pk, moving=False).update(moving=True):
+        raise ShardMoveError(f"{organization} is already being moved.")
+    organization.moving = True
+    try:
+        time.sleep(settings.SHARD_MOVE_GRACE_SECONDS if grace is None else grace)
+        jobs = DeletionJob.objects.filter(
+            organization_key=organization.pk, status__in=[DeletionJob.PENDING, DeletionJob.RUNNING],
+        )
+        if jobs.exists():
+            raise ShardMoveError(f"{organization} has deletion jobs to run first.")
+        moved = {}
+        with transaction.atomic(using=target):
+            for model in SHARDED_MODELS:
+                moved[model._meta.model_name] = copy_rows(model, organization, source, target, batch_size)
+        UserProfile.objects.filter(pk=organization.pk).update(shard=target)
+        organization.shard = target
+    finally:
+        UserProfile.objects.filter(pk=organization.pk).update(moving=False)
+        organization.moving = False
+    user_ids = Agent.objects.using(target).filter(organization=organization).values_list('user', flat=True)
+    cache.delete_many([agent_shard_key(user_id) for user_id in user_ids])
+    invalidate_agent_choices(organization.pk)
+    touch_organization(organization.pk)
+    for model in reversed(SHARDED_MODELS):
+        delete_rows(model, organization, source, batch_size)
+    return moved
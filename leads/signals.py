@@ -0,0 +1,122 @@
+from django.db import connections
+
+from .activity import lead_events, record_activity
+from .choices import invalidate_agent_choices
+from .counters import adjust_category_counts
+from .freshness import touch_organization
+from .models import Category, LeadActivity
+from .search import ensure_search_index
+from .sharding import apply_id_offsets, find_agent
+from .workload import adjust_workload, cell as workload_cell, delete_workload, fold_workload
+
+UNKNOWN = object()
+# agent labels are the user's email, the agent pages show the username
+AGENT_LABEL_FIELDS = ('username', 'email')
+
+
+def remember_lead_state(sender, instance, **kwargs):
+    # deferred fields are not in __dict__; don't trigger a query to read them
+    instance._loaded_category_id = instance.__dict__.get('category_id', UNKNOWN)
+    instance._loaded_agent_id = instance.__dict__.get('agent_id', UNKNOWN)
+
+
+def record_lead_activity_on_save(sender, instance, created, raw=False, using=None, **kwargs):
+    # connected before update_counts_on_lead_save, which resets the loaded state
+    if raw:
+        return
+    if created:
+        events = lead_events(instance.pk, instance.agent_id, instance.category_id)
+    else:
+        events = []
+        if instance._loaded_agent_id not in (UNKNOWN, instance.agent_id):
+            events.append((instance.pk, LeadActivity.ASSIGNED, instance.agent_id))
+        if instance._loaded_category_id not in (UNKNOWN, instance.category_id):
+            events.append((instance.pk, LeadActivity.CATEGORIZED, instance.category_id))
+    record_activity(instance.organization_id, events, using)
+
+
+def record_lead_activity_on_delete(sender, instance, using=None, **kwargs):
+    record_activity(instance.organization_id, [(instance.pk, LeadActivity.DELETED, None)], using)
+
+
+def update_counts_on_lead_save(sender, instance, created, raw=False, using=None, **kwargs):
+    if raw:
+        return
+    old_category_id = None if created else instance._loaded_category_id
+    old_agent_id = None if created else instance._loaded_agent_id
+    if created:
+        adjust_category_counts(instance.organization_id, {instance.category_id: 1}, using)
+    elif old_category_id is not UNKNOWN and old_category_id != instance.category_id:
+        adjust_category_counts(instance.organization_id, {old_category_id: -1, instance.category_id: 1}, using)
+    new_cell = workload_cell(instance.agent_id, instance.category_id)
+    if created:
+        adjust_workload(instance.organization_id, {new_cell: 1})
+    elif UNKNOWN not in (old_agent_id, old_category_id):
+        old_cell = workload_cell(old_agent_id, old_category_id)
+        if old_cell != new_cell:
+            adjust_workload(instance.organization_id, {old_cell: -1, new_cell: 1})
+    instance._loaded_category_id = instance.category_id
+    instance._loaded_agent_id = instance.agent_id
+
+
+def update_counts_on_lead_delete(sender, instance, using=None, **kwargs):
+    adjust_category_counts(instance.organization_id, {instance.category_id: -1}, using)
+    adjust_workload(instance.organization_id, {workload_cell(instance.agent_id, instance.category_id): -1})
+
+
+def fold_workload_on_agent_delete(sender, instance, **kwargs):
+    # the agent's leads were set to no agent without signals
+    fold_workload(instance.organization_id, agent_key=instance.pk)
+
+
+def uncategorize_counts_on_category_delete(sender, instance, using=None, **kwargs):
+    # the category's leads are about to be set to no category without signals
+    lead_count = Category.objects.using(using).filter(pk=instance.pk).values_list('lead_count', flat=True).first()
+    adjust_category_counts(instance.organization_id, {None: lead_count or 0}, using)
+
+
+def fold_workload_on_category_delete(sender, instance, **kwargs):
+    fold_workload(instance.organization_id, category_key=instance.pk)
+
+
+def delete_workload_on_organization_delete(sender, instance, **kwargs):
+    delete_workload(instance.pk)
+
+
+def invalidate_agent_choices_on_agent_change(sender, instance, **kwargs):
+    invalidate_agent_choices(instance.organization_id)
+
+
+def remember_user_label(sender, instance, **kwargs):
+    instance._loaded_label = tuple(instance.__dict__.get(field, UNKNOWN) for field in AGENT_LABEL_FIELDS)
+
+
+def invalidate_agent_choices_on_user_change(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # e.g. the last_login update of every login changes nothing shown
+    if raw or created or not instance.is_agent:
+        return
+    if update_fields is not None and not set(update_fields) & set(AGENT_LABEL_FIELDS):
+        return
+    label = tuple(getattr(instance, field) for field in AGENT_LABEL_FIELDS)
+    if label == instance._loaded_label:
+        return
+    instance._loaded_label = label
+    agent = find_agent(instance)
+    if agent is not None:
+        invalidate_agent_choices(agent.organization_id)
+        touch_organization(agent.organization_id)
+
+
+def touch_organization_on_change(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    touch_organization(instance.organization_id)
+
+
+def ensure_lead_search_index(sender, using, **kwargs):
+    # migrations that rebuild leads_lead drop the search triggers with it
+    ensure_search_index(connections[using])
+
+
+def apply_shard_id_offsets(sender, using, **kwargs):
+    apply_id_offsets(using)
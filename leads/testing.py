@@ -0,0 +1,39 @@
+"""Fixtures shared by the tests of the leads and agents apps."""
+from django import test
+from django.core.cache import cache
+from django.db import connections
+
+from .models import Agent, User
+
+
+class TestCase(test.TestCase):
+    """
+    A TestCase that starts every test with an empty cache: unlike the
+    database, the cache (agent shards, choices, fragments, pages) outlives
+    the test transaction.
+    """
+
+    def _pre_setup(self):
+        super()._pre_setup()
+        cache.clear()
+
+
+def create_organizer(username='organizer'):
+    """An organizer user and its organization (UserProfile)."""
+    user = User.objects.create_user(username=username, email=f'{username}@example.com', password='password')
+    return user, user.userprofile
+
+
+def create_agent(organization, username='agent'):
+    user = User.objects.create_user(
+        username=username, email=f'{username}@example.com', password='password', is_organizor=False, is_agent=True,
+    )
+    return Agent.objects.using(organization.shard).create(user=user, organization=organization)
+
+
+def query_plan(queryset):
+    """SQLite's EXPLAIN QUERY PLAN details of `queryset`, one line per step."""
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[-1] for row in cursor.fetchall()]
@@ -1,3 +1,1001 @@
-from django.test import TestCase
+import datetime
+import json
+from collections import Counter
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .activity import buffer as activity_buffer, new_lead_events, record_activity
+from .choices import agent_choices
+from .counters import rebuild_category_counts
+from .deletion import enqueue_agent_deletion, enqueue_lead_deletion, run_deletion_job, run_deletion_jobs
+from .distribution import LEAST_LOADED, ROUND_ROBIN, assign_leads, distribute_leads, plan_least_loaded
+from .duplicates import find_duplicates, rebuild_block_keys
+from .exporters import export_leads
+from .mail import claim_due_mail, queue_mail, send_queued_mail
+from .middleware import resolve_tenant
+from .models import (
+    Agent, Category, DeletionJob, Lead, LeadActivity, OutgoingEmail, User, UserProfile, organization_shard,
+)
+from .pagination import KeysetPage, decode_cursor, encode_cursor
+from .scoring import NONE_KEY, SECONDS_PER_DAY, compute_scores, lookup, score_leads
+from .search import match_expression, tenant_match_expression
+from .sharding import (
+    OrganizationMoving, ShardMoveError, find_agent, move_organization, shard_atomic, shard_context, use_shard,
+)
+from .testing import TestCase, create_agent, create_organizer, query_plan
+from .workload import adjust_workload, rebuild_workload, workload_cells
+
+
+class LeadImportTests(TestCase):
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+        self.client.force_login(self.user)
+
+    def post_import(self, name, content):
+        return self.client.post('/leads/import/', {'file': SimpleUploadedFile(name, content)})
+
+    def test_import_csv(self):
+        response = self.post_import('leads.csv', 'first_name,last_name,age\nJosé,Müller,30\nAnn,Lee,x\n'.encode())
+        self.assertEqual(response.status_code, 200)
+        result = response.context['result']
+        self.assertEqual((result.processed, result.created, result.rejected), (2, 1, 1))
+        self.assertEqual(result.errors[0][0], 3)
+        self.assertTrue(Lead.objects.filter(first_name='José', organization=self.organization).exists())
+
+    def test_non_utf8_file_is_rejected_at_its_line(self):
+        content = 'first_name,last_name,age\nAnn,Lee,20\nJosé,Müller,30\nBob,Ray,40\n'.encode('latin-1')
+        response = self.post_import('leads.csv', content)
+        self.assertEqual(response.status_code, 200)
+        result = response.context['result']
+        self.assertEqual((result.created, result.rejected), (1, 1))
+        self.assertEqual(result.errors, [(3, "Not UTF-8 text: the file was only read up to this line.")])
+        self.assertContains(response, "Line 3: Not UTF-8 text")
+        self.assertEqual(list(Lead.objects.values_list('first_name', flat=True)), ['Ann'])
+
+    def test_non_utf8_jsonl_is_rejected_at_its_line(self):
+        content = '{"first_name": "José", "last_name": "Müller", "age": 30}\n'.encode('latin-1')
+        result = self.post_import('leads.jsonl', content).context['result']
+        self.assertEqual(result.errors[0][0], 1)
+        self.assertFalse(Lead.objects.exists())
+
+
+class KeysetPaginationTests(TestCase):
+
+    def test_cursor_keeps_datetime_microseconds(self):
+        ts = timezone.now().replace(microsecond=123456)
+        self.assertEqual(decode_cursor(encode_cursor([ts, 7]), 2), [ts, 7])
+
+    def test_activity_pages_across_events_sharing_a_timestamp(self):
+        user, organization = create_organizer()
+        lead = Lead.objects.create(first_name='Ann', last_name='Lee', age=30, organization=organization)
+        LeadActivity.objects.all().delete()
+        start = timezone.now().replace(microsecond=123456)
+        # record_activity stamps the events of one call with the same time
+        LeadActivity.objects.bulk_create([
+            LeadActivity(
+                organization_key=organization.pk, lead_key=lead.pk, kind=LeadActivity.ASSIGNED,
+                ts=start + datetime.timedelta(seconds=index // 3),
+            )
+            for index in range(30)
+        ])
+        self.client.force_login(user)
+        url = f'/leads/{lead.pk}/activity/'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            seen.extend(event.pk for event in response.context['events'])
+            next_url = response.context['events_links'].next_url
+            url = f'/leads/{lead.pk}/activity/{next_url}' if next_url else None
+        expected = LeadActivity.objects.filter(lead_key=lead.pk).order_by('-ts', '-id')
+        self.assertEqual(seen, list(expected.values_list('id', flat=True)))
+        self.assertEqual(len(seen), 30)
+
+    def test_page_after_cursor(self):
+        user, organization = create_organizer()
+        Lead.objects.bulk_create([
+            Lead(first_name=f'F{index}', last_name='L', age=index, organization=organization) for index in range(5)
+        ])
+        first = KeysetPage(Lead.objects.all(), ('-age', '-id'), 2)
+        second = KeysetPage(Lead.objects.all(), ('-age', '-id'), 2, first.next_cursor)
+        self.assertEqual([lead.age for lead in first], [4, 3])
+        self.assertEqual([lead.age for lead in second], [2, 1])
+
+
+class ScoringTests(TestCase):
+    weights = {'age': 0.1, 'category': 0.4, 'agent_load': -0.2, 'recency': 0.5}
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+
+    def test_lookup(self):
+        values = lookup({1: 0.5, 5: 2.0}, np.array([5, 1, 3, 0, 9]), default=-1.0)
+        self.assertEqual(values.tolist(), [2.0, 0.5, -1.0, -1.0, -1.0])
+
+    def test_compute_scores(self):
+        now = 1_000_000_000.0
+        columns = {
+            'age': np.array([50.0, 200.0]),
+            'category': np.array([NONE_KEY, 7]),
+            'agent': np.array([NONE_KEY, 3]),
+            'created': np.array([now, now - 14 * SECONDS_PER_DAY]),
+        }
+        scores = compute_scores(columns, {NONE_KEY: 1.0, 7: 0.0}, {NONE_KEY: 0.0, 3: 1.0}, now, self.weights, 14)
+        # 0.1 * 0.5 + 0.4 * 1 + 0.5 * 1, and 0.1 * 1 (capped age) - 0.2 * 1 + 0.5 / 2
+        self.assertEqual(scores.tolist(), [95.0, 15.0])
+
+    def test_score_leads_rescores_changed_leads(self):
+        agent = create_agent(self.organization)
+        converted = Category.objects.create(name='Converted', organization=self.organization)
+        hot = Lead.objects.create(first_name='Hot', last_name='Lead', age=90, organization=self.organization)
+        cold = Lead.objects.create(
+            first_name='Cold', last_name='Lead', age=10, agent=agent, category=converted, organization=self.organization,
+        )
+        self.assertEqual(score_leads(self.organization, full=True), 2)
+        self.organization.refresh_from_db()
+        self.assertIsNotNone(self.organization.scored_at)
+        hot.refresh_from_db()
+        cold.refresh_from_db()
+        self.assertGreater(hot.score, cold.score)
+
+        # only the lead saved since the last run is rescored
+        Lead.objects.filter(pk=hot.pk).update(score=0)
+        cold.category = None
+        cold.save()
+        self.assertEqual(score_leads(self.organization), 1)
+        self.assertEqual(Lead.objects.get(pk=hot.pk).score, 0)
+        self.assertEqual(score_leads(UserProfile.objects.get(pk=self.organization.pk)), 0)
+        self.assertEqual(score_leads(self.organization, full=True), 2)
+        self.assertGreater(Lead.objects.get(pk=hot.pk).score, 0)
+
+    def test_new_leads_get_a_first_score(self):
+        agent = create_agent(self.organization)
+        contacted = Category.objects.create(name='Contacted', organization=self.organization)
+        created = Lead.objects.create(first_name='Ann', last_name='Lee', age=40, agent=agent, organization=self.organization)
+        Lead.objects.bulk_create([
+            Lead(first_name='Bob', last_name='Ray', age=20, category=contacted, organization=self.organization),
+            Lead(first_name='Cat', last_name='Doe', age=60, organization=self.organization),
+        ])
+        first_scores = dict(Lead.objects.values_list('first_name', 'score'))
+        self.assertTrue(all(score > 0 for score in first_scores.values()))
+        score_leads(self.organization, full=True)
+        for first_name, score in Lead.objects.values_list('first_name', 'score'):
+            self.assertAlmostEqual(first_scores[first_name], score, places=2)
+        self.assertGreater(created.score, 0)
+
+    def test_first_score_reads_the_workload_summary(self):
+        agent = create_agent(self.organization)
+        Lead.objects.create(first_name='Ann', last_name='Lee', age=40, agent=agent, organization=self.organization)
+        with CaptureQueriesContext(connection) as queries:
+            Lead.objects.create(first_name='Bob', last_name='Ray', age=40, agent=agent, organization=self.organization)
+        self.assertFalse([
+            query['sql'] for query in queries if query['sql'].startswith('SELECT') and '"leads_lead"' in query['sql']
+        ])
+
+    def test_unchanged_scores_leave_the_organization_untouched(self):
+        Lead.objects.create(first_name='Ann', last_name='Lee', age=40, organization=self.organization)
+        with mock.patch('leads.scoring.timezone.now', return_value=timezone.now()):
+            score_leads(self.organization, full=True)
+            version = UserProfile.objects.get(pk=self.organization.pk).data_version
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(score_leads(self.organization, full=True), 1)
+            self.assertFalse([query['sql'] for query in queries if query['sql'].startswith('UPDATE "leads_lead"')])
+            self.assertEqual(UserProfile.objects.get(pk=self.organization.pk).data_version, version)
+            Lead.objects.update(score=0)
+            score_leads(self.organization, full=True)
+        self.assertEqual(UserProfile.objects.get(pk=self.organization.pk).data_version, version + 1)
+
+    def test_new_lead_is_listed_among_scored_leads(self):
+        Lead.objects.bulk_create([
+            Lead(first_name=f'Old{index}', last_name='Lead', age=20, organization=self.organization) for index in range(30)
+        ])
+        score_leads(self.organization, full=True)
+        Lead.objects.create(first_name='New', last_name='Lead', age=50, organization=self.organization)
+        self.client.force_login(self.user)
+        response = self.client.get('/leads/')
+        self.assertEqual(response.context['unassigned_leads'].object_list[0].first_name, 'New')
+
+
+class ShardingTests(TestCase):
+    # crm/test_settings.py adds the shard
+    databases = {'default', 'shard1'}
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+        self.category = Category.objects.create(name='Contacted', organization=self.organization)
+        self.agent = create_agent(self.organization)
+        self.leads = [
+            Lead.objects.create(first_name=f'F{index}', last_name='L', age=index, agent=self.agent, organization=self.organization)
+            for index in range(3)
+        ]
+
+    def move(self, target='shard1'):
+        return move_organization(self.organization, target, batch_size=2, grace=0)
+
+    def test_move_organization_keeps_ids(self):
+        self.assertEqual(self.move(), {'category': 1, 'agent': 1, 'lead': 3})
+        self.assertEqual(UserProfile.objects.get(pk=self.organization.pk).shard, 'shard1')
+        self.assertEqual(organization_shard(self.organization.pk), 'shard1')
+        self.assertEqual(
+            set(Lead.objects.using('shard1').values_list('id', flat=True)), {lead.pk for lead in self.leads}
+        )
+        self.assertFalse(Lead.objects.using('default').exists())
+        self.assertFalse(Agent.objects.using('default').exists())
+        agent = find_agent(self.agent.user)
+        self.assertEqual((agent.pk, agent._state.db), (self.agent.pk, 'shard1'))
+
+        self.assertEqual(self.move('default'), {'category': 1, 'agent': 1, 'lead': 3})
+        self.assertEqual(Lead.objects.for_organization(self.organization.pk).count(), 3)
+        self.assertFalse(Lead.objects.using('shard1').exists())
+        self.assertEqual(find_agent(self.agent.user)._state.db, 'default')
+        self.assertEqual(self.move('default'), {})
+
+    def test_new_rows_get_the_ids_of_their_shard(self):
+        self.move()
+        with use_shard(self.organization):
+            lead = Lead.objects.create(first_name='New', last_name='L', age=1, organization=self.organization)
+        self.assertEqual(lead._state.db, 'shard1')
+        self.assertGreater(lead.pk, settings.SHARD_ID_STRIDE)
+
+    def test_shard_map_is_read_from_the_organization(self):
+        self.move()
+        # e.g. a move run by another process: nothing may keep the old shard
+        UserProfile.objects.filter(pk=self.organization.pk).update(shard='default')
+        self.assertEqual(organization_shard(self.organization.pk), 'default')
+
+    def test_moving_organization_is_idle(self):
+        UserProfile.objects.filter(pk=self.organization.pk).update(moving=True)
+        self.assertIsNone(resolve_tenant(User.objects.get(pk=self.user.pk)).organization)
+        self.assertIsNone(resolve_tenant(User.objects.get(pk=self.agent.user_id)).organization)
+        with self.assertRaises(OrganizationMoving):
+            with shard_atomic(self.organization):
+                pass
+        with self.assertRaises(ShardMoveError):
+            self.move()
+
+    def test_move_waits_for_deletion_jobs(self):
+        enqueue_lead_deletion(self.organization, lead_ids=[self.leads[0].pk])
+        with self.assertRaises(ShardMoveError):
+            self.move()
+        self.assertFalse(UserProfile.objects.get(pk=self.organization.pk).moving)
+        self.assertEqual(run_deletion_jobs(), 1)
+        self.assertEqual(self.move()['lead'], 2)
+
+    def test_views_and_jobs_on_the_shard(self):
+        self.move()
+        category = Category.objects.using('shard1').get(pk=self.category.pk)
+        self.client.force_login(self.user)
+
+        response = self.client.post('/leads/create/', {'first_name': 'Ann', 'last_name': 'Lee', 'age': 30, 'agent': self.agent.pk})
+        self.assertEqual(response.status_code, 302)
+        created = Lead.objects.using('shard1').get(first_name='Ann')
+        self.assertEqual(created.agent_id, self.agent.pk)
+
+        self.client.post(f'/leads/{created.pk}/update/', {'first_name': 'Anne', 'last_name': 'Lee', 'age': 31, 'agent': self.agent.pk})
+        self.client.post(f'/leads/{created.pk}/category/', {'category': category.pk})
+        created.refresh_from_db()
+        self.assertEqual((created.first_name, created.category_id), ('Anne', category.pk))
+        self.assertEqual(Category.objects.using('shard1').get(pk=category.pk).lead_count, 1)
+
+        self.client.post('/leads/import/', {'file': SimpleUploadedFile('leads.csv', b'first_name,last_name,age\nBob,Ray,40\nBob,Ray,40\n')})
+        bobs = list(Lead.objects.using('shard1').filter(first_name='Bob').order_by('id').values_list('id', flat=True))
+        self.assertEqual(len(bobs), 2)
+        self.client.post('/leads/duplicates/', {'survivor': bobs[0], 'duplicates': [bobs[1]]})
+        self.assertEqual(Lead.objects.using('shard1').filter(first_name='Bob').count(), 1)
+
+        self.client.post(f'/leads/{self.leads[0].pk}/delete/')
+        self.assertFalse(Lead.objects.using('shard1').filter(pk=self.leads[0].pk).exists())
+
+        self.client.force_login(self.agent.user)
+        response = self.client.get('/leads/')
+        self.assertEqual(
+            {lead.pk for lead in response.context['leads']}, {created.pk, self.leads[1].pk, self.leads[2].pk}
+        )
+
+        self.client.force_login(self.user)
+        self.client.post(f'/agents/{self.agent.pk}/delete/')
+        self.assertEqual(run_deletion_jobs(), 1)
+        self.assertFalse(Agent.objects.using('shard1').exists())
+        self.assertFalse(Lead.objects.using('shard1').filter(agent__isnull=False).exists())
+        self.assertEqual(Lead.objects.using('shard1').count(), 4)
+        self.assertFalse(Lead.objects.using('default').exists())
+
+
+class LeadIndexTests(TestCase):
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+        self.agent = create_agent(self.organization)
+        self.category = Category.objects.create(name='Contacted', organization=self.organization)
+
+    def assertUsesIndex(self, queryset, index):
+        plan = query_plan(queryset)
+        self.assertTrue(any(index in step for step in plan), plan)
+
+    def test_tenant_queries_use_the_lead_indexes(self):
+        leads = Lead.objects.for_organization(self.organization)
+        self.assertUsesIndex(leads.filter(agent=self.agent), 'lead_org_agent_idx')
+        self.assertUsesIndex(leads.filter(category=self.category).order_by('id'), 'lead_org_category_idx')
+        self.assertUsesIndex(leads.filter(category__isnull=True), 'lead_org_category_idx')
+
+    def test_lead_panels_are_read_in_score_order(self):
+        leads = Lead.objects.for_organization(self.organization).order_by('-score', '-id')
+        for panel in (leads.filter(agent__isnull=True), leads.filter(agent__isnull=False)):
+            plan = query_plan(panel[:20])
+            self.assertFalse(any('TEMP B-TREE' in step for step in plan), plan)
+
+
+class TenantTests(TestCase):
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+        self.agent = create_agent(self.organization)
+
+    def test_resolve_organizer(self):
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            tenant = resolve_tenant(user)
+            self.assertEqual(user.userprofile, self.organization)
+        self.assertEqual((tenant.organization, tenant.agent), (self.organization, None))
+        self.assertTrue(tenant.is_organizor)
+
+    def test_resolve_agent(self):
+        user = User.objects.get(pk=self.agent.user_id)
+        with self.assertNumQueries(1):
+            tenant = resolve_tenant(user)
+            self.assertEqual(tenant.organization, self.organization)
+        self.assertEqual(tenant.agent, self.agent)
+        self.assertFalse(tenant.is_organizor)
+
+    def test_resolve_without_organization(self):
+        self.assertIsNone(resolve_tenant(AnonymousUser()).organization)
+        UserProfile.objects.filter(pk=self.organization.pk).update(pending_deletion=True)
+        self.assertIsNone(resolve_tenant(User.objects.get(pk=self.user.pk)).organization)
+        self.assertIsNone(resolve_tenant(User.objects.get(pk=self.agent.user_id)).organization)
+
+    def test_agents_only_see_their_leads(self):
+        other = create_agent(self.organization, 'other')
+        mine = Lead.objects.create(first_name='Ann', last_name='Lee', agent=self.agent, organization=self.organization)
+        theirs = Lead.objects.create(first_name='Bob', last_name='Ray', agent=other, organization=self.organization)
+        self.client.force_login(self.agent.user)
+        response = self.client.get('/leads/')
+        self.assertEqual(list(response.context['leads']), [mine])
+        self.assertEqual(self.client.get(f'/leads/{theirs.pk}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/leads/{mine.pk}/').status_code, 200)
+
+    def test_other_organizations_are_hidden(self):
+        other_user, other_organization = create_organizer('other')
+        lead = Lead.objects.create(first_name='Ann', last_name='Lee', organization=other_organization)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(f'/leads/{lead.pk}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/leads/{lead.pk}/update/').status_code, 404)
+
+
+class OutboxTests(TestCase):
+
+    def queue(self, subject='Hello'):
+        return queue_mail(subject, 'Body', 'crm@example.com', ['a@example.com', 'b@example.com'])
+
+    def test_mail_is_queued_with_the_transaction(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                self.queue()
+                raise ValueError
+        self.assertFalse(OutgoingEmail.objects.exists())
+        self.queue()
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_send_queued_mail(self):
+        self.queue('One')
+        self.queue('Two')
+        self.assertEqual(send_queued_mail(batch_size=1), (2, 0))
+        self.assertEqual([message.subject for message in mail.outbox], ['One', 'Two'])
+        self.assertEqual(mail.outbox[0].to, ['a@example.com', 'b@example.com'])
+        self.assertEqual(set(OutgoingEmail.objects.values_list('status', flat=True)), {OutgoingEmail.SENT})
+        self.assertEqual(send_queued_mail(), (0, 0))
+
+    def test_claimed_mail_is_not_sent_twice(self):
+        email = self.queue()
+        self.assertEqual(claim_due_mail('worker-a', 10, lease=600), [email])
+        # another worker finds nothing to send while the claim holds
+        self.assertEqual(claim_due_mail('worker-b', 10, lease=600), [])
+        self.assertEqual(send_queued_mail(), (0, 0))
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_expired_claim_is_sent_again(self):
+        email = self.queue()
+        claim_due_mail('worker-a', 10, lease=0)
+        self.assertEqual(send_queued_mail(), (1, 0))
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutgoingEmail.SENT)
+
+    def test_failed_mail_is_retried_later(self):
+        email = self.queue()
+        with self.settings(EMAIL_BACKEND='leads.tests.FailingEmailBackend'), self.assertLogs('leads.mail', 'WARNING'):
+            self.assertEqual(send_queued_mail(max_attempts=2, backoff=60), (0, 1))
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts), (OutgoingEmail.PENDING, 1))
+            self.assertGreater(email.next_attempt_at, timezone.now())
+            self.assertEqual(send_queued_mail(), (0, 0))
+            OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+            self.assertEqual(send_queued_mail(max_attempts=2), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.last_error), (OutgoingEmail.FAILED, 'Mail server down'))
+
+
+class CategoryCounterTests(TestCase):
+    databases = {'default', 'shard1'}
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+        self.contacted = Category.objects.create(name='Contacted', organization=self.organization)
+        self.converted = Category.objects.create(name='Converted', organization=self.organization)
+
+    def create_lead(self, category=None):
+        return Lead.objects.create(first_name='Ann', last_name='Lee', age=30, category=category, organization=self.organization)
+
+    def assertCounts(self, contacted, converted, uncategorized):
+        self.assertEqual(
+            (
+                Category.objects.get(pk=self.contacted.pk).lead_count,
+                Category.objects.get(pk=self.converted.pk).lead_count,
+                UserProfile.objects.get(pk=self.organization.pk).uncategorized_lead_count,
+            ),
+            (contacted, converted, uncategorized),
+        )
+
+    def test_create_recategorize_and_delete(self):
+        lead = self.create_lead()
+        self.create_lead(self.contacted)
+        self.assertCounts(1, 0, 1)
+        lead.category = self.converted
+        lead.save()
+        self.assertCounts(1, 1, 0)
+        lead.category = None
+        lead.save()
+        self.assertCounts(1, 0, 1)
+        lead.delete()
+        self.assertCounts(1, 0, 0)
+
+    def test_deleted_category_leads_become_uncategorized(self):
+        self.create_lead(self.contacted)
+        self.create_lead(self.contacted)
+        self.contacted.delete()
+        self.assertEqual(UserProfile.objects.get(pk=self.organization.pk).uncategorized_lead_count, 2)
+
+    def test_import(self):
+        self.client.force_login(self.user)
+        content = 'first_name,last_name,age,category\nAnn,Lee,30,contacted\nBob,Ray,40,\nCat,Doe,50,\n'
+        self.client.post('/leads/import/', {'file': SimpleUploadedFile('leads.csv', content.encode())})
+        self.assertCounts(1, 0, 2)
+
+    def test_rebuild(self):
+        self.create_lead(self.contacted)
+        self.create_lead()
+        Category.objects.update(lead_count=7)
+        UserProfile.objects.update(uncategorized_lead_count=7)
+        rebuild_category_counts()
+        self.assertCounts(1, 0, 1)
+
+    def test_category_list_does_not_count_leads(self):
+        self.create_lead(self.contacted)
+        self.create_lead()
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/leads/categories/')
+        self.assertEqual(response.context['unassigned_lead_count'], 1)
+        self.assertContains(response, 'Contacted')
+        self.assertFalse([query['sql'] for query in queries if 'COUNT' in query['sql'] and 'leads_lead' in query['sql']])
+
+
+class CategoryDetailTests(TestCase):
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+        self.category = Category.objects.create(name='Contacted', organization=self.organization)
+        for index in range(30):
+            Lead.objects.create(
+                first_name=f'F{index}', last_name='L', age=20, category=self.category, organization=self.organization,
+            )
+        Lead.objects.create(first_name='Other', last_name='L', age=20, organization=self.organization)
+        self.client.force_login(self.user)
+
+    def test_pages_the_category_leads(self):
+        url = f'/leads/categories/{self.category.pk}'
+        response = self.client.get(url)
+        self.assertEqual(response.context['lead_count'], 30)
+        first = list(response.context['leads'])
+        self.assertEqual(len(first), 25)
+        # only the columns the template renders
+        self.assertEqual(set(first[0]), {'id', 'first_name', 'last_name'})
+        response = self.client.get(url + response.context['leads_links'].next_url)
+        second = list(response.context['leads'])
+        self.assertIsNone(response.context['leads_links'].next_url)
+        self.assertEqual(
+            [lead['id'] for lead in first + second],
+            list(Lead.objects.filter(category=self.category).order_by('id').values_list('id', flat=True)),
+        )
+
+    def test_other_organizations_category_is_not_found(self):
+        other_user, other_organization = create_organizer('other')
+        self.client.force_login(other_user)
+        self.assertEqual(self.client.get(f'/leads/categories/{self.category.pk}').status_code, 404)
+
+
+class DistributionTests(TestCase):
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+        self.ann = create_agent(self.organization, 'ann')
+        self.bob = create_agent(self.organization, 'bob')
+        self.category = Category.objects.create(name='Contacted', organization=self.organization)
+        self.leads = [
+            Lead.objects.create(
+                first_name=f'F{index}', last_name='L', age=20, organization=self.organization,
+                category=self.category if index % 2 else None,
+            )
+            for index in range(5)
+        ]
+
+    def agents(self):
+        return list(Lead.objects.order_by('id').values_list('agent', flat=True))
+
+    def assertWorkloadMatchesLeads(self):
+        self.assertEqual(
+            workload_cells(self.organization),
+            workload_cells(self.organization, use_summary=False),
+        )
+
+    def test_assign_all_unassigned_in_batches(self):
+        self.leads[0].agent = self.bob
+        self.leads[0].save()
+        with mock.patch('leads.distribution.record_activity') as record_activity:
+            self.assertEqual(assign_leads(self.organization, self.ann, batch_size=2), 4)
+        self.assertEqual(self.agents(), [self.bob.pk] + [self.ann.pk] * 4)
+        self.assertWorkloadMatchesLeads()
+        self.assertEqual(
+            [lead_id for call in record_activity.call_args_list for lead_id, _, _ in call.args[1]],
+            [lead.pk for lead in self.leads[1:]],
+        )
+
+    def test_assign_selected_leads(self):
+        self.leads[0].agent = self.bob
+        self.leads[0].save()
+        selected = [self.leads[0].pk, self.leads[3].pk]
+        self.assertEqual(assign_leads(self.organization, self.ann, selected, batch_size=1), 2)
+        self.assertEqual(self.agents(), [self.ann.pk, None, None, self.ann.pk, None])
+        self.assertWorkloadMatchesLeads()
+
+    def test_round_robin(self):
+        self.assertEqual(distribute_leads(self.organization, ROUND_ROBIN, batch_size=2), 5)
+        self.assertEqual(self.agents(), [self.ann.pk, self.bob.pk] * 2 + [self.ann.pk])
+        self.assertWorkloadMatchesLeads()
+
+    def test_least_loaded(self):
+        self.leads[0].agent = self.ann
+        self.leads[0].save()
+        self.assertEqual(distribute_leads(self.organization, LEAST_LOADED), 4)
+        self.assertEqual(Counter(self.agents()), {self.ann.pk: 3, self.bob.pk: 2})
+        self.assertWorkloadMatchesLeads()
+
+    def test_leads_assigned_concurrently_are_left_alone(self):
+        def plan_then_assign_elsewhere(lead_ids, loads):
+            plan = plan_least_loaded(lead_ids, loads)
+            Lead.objects.filter(pk=lead_ids[0]).update(agent=self.ann)
+            adjust_workload(self.organization.pk, {(NONE_KEY, NONE_KEY): -1, (self.ann.pk, NONE_KEY): 1})
+            return plan
+
+        with mock.patch('leads.distribution.plan_least_loaded', plan_then_assign_elsewhere), \
+                mock.patch('leads.distribution.record_activity') as record_activity:
+            self.assertEqual(distribute_leads(self.organization, LEAST_LOADED), 4)
+        self.assertWorkloadMatchesLeads()
+        self.assertEqual(len(record_activity.call_args.args[1]), 4)
+
+
+class AgentChoicesTests(TestCase):
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+        self.agent = create_agent(self.organization)
+
+    def data_version(self):
+        return UserProfile.objects.get(pk=self.organization.pk).data_version
+
+    def test_choices_are_cached(self):
+        self.assertEqual(agent_choices(self.organization.pk), [(self.agent.pk, 'agent@example.com')])
+        with self.assertNumQueries(0):
+            agent_choices(self.organization.pk)
+
+    def test_label_change_invalidates(self):
+        agent_choices(self.organization.pk)
+        version = self.data_version()
+        user = User.objects.get(pk=self.agent.user.pk)
+        user.email = 'new@example.com'
+        user.save()
+        self.assertEqual(agent_choices(self.organization.pk), [(self.agent.pk, 'new@example.com')])
+        self.assertEqual(self.data_version(), version + 1)
+
+    def test_new_agent_invalidates(self):
+        agent_choices(self.organization.pk)
+        other = create_agent(self.organization, 'other')
+        self.assertEqual([pk for pk, label in agent_choices(self.organization.pk)], [self.agent.pk, other.pk])
+
+    def test_login_and_unrelated_saves_keep_the_cache(self):
+        agent_choices(self.organization.pk)
+        version = self.data_version()
+        self.assertTrue(self.client.login(username='agent', password='password'))
+        user = User.objects.get(pk=self.agent.user.pk)
+        user.first_name = 'Ann'
+        user.save()
+        self.assertEqual(self.data_version(), version)
+        with self.assertNumQueries(0):
+            agent_choices(self.organization.pk)
+
+
+class LeadSearchTests(TestCase):
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+        self.agent = create_agent(self.organization)
+        self.ann = Lead.objects.create(first_name='Ann', last_name='Müller', age=30, organization=self.organization)
+        self.anna = Lead.objects.create(
+            first_name='Anna', last_name='Lee', age=30, agent=self.agent, organization=self.organization,
+        )
+        other_user, other_organization = create_organizer('other')
+        Lead.objects.create(first_name='Ann', last_name='Hidden', age=30, organization=other_organization)
+        self.client.force_login(self.user)
+
+    def search(self, text):
+        return list(self.client.get('/leads/search/', {'q': text}).context['leads'])
+
+    def test_prefixes_and_diacritics(self):
+        self.assertEqual(self.search('ann'), [self.ann, self.anna])
+        self.assertEqual(self.search('an mull'), [self.ann])
+
+    def test_only_the_tenants_leads(self):
+        self.assertNotIn('Hidden', [lead.last_name for lead in self.search('ann')])
+        self.client.force_login(self.agent.user)
+        self.assertEqual(self.search('ann'), [self.anna])
+
+    def test_organization_id_is_not_searchable_as_a_name(self):
+        self.assertEqual(self.search(str(self.organization.pk)), [])
+
+    def test_renamed_and_deleted_leads(self):
+        self.ann.first_name = 'Bea'
+        self.ann.save()
+        self.assertEqual(self.search('bea'), [self.ann])
+        self.ann.delete()
+        self.assertEqual(self.search('bea'), [])
+
+    def test_organization_is_matched_inside_the_index(self):
+        self.assertEqual(
+            tenant_match_expression(match_expression('ann lee'), 7),
+            'organization_id : "7" AND {first_name last_name} : ("ann"* "lee"*)',
+        )
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+        self.lead = Lead.objects.create(first_name='Ann', last_name='Lee', age=30, organization=self.organization)
+        self.client.force_login(self.user)
+
+    def test_unchanged_page_is_not_modified(self):
+        response = self.client.get('/leads/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Last-Modified'])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/leads/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([query['sql'] for query in queries if 'leads_lead"' in query['sql']])
+
+    def test_write_changes_the_etag(self):
+        etag = self.client.get('/leads/categories/')['ETag']
+        Category.objects.create(name='Contacted', organization=self.organization)
+        response = self.client.get('/leads/categories/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Contacted')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_differs_per_user_and_url(self):
+        etag = self.client.get('/leads/')['ETag']
+        self.assertNotEqual(self.client.get('/leads/?sort=name')['ETag'], etag)
+        agent = create_agent(self.organization)
+        self.client.force_login(agent.user)
+        self.assertEqual(self.client.get('/leads/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class FragmentCacheTests(TestCase):
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+        self.agent = create_agent(self.organization)
+        Lead.objects.create(first_name='Ann', last_name='Lee', age=30, organization=self.organization)
+        self.client.force_login(self.user)
+
+    def lead_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in queries if 'FROM "leads_lead"' in query['sql']]
+
+    def test_cached_table_runs_no_lead_queries(self):
+        response, queries = self.lead_queries('/leads/')
+        self.assertTrue(queries)
+        response, queries = self.lead_queries('/leads/')
+        self.assertContains(response, 'Ann')
+        self.assertEqual(queries, [])
+
+    def test_write_misses_the_cached_table(self):
+        self.client.get('/leads/categories/')
+        Category.objects.create(name='Contacted', organization=self.organization)
+        self.assertContains(self.client.get('/leads/categories/'), 'Contacted')
+
+    def test_table_is_cached_per_user(self):
+        self.assertContains(self.client.get('/leads/'), 'Ann')
+        self.client.force_login(self.agent.user)
+        self.assertNotContains(self.client.get('/leads/'), 'Ann')
+
+
+class WorkloadSummaryTests(TestCase):
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+        self.agent = create_agent(self.organization)
+        self.category = Category.objects.create(name='Contacted', organization=self.organization)
+        self.lead = Lead.objects.create(
+            first_name='Ann', last_name='Lee', age=30, agent=self.agent, category=self.category,
+            organization=self.organization,
+        )
+        Lead.objects.create(first_name='Bob', last_name='Ray', age=40, organization=self.organization)
+
+    def assertCells(self, cells):
+        self.assertEqual(workload_cells(self.organization), cells)
+        self.assertEqual(workload_cells(self.organization, use_summary=False), cells)
+
+    def test_lead_changes(self):
+        self.assertCells({(self.agent.pk, self.category.pk): 1, (0, 0): 1})
+        self.lead.agent = None
+        self.lead.save()
+        self.assertCells({(0, self.category.pk): 1, (0, 0): 1})
+        self.lead.delete()
+        self.assertCells({(0, 0): 1})
+
+    def test_deleted_agent_and_category_fold_into_none(self):
+        self.agent.delete()
+        self.assertCells({(0, self.category.pk): 1, (0, 0): 1})
+        self.category.delete()
+        self.assertCells({(0, 0): 2})
+
+    def test_rebuild(self):
+        adjust_workload(self.organization.pk, {(0, 0): 5})
+        rebuild_workload(self.organization)
+        self.assertCells({(self.agent.pk, self.category.pk): 1, (0, 0): 1})
+
+
+class DeletionJobTests(TestCase):
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+        self.agent = create_agent(self.organization)
+        self.category = Category.objects.create(name='Contacted', organization=self.organization)
+        self.leads = [
+            Lead.objects.create(
+                first_name=f'F{index}', last_name='L', age=20, agent=self.agent if index % 2 else None,
+                category=self.category if index < 3 else None, organization=self.organization,
+            )
+            for index in range(5)
+        ]
+        other_user, self.other_organization = create_organizer('other')
+        self.other_lead = Lead.objects.create(first_name='Eve', last_name='L', age=20, organization=self.other_organization)
+        self.client.force_login(self.user)
+
+    def test_selected_leads_are_deleted_right_away(self):
+        selected = [self.leads[0].pk, self.leads[1].pk, self.other_lead.pk]
+        response = self.client.post('/leads/delete/', {'leads': selected})
+        self.assertRedirects(response, '/leads/', fetch_redirect_response=False)
+        self.assertEqual(
+            list(Lead.objects.order_by('id').values_list('id', flat=True)),
+            [lead.pk for lead in self.leads[2:]] + [self.other_lead.pk],
+        )
+        self.assertEqual(Category.objects.get(pk=self.category.pk).lead_count, 1)
+        self.assertEqual(workload_cells(self.organization), workload_cells(self.organization, use_summary=False))
+        self.assertEqual(DeletionJob.objects.get().status, DeletionJob.DONE)
+
+    def test_category_leads_are_deleted_in_chunks(self):
+        self.client.post('/leads/delete/', {'category': self.category.pk})
+        self.assertEqual(Lead.objects.filter(category=self.category).count(), 3)
+        job = DeletionJob.objects.get()
+        run_deletion_job(job, batch_size=2)
+        self.assertEqual((job.status, job.processed), (DeletionJob.DONE, 3))
+        self.assertFalse(Lead.objects.filter(category=self.category).exists())
+        self.assertEqual(Category.objects.get(pk=self.category.pk).lead_count, 0)
+
+    def test_agents_cannot_delete_leads(self):
+        self.client.force_login(self.agent.user)
+        self.client.post('/leads/delete/', {'leads': [self.leads[1].pk]})
+        self.assertFalse(DeletionJob.objects.exists())
+
+    def test_agent_deletion_unassigns_its_leads(self):
+        enqueue_agent_deletion(self.agent)
+        self.assertEqual(run_deletion_jobs(batch_size=1), 1)
+        self.assertFalse(Agent.objects.exists())
+        self.assertEqual(Lead.objects.filter(agent__isnull=False).count(), 0)
+        self.assertEqual(workload_cells(self.organization), workload_cells(self.organization, use_summary=False))
+
+    def test_organization_deletion(self):
+        response = self.client.post('/leads/organization/delete/')
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        self.assertFalse(User.objects.get(pk=self.user.pk).is_active)
+        self.assertNotIn('_auth_user_id', self.client.session)
+        self.assertEqual(run_deletion_jobs(batch_size=2), 1)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(UserProfile.objects.filter(pk=self.organization.pk).exists())
+        self.assertEqual(list(Lead.objects.all()), [self.other_lead])
+        self.assertFalse(Category.objects.exists())
+        self.assertFalse(Agent.objects.exists())
+
+
+class LeadActivityTests(TestCase):
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+        self.lead = Lead.objects.create(first_name='Ann', last_name='Lee', age=30, organization=self.organization)
+        activity_buffer.flush()
+
+    def tearDown(self):
+        activity_buffer.flush()
+
+    def test_new_lead_events_use_the_inserted_ids(self):
+        batch = [
+            Lead(first_name=name, last_name='L', age=20, organization=self.organization) for name in ('Bob', 'Cat')
+        ]
+        Lead.objects.bulk_create(batch)
+        # created after the batch, as by a concurrent request
+        Lead.objects.create(first_name='Dan', last_name='L', age=20, organization=self.organization)
+        events = new_lead_events(self.organization, batch)
+        self.assertEqual(
+            [lead_id for lead_id, kind, value in events],
+            list(Lead.objects.filter(first_name__in=['Bob', 'Cat']).order_by('id').values_list('id', flat=True)),
+        )
+        self.assertEqual([lead.pk for lead in batch], [lead_id for lead_id, _, _ in events])
+
+    def test_transaction_of_the_written_database_decides(self):
+        events = [(self.lead.pk, LeadActivity.ASSIGNED, None)]
+        # 'default' is inside the test's transaction: wait for its commit
+        record_activity(self.organization.pk, events)
+        self.assertEqual(activity_buffer.flush(), 0)
+        # no transaction on 'shard1': buffered right away
+        record_activity(self.organization.pk, events, using='shard1')
+        self.assertEqual(activity_buffer.flush(), 1)
+
+    def test_activity_page_writes_nothing(self):
+        record_activity(self.organization.pk, [(self.lead.pk, LeadActivity.ASSIGNED, None)], using='shard1')
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(f'/leads/{self.lead.pk}/activity/').status_code, 200)
+        self.assertFalse([query['sql'] for query in queries if query['sql'].startswith('INSERT')])
+        self.assertEqual(activity_buffer.flush(), 1)
+
+
+class DuplicateTests(TestCase):
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+        self.agent = create_agent(self.organization)
+        self.category = Category.objects.create(name='Contacted', organization=self.organization)
+
+    def create(self, first_name, last_name, age, **kwargs):
+        return Lead.objects.create(
+            first_name=first_name, last_name=last_name, age=age, organization=self.organization, **kwargs
+        )
+
+    def groups(self):
+        return [[lead.pk for lead in group] for group in find_duplicates(self.organization)]
+
+    def test_ages_across_a_multiple_of_five_are_compared(self):
+        ann = self.create('Ann', 'Lee', 24)
+        other = self.create('ann', 'LEE', 25)
+        self.assertEqual(self.groups(), [[ann.pk, other.pk]])
+
+    def test_ages_within_the_tolerance_chain_into_one_group(self):
+        leads = [self.create('Jon', 'Smith', 30), self.create('John', 'Smith', 32), self.create('Smith', 'John', 34)]
+        self.create('John', 'Smith', 40)
+        self.assertEqual(self.groups(), [[lead.pk for lead in leads]])
+
+    def test_name_numbers_must_match(self):
+        self.create('Test', 'Lead 2', 30)
+        self.create('Test', 'Lead 3', 30)
+        self.assertEqual(self.groups(), [])
+
+    def test_rebuild_drops_stale_keys(self):
+        ann = self.create('Ann', 'Lee', 24)
+        other = self.create('Ann', 'Lee', 25)
+        Lead.objects.filter(pk=other.pk).update(block_key='stale')
+        self.assertEqual(self.groups(), [])
+        self.assertEqual(rebuild_block_keys(self.organization), 2)
+        self.assertEqual(self.groups(), [[ann.pk, other.pk]])
+
+    def test_merge_keeps_the_oldest_lead(self):
+        survivor = self.create('Ann', 'Lee', 30)
+        duplicate = self.create('Ann', 'Lee', 31, agent=self.agent, category=self.category)
+        self.client.force_login(self.user)
+        response = self.client.post('/leads/duplicates/', {'survivor': survivor.pk, 'duplicates': [duplicate.pk]})
+        self.assertRedirects(response, '/leads/duplicates/', fetch_redirect_response=False)
+        self.assertEqual(list(Lead.objects.all()), [survivor])
+        survivor.refresh_from_db()
+        self.assertEqual((survivor.agent, survivor.category), (self.agent, self.category))
+        self.assertEqual(Category.objects.get(pk=self.category.pk).lead_count, 1)
+        self.assertEqual(workload_cells(self.organization), workload_cells(self.organization, use_summary=False))
+
+
+class FailingEmailBackend(BaseEmailBackend):
+
+    def send_messages(self, messages):
+        raise ConnectionError('Mail server down')
+
+
+class LeadExportTests(TestCase):
+
+    def setUp(self):
+        self.user, self.organization = create_organizer()
+        self.agent = create_agent(self.organization)
+        category = Category.objects.create(name='Contacted', organization=self.organization)
+        self.lead = Lead.objects.create(
+            first_name='Ann', last_name='Lee', age=30, agent=self.agent, category=category, organization=self.organization,
+        )
+        Lead.objects.create(first_name='Bob', last_name='Ray', age=40, organization=self.organization)
+        other_user, other_organization = create_organizer('other')
+        Lead.objects.create(first_name='Eve', last_name='Hidden', age=50, organization=other_organization)
+        self.client.force_login(self.user)
+
+    def export(self, format):
+        response = self.client.get(f'/leads/export/?format={format}')
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        response, content = self.export('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(content.splitlines(), [
+            'id,first_name,last_name,age,agent,category',
+            f'{self.lead.pk},Ann,Lee,30,agent,Contacted',
+            f'{self.lead.pk + 1},Bob,Ray,40,,',
+        ])
+
+    def test_jsonl(self):
+        response, content = self.export('jsonl')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row['first_name'] for row in rows], ['Ann', 'Bob'])
+        self.assertEqual((rows[0]['agent'], rows[0]['category']), ('agent', 'Contacted'))
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get('/leads/export/?format=xml').status_code, 400)
+
+    def test_agents_cannot_export(self):
+        self.client.force_login(self.agent.user)
+        self.assertEqual(self.client.get('/leads/export/').status_code, 302)
+
+
+class ShardedLeadExportTests(TestCase):
+    databases = {'default', 'shard1'}
+
+    def test_export_reads_the_shard_it_was_started_on(self):
+        user, organization = create_organizer()
+        agent = create_agent(organization)
+        Lead.objects.create(first_name='Ann', last_name='Lee', age=30, agent=agent, organization=organization)
+        move_organization(organization, 'shard1', grace=0)
+        with shard_context('shard1'):
+            lines = export_leads(Lead.objects.all(), 'csv')
+        # streamed after the routing context is gone, like a response body
+        self.assertEqual(''.join(lines).splitlines()[1:], [f'{Lead.objects.using("shard1").get().pk},Ann,Lee,30,agent,'])
@@ -2,7 +2,9 @@ from django.urls import path
 from .views import (
     lead_list, lead_detail, lead_create, lead_update, lead_delete, 
     LeadListView, LeadDetailView, LeadCreateView, LeadUpdateView, LeadDeleteView, 
-    AssignAgentView, CategoryListView, CategoryDetailView, LeadCategoryUpdateView
+    AssignAgentView, CategoryListView, CategoryDetailView, LeadCategoryUpdateView,
+    LeadImportView, LeadExportView, BulkAssignAgentView, LeadSearchView, LeadActivityView,
+    LeadDuplicatesView, BulkLeadDeleteView, OrganizationDeleteView
 )
 
 
@@ -12,12 +14,20 @@ urlpatterns = [
     #path('', lead_list, name='lead-list'),
     path('', LeadListView.as_view(), name='lead-list'),
     path('<int:pk>/', LeadDetailView.as_view(), name='lead-detail'),
+    path('<int:pk>/activity/', LeadActivityView.as_view(), name='lead-activity'),
     path('<int:pk>/update/', LeadUpdateView.as_view(), name='lead-update'),
     path('<int:pk>/delete/', LeadDeleteView.as_view(), name='lead-delete'),
     path('<int:pk>/assign-agent/', AssignAgentView.as_view(), name='assign-agent'),
+    path('assign-agent/', BulkAssignAgentView.as_view(), name='bulk-assign-agent'),
+    path('delete/', BulkLeadDeleteView.as_view(), name='bulk-lead-delete'),
     path('create/', LeadCreateView.as_view(), name='lead-create'),
+    path('import/', LeadImportView.as_view(), name='lead-import'),
+    path('export/', LeadExportView.as_view(), name='lead-export'),
+    path('search/', LeadSearchView.as_view(), name='lead-search'),
+    path('duplicates/', LeadDuplicatesView.as_view(), name='lead-duplicates'),
     path('categories/', CategoryListView.as_view(), name='category-list'),
     path('categories/<int:pk>', CategoryDetailView.as_view(), name='category-detail'),
     path('<int:pk>/category/', LeadCategoryUpdateView.as_view(), name='lead-category-update'),
+    path('organization/delete/', OrganizationDeleteView.as_view(), name='organization-delete'),
     
 ]
\ No newline at end of file
@@ -1,11 +1,28 @@
-from django.shortcuts import render, redirect, reverse
-from django.core.mail import send_mail
-from django.http import HttpResponse
-from .models import Lead, Agent, Category
-from .forms import LeadForm, LeadModelForm, SignUpForm, AssignAgentForm, LeadCategoryUpdateForm
+from django.shortcuts import render, redirect, reverse, get_object_or_404
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from .models import Lead, Agent, Category, LeadActivity, User
+from .forms import (
+    LeadForm, LeadModelForm, SignUpForm, AssignAgentForm, LeadCategoryUpdateForm, LeadImportForm,
+    BulkAssignAgentForm, BulkLeadDeleteForm, LeadMergeForm
+)
+from .activity import lead_timeline
+from .choices import agent_choices
+from .counters import category_counts
+from .deletion import enqueue_lead_deletion, enqueue_organization_deletion, run_deletion_job
+from .distribution import assign_leads, distribute_leads
+from .duplicates import find_duplicates, merge_leads
+from .exporters import CONTENT_TYPES, export_leads
+from .freshness import ConditionalGetMixin, FragmentCacheMixin
+from .importers import LeadImporter, detect_format, open_text
 from django.views import generic
+from django.contrib.auth import logout
 from django.contrib.auth.mixins import LoginRequiredMixin
 from agents.mixins import OrganizerAndLoginRequiredMixin
+from .mail import queue_mail
+from .pagination import KeysetPaginationMixin
+from .search import search_leads
+from .sharding import shard_atomic
 
 class LandingPageView(generic.TemplateView):
     template_name = 'landing.html'
@@ -13,40 +30,55 @@ class LandingPageView(generic.TemplateView):
 def landing_page(request):
     return render(request, 'landing.html')
 
-class LeadListView(LoginRequiredMixin, generic.ListView):
+class LeadListView(LoginRequiredMixin, ConditionalGetMixin, FragmentCacheMixin, KeysetPaginationMixin, generic.ListView):
     template_name = 'leads/lead_list.html'
     context_object_name = "leads"
+    paginate_by = 20
+    # highest score first (see leads/scoring.py), on the (organization, score) index
+    keyset_ordering = ('-score', '-id')
+    unassigned_cursor_kwarg = "unassigned_after"
 
     def get_queryset(self):
-        user = self.request.user
+        tenant = self.request.tenant
 
-        #initial queryset of leads for the entire organization
-        if user.is_organizor:
-            queryset = Lead.objects.filter(
-                organization=user.userprofile, 
-                agent__isnull=False
-            )
-        else:
-            queryset = Lead.objects.filter(organization=user.agent.organization)
-            #filter for the agent
-            queryset = queryset.filter(agent__user=user)
+        #leads of the organization, or only the agent's own leads for agents
+        queryset = Lead.objects.for_tenant(tenant)
+        if tenant.is_organizor:
+            queryset = queryset.filter(agent__isnull=False)
         return queryset
 
     #Way to pass context in the Class Based Views
     def get_context_data(self, **kwargs):
         context = super(LeadListView, self).get_context_data(**kwargs)
-        user = self.request.user
-        if user.is_organizor:
-            queryset = Lead.objects.filter(
-                organization=user.userprofile, 
-                agent__isnull=True
-            )
+        context.update({
+            "leads_links": self.get_page_links(context["page_obj"], self.cursor_kwarg)
+        })
+        tenant = self.request.tenant
+        if tenant.is_organizor:
+            queryset = Lead.objects.for_tenant(tenant).filter(agent__isnull=True)
+            # paged independently of the assigned leads, with its own cursor
+            unassigned_leads = self.get_keyset_page(queryset, self.unassigned_cursor_kwarg)
             context.update({
-                "unassigned_leads": queryset
+                "unassigned_leads": unassigned_leads,
+                "unassigned_links": self.get_page_links(unassigned_leads, self.unassigned_cursor_kwarg),
             })
         return context
 
 
+class LeadSearchView(LoginRequiredMixin, generic.TemplateView):
+    template_name = 'leads/lead_search.html'
+    results_limit = 20
+
+    def get_context_data(self, **kwargs):
+        context = super(LeadSearchView, self).get_context_data(**kwargs)
+        query = self.request.GET.get('q', '').strip()
+        context.update({
+            "query": query,
+            "leads": search_leads(self.request.tenant, query, limit=self.results_limit) if query else [],
+        })
+        return context
+
+
 def lead_list(request):
     #return HttpResponse("Hello World")
     leads = Lead.objects.all()
@@ -55,20 +87,45 @@ def lead_list(request):
     }
     return render(request, 'leads/lead_list.html', context)
 
-class LeadDetailView(LoginRequiredMixin, generic.DetailView):
+class LeadDetailView(LoginRequiredMixin, ConditionalGetMixin, generic.DetailView):
     template_name = 'leads/lead_detail.html'
     context_object_name = 'lead'
 
     def get_queryset(self):
-        user = self.request.user
-        #initial queryset of leads for the entire organization
-        if user.is_organizor:
-            queryset = Lead.objects.filter(organization=user.userprofile)
-        else:
-            queryset = Lead.objects.filter(organization=user.agent.organization)
-            #filter for the agent
-            queryset = queryset.filter(agent__user=user)
-        return queryset
+        return Lead.objects.for_tenant(self.request.tenant)
+
+
+class LeadActivityView(LoginRequiredMixin, KeysetPaginationMixin, generic.DetailView):
+    template_name = 'leads/lead_activity.html'
+    context_object_name = 'lead'
+    keyset_ordering = ('-ts', '-id')
+
+    def get_queryset(self):
+        return Lead.objects.for_tenant(self.request.tenant)
+
+    def get_context_data(self, **kwargs):
+        context = super(LeadActivityView, self).get_context_data(**kwargs)
+        lead = self.object
+        # events recorded outside a transaction appear once their process
+        # flushes them, within ACTIVITY_FLUSH_INTERVAL
+        page = self.get_keyset_page(lead_timeline(lead.organization_id, lead.pk), self.cursor_kwarg)
+        events = list(page)
+        agents = dict(agent_choices(lead.organization_id))
+        categories = dict(Category.objects.for_organization(lead.organization_id).values_list('id', 'name'))
+        actors = dict(
+            User.objects.filter(id__in={event.actor_key for event in events}).values_list('id', 'username')
+        )
+        for event in events:
+            event.actor = actors.get(event.actor_key)
+            if event.kind == LeadActivity.ASSIGNED:
+                event.target = agents.get(event.value, "a removed agent") if event.value else "no agent"
+            elif event.kind == LeadActivity.CATEGORIZED:
+                event.target = categories.get(event.value, "a removed category") if event.value else "no category"
+        context.update({
+            "events": events,
+            "events_links": self.get_page_links(page, self.cursor_kwarg),
+        })
+        return context
 
 
 def lead_detail(request, pk):
@@ -83,20 +140,63 @@ class LeadCreateView(OrganizerAndLoginRequiredMixin, generic.CreateView):
     template_name = 'leads/lead_create.html'
     form_class = LeadModelForm
 
+    def get_form_kwargs(self, **kwargs):
+        kwargs = super(LeadCreateView, self).get_form_kwargs(**kwargs)
+        kwargs.update({
+            "organization": self.request.tenant.organization
+        })
+        return kwargs
+
     def get_success_url(self):
         return reverse('leads:lead-list')
 
     def form_valid(self, form):
-        # TO DO Send email
-        lead = form.save(commit=False)
-        lead.organization = self.request.user.userprofile
-        lead.save()
-        send_mail(
-            subject='New Lead has been created', 
-            message='Go to the site to see the newly created lead.\n\nThank You,\nCRM Admin',
-            from_email='test@example.com', recipient_list=['test2@example.com']
-            )
-        return super(LeadCreateView, self).form_valid(form)
+        form.instance.organization = self.request.tenant.organization
+        # the notification is queued in the same transaction as the lead and
+        # sent by the send_queued_mail worker, off the request path
+        with shard_atomic(self.request.tenant.organization):
+            response = super(LeadCreateView, self).form_valid(form)
+            if self.object.agent_id is None and settings.LEAD_AUTO_DISTRIBUTION:
+                distribute_leads(
+                    self.request.tenant.organization,
+                    settings.LEAD_AUTO_DISTRIBUTION,
+                    lead_ids=[self.object.pk],
+                )
+            queue_mail(
+                subject='New Lead has been created', 
+                message='Go to the site to see the newly created lead.\n\nThank You,\nCRM Admin',
+                from_email='test@example.com', recipient_list=['test2@example.com']
+                )
+        return response
+
+
+class LeadImportView(OrganizerAndLoginRequiredMixin, generic.FormView):
+    template_name = 'leads/lead_import.html'
+    form_class = LeadImportForm
+
+    def form_valid(self, form):
+        upload = form.cleaned_data["file"]
+        format = form.cleaned_data["format"] or detect_format(upload.name)
+        importer = LeadImporter(self.request.tenant.organization)
+        upload.open()
+        result = importer.run(open_text(upload.file), format)
+        return self.render_to_response(self.get_context_data(form=self.form_class(), result=result))
+
+
+class LeadExportView(OrganizerAndLoginRequiredMixin, generic.View):
+
+    def get(self, request, *args, **kwargs):
+        format = request.GET.get("format", "csv")
+        if format not in CONTENT_TYPES:
+            return HttpResponseBadRequest("Unknown export format")
+        # rows are streamed as they are read, so memory stays flat and the
+        # first bytes go out before the whole table has been read
+        response = StreamingHttpResponse(
+            export_leads(Lead.objects.for_tenant(request.tenant), format),
+            content_type=CONTENT_TYPES[format],
+        )
+        response["Content-Disposition"] = f'attachment; filename="leads.{format}"'
+        return response
 
 
 def lead_create(request):
@@ -117,11 +217,14 @@ class LeadUpdateView(OrganizerAndLoginRequiredMixin, generic.UpdateView):
     form_class = LeadModelForm
 
     def get_queryset(self):
-        user = self.request.user
-        #initial queryset of leads for the entire organization
-        if user.is_organizor:
-            queryset = Lead.objects.filter(organization=user.userprofile)
-        return queryset
+        return Lead.objects.for_tenant(self.request.tenant)
+
+    def get_form_kwargs(self, **kwargs):
+        kwargs = super(LeadUpdateView, self).get_form_kwargs(**kwargs)
+        kwargs.update({
+            "organization": self.request.tenant.organization
+        })
+        return kwargs
 
     def get_success_url(self):
         return reverse('leads:lead-list')
@@ -146,11 +249,7 @@ class LeadDeleteView(OrganizerAndLoginRequiredMixin, generic.DeleteView):
     template_name = 'leads/lead_delete.html'
     
     def get_queryset(self):
-        user = self.request.user
-        #initial queryset of leads for the entire organization
-        if user.is_organizor:
-            queryset = Lead.objects.filter(organization=user.userprofile)
-        return queryset
+        return Lead.objects.for_tenant(self.request.tenant)
 
     def get_success_url(self):
         return reverse('leads:lead-list')
@@ -185,73 +284,162 @@ class AssignAgentView(OrganizerAndLoginRequiredMixin, generic.FormView):
     def form_valid(self, form):
         #print(form.data)
         agent = form.cleaned_data["agent"]
-        lead = Lead.objects.get(id=self.kwargs["pk"])
+        lead = get_object_or_404(Lead.objects.for_tenant(self.request.tenant), id=self.kwargs["pk"])
         lead.agent = agent
         lead.save()
         return super(AssignAgentView, self).form_valid(form)
 
 
 
-class CategoryListView(LoginRequiredMixin, generic.ListView):
+class BulkAssignAgentView(OrganizerAndLoginRequiredMixin, generic.FormView):
+    template_name = 'leads/bulk_assign_agent.html'
+    form_class = BulkAssignAgentForm
+
+    def get_initial(self):
+        return {
+            "leads": self.request.GET.getlist("leads"),
+            "all_unassigned": bool(self.request.GET.get("all_unassigned")),
+        }
+
+    def get_form_kwargs(self, **kwargs):
+        kwargs = super(BulkAssignAgentView, self).get_form_kwargs(**kwargs)
+        kwargs.update({
+            "request": self.request
+        })
+        return kwargs
+
+    def get_success_url(self):
+        return reverse('leads:lead-list')
+
+    def form_valid(self, form):
+        # one UPDATE for the whole selection instead of a save per lead
+        lead_ids = None if form.cleaned_data["all_unassigned"] else form.cleaned_data["leads"]
+        assign_leads(self.request.tenant.organization, form.cleaned_data["agent"], lead_ids)
+        return super(BulkAssignAgentView, self).form_valid(form)
+
+
+class BulkLeadDeleteView(OrganizerAndLoginRequiredMixin, generic.FormView):
+    template_name = 'leads/bulk_lead_delete.html'
+    form_class = BulkLeadDeleteForm
+
+    def get_initial(self):
+        return {
+            "leads": self.request.GET.getlist("leads"),
+            "category": self.request.GET.get("category"),
+        }
+
+    def get_form_kwargs(self, **kwargs):
+        kwargs = super(BulkLeadDeleteView, self).get_form_kwargs(**kwargs)
+        kwargs.update({
+            "request": self.request
+        })
+        return kwargs
+
+    def get_success_url(self):
+        return reverse('leads:lead-list')
+
+    def form_valid(self, form):
+        lead_ids = form.cleaned_data["leads"] or None
+        category = form.cleaned_data["category"]
+        job = enqueue_lead_deletion(self.request.tenant.organization, lead_ids, category)
+        # a selection that fits in one chunk goes right away; a category is
+        # left to run_deletion_jobs, whatever its size
+        if category is None and len(lead_ids) <= settings.DELETION_BATCH_SIZE:
+            run_deletion_job(job)
+        return super(BulkLeadDeleteView, self).form_valid(form)
+
+
+class OrganizationDeleteView(OrganizerAndLoginRequiredMixin, generic.TemplateView):
+    template_name = 'leads/organization_delete.html'
+
+    def post(self, request, *args, **kwargs):
+        # hidden and logged out now; run_deletion_jobs removes the rows
+        enqueue_organization_deletion(request.tenant.organization)
+        logout(request)
+        return redirect('landing-page')
+
+
+class LeadDuplicatesView(OrganizerAndLoginRequiredMixin, generic.FormView):
+    template_name = 'leads/lead_duplicates.html'
+    form_class = LeadMergeForm
+    # groups listed per page; merging some shows the next ones
+    max_groups = 50
+
+    def get_success_url(self):
+        return reverse('leads:lead-duplicates')
+
+    def get_context_data(self, **kwargs):
+        context = super(LeadDuplicatesView, self).get_context_data(**kwargs)
+        groups = []
+        for group in find_duplicates(self.request.tenant.organization):
+            groups.append(group)
+            if len(groups) == self.max_groups:
+                break
+        context["groups"] = groups
+        return context
+
+    def form_valid(self, form):
+        try:
+            merge_leads(
+                self.request.tenant.organization, form.cleaned_data["survivor"], form.cleaned_data["duplicates"]
+            )
+        except Lead.DoesNotExist:
+            raise Http404("No such lead")
+        return super(LeadDuplicatesView, self).form_valid(form)
+
+
+class CategoryListView(LoginRequiredMixin, ConditionalGetMixin, FragmentCacheMixin, generic.ListView):
     template_name = "leads/category_list.html"
     context_object_name = "category_list"
 
     def get_context_data(self, **kwargs):
         context = super(CategoryListView, self).get_context_data(**kwargs)
-        user = self.request.user
-        
-        if user.is_organizor:
-            queryset = Lead.objects.filter(
-                organization=user.userprofile
-            )
+        # category counts cover the whole organization, also for agents
+        organization = self.request.tenant.organization
+
+        if settings.LEAD_CATEGORY_COUNTERS:
+            # categories and the organization carry maintained counts
+            unassigned_lead_count = organization.uncategorized_lead_count
         else:
-            queryset = Lead.objects.filter(
-                organization=user.agent.organization
-                )
+            counts = category_counts(Lead.objects.for_organization(organization))
+            for category in context["category_list"]:
+                category.lead_count = counts.get(category.pk, 0)
+            unassigned_lead_count = counts.get(None, 0)
 
         context.update({
-            "unassigned_lead_count": queryset.filter(category__isnull=True).count()
+            "unassigned_lead_count": unassigned_lead_count
         })
         return context
          
     def get_queryset(self):
-        user = self.request.user
-        if user.is_organizor:
-            queryset = Category.objects.filter(
-                organization=user.userprofile
-            )
-        else:
-            queryset = Category.objects.filter(organization=user.agent.organization)
-        return queryset
+        return Category.objects.for_tenant(self.request.tenant)
 
 
-class CategoryDetailView(LoginRequiredMixin, generic.DetailView):
+class CategoryDetailView(LoginRequiredMixin, ConditionalGetMixin, FragmentCacheMixin, KeysetPaginationMixin, generic.DetailView):
     template_name = "leads/category_detail.html"
     context_object_name = "category"
 
-    '''    
     def get_context_data(self, **kwargs):
         context = super(CategoryDetailView, self).get_context_data(**kwargs)
-        #leads = self.get_object.lead_set.all()
-        leads = self.get_object().leads.all()
+        category = self.object
+        # only the columns the template renders, one page at a time
+        leads = Lead.objects.for_organization(category.organization_id).filter(
+            category=category
+        ).values("id", "first_name", "last_name")
+        page = self.get_keyset_page(leads, self.cursor_kwarg)
+        if settings.LEAD_CATEGORY_COUNTERS:
+            lead_count = category.lead_count
+        else:
+            lead_count = leads.count()
         context.update({
-            "leads":leads
+            "leads": page,
+            "leads_links": self.get_page_links(page, self.cursor_kwarg),
+            "lead_count": lead_count,
         })
-        return context    
-    '''
+        return context
 
     def get_queryset(self):
-        user = self.request.user
-        # initial queryset of leads for the entire organisation
-        if user.is_organizor:
-            queryset = Category.objects.filter(
-                organization=user.userprofile
-            )
-        else:
-            queryset = Category.objects.filter(
-                organization=user.agent.organization
-            )
-        return queryset
+        return Category.objects.for_tenant(self.request.tenant)
 
 
 class LeadCategoryUpdateView(LoginRequiredMixin, generic.UpdateView):
@@ -259,15 +447,7 @@ class LeadCategoryUpdateView(LoginRequiredMixin, generic.UpdateView):
     form_class = LeadCategoryUpdateForm
 
     def get_queryset(self):
-        user = self.request.user
-        # initial queryset of leads for the entire organisation
-        if user.is_organizor:
-            queryset = Lead.objects.filter(organization=user.userprofile)
-        else:
-            queryset = Lead.objects.filter(organization=user.agent.organization)
-            # filter for the agent that is logged in
-            queryset = queryset.filter(agent__user=user)
-        return queryset
+        return Lead.objects.for_tenant(self.request.tenant)
 
     def get_success_url(self):
         return reverse("leads:lead-detail", kwargs={"pk": self.get_object().id})
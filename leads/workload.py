@@ -0,0 +1,159 @@
+"""
+Leads per agent and category.
+
+lead_cells counts an organization's leads per (agent, category) cell with
+a single GROUP BY. For large organizations WorkloadSummary keeps the same
+cells up to date incrementally: the Lead signals adjust them on create,
+reassignment, recategorization and delete, and the bulk paths (importer,
+bulk assignment, distribution) pass their deltas to adjust_workload. The
+dashboard then reads a number of rows bounded by agents x categories,
+whatever the number of leads.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+
+from .models import Lead, WorkloadSummary
+
+# WorkloadSummary key of "no agent" and "no category"
+NONE_KEY = 0
+
+
+def cell(agent_id, category_id):
+    return (agent_id or NONE_KEY, category_id or NONE_KEY)
+
+
+def lead_cells(leads):
+    """{(agent_key, category_key): count} of `leads`, with one GROUP BY."""
+    return {
+        cell(agent_id, category_id): count
+        for agent_id, category_id, count in (
+            leads.order_by().values_list('agent', 'category').annotate(count=Count('id'))
+        )
+    }
+
+
+def new_lead_cells(leads):
+    """Cell deltas for leads inserted without signals (bulk_create)."""
+    return Counter(cell(lead.agent_id, lead.category_id) for lead in leads)
+
+
+def reassign_cells(cells, agent_id):
+    """Cell deltas for moving the leads counted in `cells` to `agent_id`."""
+    deltas = Counter()
+    for (agent_key, category_key), count in cells.items():
+        deltas[(agent_key, category_key)] -= count
+        deltas[cell(agent_id, category_key)] += count
+    return deltas
+
+
+def adjust_workload(organization_id, deltas):
+    """
+    Apply {(agent_key, category_key): change} to the organization's
+    summary with one upsert per changed cell.
+    """
+    table = WorkloadSummary._meta.db_table
+    rows = [
+        (organization_id, agent_key, category_key, delta)
+        for (agent_key, category_key), delta in deltas.items()
+        if delta
+    ]
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {table} (organization_key, agent_key, category_key, lead_count) "
+            f"VALUES (%s, %s, %s, %s) "
+            f"ON CONFLICT (organization_key, agent_key, category_key) "
+            f"DO UPDATE SET lead_count = {table}.lead_count + excluded.lead_count",
+            rows,
+        )
+
+
+def fold_workload(organization_id, agent_key=None, category_key=None):
+    """
+    Move the cells of a deleted agent or category to the "none" key, like
+    the SET_NULL the database applied to their leads.
+    """
+    cells = WorkloadSummary.objects.filter(organization_key=organization_id)
+    if agent_key is not None:
+        cells = cells.filter(agent_key=agent_key)
+    else:
+        cells = cells.filter(category_key=category_key)
+    deltas = Counter()
+    for summary in cells:
+        folded = (NONE_KEY, summary.category_key) if agent_key is not None else (summary.agent_key, NONE_KEY)
+        deltas[folded] += summary.lead_count
+    with transaction.atomic():
+        cells.delete()
+        adjust_workload(organization_id, deltas)
+
+
+def delete_workload(organization_id):
+    WorkloadSummary.objects.filter(organization_key=organization_id).delete()
+
+
+def rebuild_workload(organization=None):
+    """Recompute the summary of one or every organization from the leads table."""
+    summaries = WorkloadSummary.objects.all()
+    if organization is not None:
+        lead_sets = [Lead.objects.for_organization(organization)]
+        summaries = summaries.filter(organization_key=organization.pk)
+    else:
+        lead_sets = [Lead.objects.using(shard) for shard in settings.SHARDS]
+    rows = [
+        row
+        for leads in lead_sets
+        for row in leads.order_by().values_list('organization', 'agent', 'category').annotate(count=Count('id'))
+    ]
+    with transaction.atomic():
+        summaries.delete()
+        WorkloadSummary.objects.bulk_create([
+            WorkloadSummary(
+                organization_key=organization_id,
+                agent_key=agent_id or NONE_KEY,
+                category_key=category_id or NONE_KEY,
+                lead_count=count,
+            )
+            for organization_id, agent_id, category_id, count in rows
+        ], batch_size=1000)
+
+
+def workload_cells(organization, use_summary=True):
+    """The organization's cells, from the summary table or the leads table."""
+    if use_summary:
+        return {
+            (agent_key, category_key): count
+            for agent_key, category_key, count in (
+                WorkloadSummary.objects.filter(organization_key=organization.pk, lead_count__gt=0)
+                .values_list('agent_key', 'category_key', 'lead_count')
+            )
+        }
+    return lead_cells(Lead.objects.for_organization(organization))
+
+
+def agent_lead_counts(organization_id):
+    """{agent_id: leads} of the organization from the summary, reading no leads."""
+    counts = Counter()
+    for agent_key, count in (
+        WorkloadSummary.objects.filter(organization_key=organization_id).exclude(agent_key=NONE_KEY)
+        .values_list('agent_key', 'lead_count')
+    ):
+        counts[agent_key] += count
+    return counts
+
+
+def workload_table(cells, agents, categories):
+    """
+    Rows of the dashboard: one per agent (id, label) plus the unassigned
+    backlog, each with its count per category (plus uncategorized) and total.
+    """
+    columns = [category.pk for category in categories] + [NONE_KEY]
+    rows = []
+    for agent_key, label in list(agents) + [(NONE_KEY, None)]:
+        counts = [cells.get((agent_key, category_key), 0) for category_key in columns]
+        rows.append({"agent_id": agent_key or None, "label": label, "counts": counts, "total": sum(counts)})
+    totals = [sum(row["counts"][position] for row in rows) for position in range(len(columns))]
+    return rows, totals
@@ -6,7 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'crm.settings')
+    # the tests run with an extra shard, see crm/test_settings.py
+    settings_module = 'crm.test_settings' if sys.argv[1:2] == ['test'] else 'crm.settings'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc: